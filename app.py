@@ -1,6 +1,11 @@
+import asyncio
 import os
 import uvicorn
+from core import metrics
 from core.broadcast_strategy import context
+from core.compression import uvicorn_options
+from core.connection_manager import ConnectionManager
+from core.frames import ProtocolScopeMiddleware
 from core.shutdown import GracefulShutdown
 from logger import setup_logging
 from fastapi import FastAPI
@@ -10,6 +15,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 app = FastAPI()
+app.add_middleware(ProtocolScopeMiddleware)
 add_api_websocket_rout(app)
 
 workers = int(os.getenv("UVICORN_WORKERS", 1))
@@ -18,7 +24,13 @@ workers = int(os.getenv("UVICORN_WORKERS", 1))
 async def on_startup():
     setup_logging()
     context.start()
+    asyncio.create_task(metrics.monitor_event_loop())
+    if ConnectionManager().keepalive.enabled:
+        asyncio.create_task(ConnectionManager().keepalive.run())
     shutdown_handler = GracefulShutdown()
 
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, workers=workers)
\ No newline at end of file
+    # the scheduler-driven keepalive replaces uvicorn's ping task per connection
+    ws_ping_interval = None if float(os.getenv("KEEPALIVE_INTERVAL", 20)) > 0 else 20.0
+    uvicorn.run("app:app", host="0.0.0.0", port=8000, workers=workers, ws_ping_interval=ws_ping_interval,
+                **uvicorn_options())
\ No newline at end of file
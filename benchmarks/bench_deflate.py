@@ -0,0 +1,114 @@
+"""
+    CPU and memory per 10k-recipient broadcast with permessage-deflate.
+
+    - uncompressed: one prepared frame shared by every recipient (no extension).
+    - per connection: uvicorn's default deflate with context takeover (window 12, memLevel 5),
+      every recipient's PerMessageDeflate compresses the message and keeps its zlib contexts between messages.
+    - shared: WS_COMPRESSION=shared, deflate without context takeover; the broadcast is deflated once
+      (core.frames.PreparedMessage.frame_for) and the compressed frame is shared by every recipient.
+    CPU is process time per broadcast, memory is what the recipients' compression state holds between
+    broadcasts (tracemalloc, zlib allocations included) and wire bytes are the frame size per recipient.
+    Transports are stubs, so only compression and framing are measured.
+
+    Run from the repository root:
+        python -m benchmarks.bench_deflate
+"""
+import gc
+import json
+import time
+import tracemalloc
+
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+from websockets.frames import Frame, Opcode
+
+from core.compression import WINDOW_BITS
+from core.frames import DEFLATE_MEM_LEVEL, PreparedMessage
+
+RECIPIENTS = 10_000
+PAYLOAD_SIZES = (512, 4 * 1024, 64 * 1024)
+ROUNDS = 3
+
+
+class StubTransport:
+    __slots__ = ("written",)
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+
+def payload(size: int) -> str:
+    items, length = [], 0
+    while length < size:
+        item = json.dumps({"id": len(items), "symbol": f"S{len(items) % 97}", "price": len(items) * 1.25})
+        items.append(item)
+        length += len(item) + 1
+    return ",".join(items)[:size]
+
+
+def extension(no_context_takeover: bool) -> PerMessageDeflate:
+    return PerMessageDeflate(no_context_takeover, no_context_takeover, WINDOW_BITS, WINDOW_BITS,
+                             {"memLevel": DEFLATE_MEM_LEVEL})
+
+
+def state_bytes(make) -> float:
+    """
+        Memory the recipients' compression state keeps between broadcasts, per 10k recipients
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    state = [make() for _ in range(RECIPIENTS)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del state
+    return used
+
+
+def uncompressed(message, transports, extensions):
+    message = PreparedMessage(message)
+    for transport in transports:
+        transport.write(message.frame)
+
+
+def per_connection(message, transports, extensions):
+    data = message.encode("utf-8")
+    for transport, deflate in zip(transports, extensions):
+        transport.write(Frame(Opcode.TEXT, data).serialize(mask=False, extensions=[deflate]))
+
+
+def shared(message, transports, extensions):
+    message = PreparedMessage(message)
+    for transport in transports:
+        transport.write(message.frame_for(WINDOW_BITS))
+
+
+def measure(fn, message, extensions):
+    transports = [StubTransport() for _ in range(RECIPIENTS)]
+    t0 = time.process_time()
+    for _ in range(ROUNDS):
+        fn(message, transports, extensions)
+    cpu = (time.process_time() - t0) / ROUNDS
+    return cpu, transports[0].written / ROUNDS
+
+
+def main():
+    print(f"{RECIPIENTS} recipients, compression state kept between broadcasts:")
+    print(f"  uncompressed   {0:>8.1f} MB")
+    print(f"  per connection {state_bytes(lambda: extension(False)) / 2 ** 20:>8.1f} MB")
+    print(f"  shared         {state_bytes(lambda: extension(True)) / 2 ** 20:>8.1f} MB")
+    print()
+
+    contexts = [extension(False) for _ in range(RECIPIENTS)]
+    print("CPU ms per broadcast / bytes on the wire per recipient")
+    print(f"{'payload bytes':>14} {'uncompressed':>20} {'per connection':>20} {'shared':>20}")
+    for size in PAYLOAD_SIZES:
+        message = payload(size)
+        row = [measure(fn, message, contexts) for fn in (uncompressed, per_connection, shared)]
+        print(f"{size:>14}" + "".join(f"{cpu * 1000:>11.2f} / {wire:>6.0f}" for cpu, wire in row))
+
+
+if __name__ == "__main__":
+    main()
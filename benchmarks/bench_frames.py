@@ -0,0 +1,62 @@
+"""
+    CPU per 10k-recipient broadcast: per-recipient framing vs one prepared frame.
+
+    - per recipient: what send_text() costs us per socket, the str is encoded to UTF-8 and
+      a websockets Frame is built and serialized for every recipient.
+    - prepared: core.frames.PreparedMessage encodes the frame once and the same bytes
+      are written to every transport.
+    Transports are stubs, so only encoding and framing are measured.
+
+    Run from the repository root:
+        python -m benchmarks.bench_frames
+"""
+import time
+
+from websockets.frames import Frame, Opcode
+
+from core.frames import PreparedMessage
+
+RECIPIENTS = 10_000
+PAYLOAD_SIZES = (19, 1024, 16 * 1024, 64 * 1024)
+ROUNDS = 5
+
+
+class StubTransport:
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+
+def per_recipient(message, transports):
+    for transport in transports:
+        transport.write(Frame(Opcode.TEXT, message.encode("utf-8")).serialize(mask=False, extensions=[]))
+
+
+def prepared(message, transports):
+    message = PreparedMessage(message)
+    for transport in transports:
+        transport.write(message.frame)
+
+
+def measure(fn, message, transports):
+    t0 = time.process_time()
+    for _ in range(ROUNDS):
+        fn(message, transports)
+    return (time.process_time() - t0) / ROUNDS
+
+
+def main():
+    transports = [StubTransport() for _ in range(RECIPIENTS)]
+    print(f"{RECIPIENTS} recipients, CPU ms per broadcast")
+    print(f"{'payload bytes':>14} {'per recipient':>14} {'prepared':>10} {'speedup':>8}")
+    for size in PAYLOAD_SIZES:
+        message = "x" * size
+        before = measure(per_recipient, message, transports)
+        after = measure(prepared, message, transports)
+        print(f"{size:>14} {before * 1000:>14.2f} {after * 1000:>10.2f} {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+    Event-loop time spent on logging for one 20k-recipient broadcast.
+
+    - sync per recipient: the old behaviour, an f-string INFO line per recipient written by a StreamHandler
+      on the calling thread.
+    - queue per recipient: the same lines through setup_logging()'s queue handler, formatted and written
+      by the listener thread.
+    - summary: one aggregated line per fan-out plus sampled per-recipient debug events (1 in 1000).
+    Only the time on the calling thread is measured; that is what stalls the event loop.
+    Output goes to a temporary file so the numbers do not depend on the terminal.
+
+    Run from the repository root:
+        python -m benchmarks.bench_logging
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import logger as logging_setup
+from logger import Sampler, setup_logging
+
+RECIPIENTS = 20_000
+
+
+class FakeWebSocket:
+    pass
+
+
+def sync_per_recipient(log, sockets):
+    for ws in sockets:
+        log.info(f"[{os.getpid()}] Sent message to: {ws}")
+
+
+def lazy_per_recipient(log, sockets):
+    for ws in sockets:
+        log.info("[%s] Sent message to: %r", os.getpid(), ws)
+
+
+def summary(log, sockets):
+    sampler = Sampler(1000)
+    for ws in sockets:
+        if sampler.hit():
+            log.debug("[%s] Sent message to: %r", os.getpid(), ws)
+    log.info("[%s] Fan-out of %r to %d sockets: queued %d, failed %d in %.1f ms",
+             os.getpid(), "Scheduled broadcast", len(sockets), len(sockets), 0, 0.0)
+
+
+def measure(fn, log, sockets):
+    started = time.perf_counter()
+    fn(log, sockets)
+    return time.perf_counter() - started
+
+
+def main():
+    sockets = [FakeWebSocket() for _ in range(RECIPIENTS)]
+    stdout = sys.stdout
+    with tempfile.TemporaryFile("w") as sink:
+        sys.stdout = sink
+        try:
+            setup_logging(use_queue=False)
+            log = logging.getLogger("socket_logger")
+            sync = measure(sync_per_recipient, log, sockets)
+
+            setup_logging(use_queue=True)
+            log = logging.getLogger("socket_logger")
+            queued = measure(lazy_per_recipient, log, sockets)
+            summarised = measure(summary, log, sockets)
+            logging_setup.stop_logging()
+        finally:
+            sys.stdout = stdout
+
+    print(f"{RECIPIENTS} recipients, event-loop ms spent logging one broadcast")
+    print(f"{'sync per recipient':>22} {sync * 1000:>9.1f}")
+    print(f"{'queue per recipient':>22} {queued * 1000:>9.1f}")
+    print(f"{'summary + sampled':>22} {summarised * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
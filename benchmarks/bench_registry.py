@@ -0,0 +1,88 @@
+"""
+    Memory per idle connection in the ConnectionManager.
+
+    Registers N fake sockets and measures the memory allocated for them with tracemalloc
+    (the socket objects themselves are allocated before the measurement starts):
+    - previous: the layout before the slot registry: websocket -> deadline dict, websocket -> queue dict,
+      and an outbound queue with its deque, event and an always running writer task per connection.
+    - registry: ConnectionManager.register(), a slotted Connection record in the dense registry,
+      a slotted outbound queue without deque or task while idle, and the scheduler entry.
+
+    Run from the repository root:
+        python -m benchmarks.bench_registry
+"""
+import asyncio
+import gc
+import tracemalloc
+from collections import deque
+
+from core.connection_manager import ConnectionManager
+from core.scheduler import DeadlineScheduler
+
+SIZES = (10_000, 100_000)
+
+
+class FakeWebSocket:
+    __slots__ = ("__weakref__",)
+
+
+class PreviousQueue:
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self._pending = deque()
+        self._ready = asyncio.Event()
+        self._closed = False
+        self._task = asyncio.create_task(self._writer())
+
+    async def _writer(self):
+        while not self._closed:
+            await self._ready.wait()
+
+
+async def measure(register, sockets) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    state = register(sockets)
+    # let writer tasks (if any) start and park on their first await
+    await asyncio.sleep(0)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / len(sockets), state
+
+
+def register_previous(sockets):
+    scheduler = DeadlineScheduler()
+    deadlines, outbound = {}, {}
+    for ws in sockets:
+        outbound[ws] = PreviousQueue(ws)
+        deadlines[ws] = scheduler.schedule(ws, 10)
+    return scheduler, deadlines, outbound
+
+
+def register_registry(sockets):
+    manager = ConnectionManager()
+    for ws in sockets:
+        manager.register(ws)
+    return manager
+
+
+async def main():
+    print(f"{'connections':>12} {'previous B/conn':>16} {'registry B/conn':>16} {'ratio':>7}")
+    for size in SIZES:
+        sockets = [FakeWebSocket() for _ in range(size)]
+
+        previous, state = await measure(register_previous, sockets)
+        for queue in state[2].values():
+            queue._task.cancel()
+        del state
+        await asyncio.sleep(0)
+
+        current, manager = await measure(register_registry, sockets)
+        await manager.disconnect_many(list(manager.get_connections()))
+
+        print(f"{size:>12} {previous:>16.0f} {current:>16.0f} {previous / current:>6.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
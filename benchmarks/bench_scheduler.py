@@ -0,0 +1,81 @@
+"""
+    Microbenchmark of the scheduled-broadcast loop bookkeeping.
+
+    Compares the old per-second full scan of ConnectionManager.active_connections
+    with the DeadlineScheduler, with no sockets involved:
+    - idle tick: a wakeup when nothing is due (the old loop still scanned every connection),
+      the timing wheel only looks at its earliest bucket.
+    - due tick: handling and rescheduling the connections that became due in one second,
+      the timing wheel only touches those connections.
+
+    Run from the repository root:
+        python -m benchmarks.bench_scheduler
+"""
+import time
+from datetime import datetime, timedelta
+
+from core.scheduler import DeadlineScheduler
+
+SIZES = (1_000, 10_000, 50_000, 100_000)
+TICKS = 20
+INTERVAL = 10
+
+
+def full_scan_tick(connections, now):
+    due = 0
+    for ws, next_time in list(connections.items()):
+        if now >= next_time:
+            connections[ws] = now + timedelta(seconds=INTERVAL)
+            due += 1
+    return due
+
+
+def bench_full_scan(size):
+    start = datetime.utcnow()
+    connections = {i: start + timedelta(seconds=INTERVAL * (i % 1000) / 1000) for i in range(size)}
+
+    idle_now = start - timedelta(seconds=1)
+    t0 = time.process_time()
+    for _ in range(TICKS):
+        full_scan_tick(connections, idle_now)
+    idle = (time.process_time() - t0) / TICKS
+
+    t0 = time.process_time()
+    for tick in range(TICKS):
+        full_scan_tick(connections, start + timedelta(seconds=tick % INTERVAL))
+    due = (time.process_time() - t0) / TICKS
+    return idle, due
+
+
+def bench_timing_wheel(size):
+    clock = [0.0]
+    scheduler = DeadlineScheduler(clock=lambda: clock[0])
+    for i in range(size):
+        scheduler.schedule_at(i, INTERVAL * (i % 1000) / 1000)
+
+    t0 = time.process_time()
+    for _ in range(TICKS):
+        scheduler.next_deadline()
+        scheduler.pop_due(-1.0)
+    idle = (time.process_time() - t0) / TICKS
+
+    t0 = time.process_time()
+    for tick in range(TICKS):
+        clock[0] = float(tick)
+        for key in scheduler.pop_due():
+            scheduler.schedule(key, INTERVAL)
+    due = (time.process_time() - t0) / TICKS
+    return idle, due
+
+
+def main():
+    print(f"{'connections':>12} {'scan idle ms':>13} {'wheel idle ms':>14} {'scan tick ms':>13} {'wheel tick ms':>14}")
+    for size in SIZES:
+        scan_idle, scan_due = bench_full_scan(size)
+        heap_idle, heap_due = bench_timing_wheel(size)
+        print(f"{size:>12} {scan_idle * 1000:>13.3f} {heap_idle * 1000:>14.3f} "
+              f"{scan_due * 1000:>13.3f} {heap_due * 1000:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
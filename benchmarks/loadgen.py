@@ -0,0 +1,323 @@
+"""
+    Load generator for the WebSocket server.
+
+    Starts the app as a subprocess (or attaches to --url), opens N client connections at a tunable
+    connect rate from several client processes, and records:
+    - scheduled broadcast latency p50/p95/p99. With one worker the deadline of every message is known
+      (accept + 10 s per tick), so this is publish-to-receipt. With several workers the leader's publish time
+      is not visible to clients, so latency is measured from the first receipt of the same round (fan-out skew).
+    - round-trip time of `send_now` and `ping` from a sample of the clients.
+    - server RSS per connection and server CPU (all worker processes) during the measurement window.
+    Multi-worker runs use the Redis-free local bus by default, so no Redis is needed.
+
+    Results are written as JSON and two runs can be compared:
+        python -m benchmarks.loadgen run --connections 10000 --connect-rate 2000 --duration 30 --output before.json
+        python -m benchmarks.loadgen run --workers 3 --connections 10000 --output after.json
+        python -m benchmarks.loadgen compare before.json after.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import psutil
+import websockets
+
+from core.compression import SHARED_DEFLATE_PROTOCOL, CompressionMode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INTERVAL = 10
+
+# metric -> True if higher is better
+COMPARED = {
+    "connect_rate": True,
+    "scheduled_latency_ms.p50": False,
+    "scheduled_latency_ms.p95": False,
+    "scheduled_latency_ms.p99": False,
+    "send_now_rtt_ms.p50": False,
+    "send_now_rtt_ms.p99": False,
+    "ping_rtt_ms.p50": False,
+    "ping_rtt_ms.p99": False,
+    "rss_per_connection_bytes": False,
+    "server_cpu_percent": False,
+}
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "max": None}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+
+    return {"count": len(values), "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": round(values[-1], 3)}
+
+
+async def run_clients(url, count, rate, duration, probe_every, probe_interval):
+    """
+        One client process: `count` connections opened at `rate` per second, kept for `duration` seconds
+    """
+    result = {"connected": 0, "failed": 0, "scheduled": [], "send_now": [], "ping": []}
+    sockets = []
+    readers = []
+    waiters = {}
+
+    async def reader(index, ws, connected_at):
+        try:
+            async for message in ws:
+                now = time.time()
+                if "broadcast" in message.lower():
+                    result["scheduled"].append((connected_at, now))
+                    continue
+                waiter = waiters.pop((index, message), None)
+                if waiter is not None and not waiter.done():
+                    waiter.set_result(now)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def probe(index, ws):
+        while True:
+            await asyncio.sleep(probe_interval)
+            for command, reply in (("send_now", "Immediate message sent"), ("ping", "pong")):
+                waiter = waiters[(index, reply)] = asyncio.get_running_loop().create_future()
+                started = time.time()
+                await ws.send(command)
+                try:
+                    received = await asyncio.wait_for(waiter, timeout=5)
+                    result[command].append((received - started) * 1000)
+                except asyncio.TimeoutError:
+                    pass
+
+    started = time.time()
+    for index in range(count):
+        delay = started + index / rate - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            ws = await websockets.connect(url, max_queue=None, compression=None, open_timeout=30)
+        except Exception:
+            result["failed"] += 1
+            continue
+        result["connected"] += 1
+        sockets.append(ws)
+        readers.append(asyncio.create_task(reader(index, ws, time.time())))
+        if probe_every and index % probe_every == 0:
+            readers.append(asyncio.create_task(probe(index, ws)))
+
+    result["connect_seconds"] = time.time() - started
+    await asyncio.sleep(duration)
+
+    for task in readers:
+        task.cancel()
+    await asyncio.gather(*(ws.close() for ws in sockets), return_exceptions=True)
+    return result
+
+
+def client_process(url, count, rate, duration, probe_every, probe_interval, queue):
+    queue.put(asyncio.run(run_clients(url, count, rate, duration, probe_every, probe_interval)))
+
+
+def scheduled_latencies(receipts, single_worker):
+    if single_worker:
+        # the n-th scheduled message is due n * INTERVAL after accept
+        latencies = []
+        for connected_at, received in receipts:
+            tick = max(1, round((received - connected_at) / INTERVAL))
+            latencies.append((received - connected_at - tick * INTERVAL) * 1000)
+        return latencies
+
+    times = sorted(received for _, received in receipts)
+    latencies, round_start = [], None
+    for received in times:
+        if round_start is None or received - round_start > INTERVAL / 2:
+            round_start = received
+        latencies.append((received - round_start) * 1000)
+    return latencies
+
+
+def server_processes(pid):
+    process = psutil.Process(pid)
+    return [process] + process.children(recursive=True)
+
+
+def server_usage(pid):
+    rss = cpu = 0
+    for process in server_processes(pid):
+        try:
+            rss += process.memory_info().rss
+            times = process.cpu_times()
+            cpu += times.user + times.system
+        except psutil.NoSuchProcess:
+            pass
+    return rss, cpu
+
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server did not start on {host}:{port}")
+
+
+def server_options(env: dict) -> list:
+    """
+        uvicorn CLI flags for the configuration `python app.py` runs with: the server's keepalive
+        instead of uvicorn's own pings, and the WS_COMPRESSION mode
+    """
+    options = []
+    if float(env.get("KEEPALIVE_INTERVAL", 20)) > 0:
+        options += ["--ws-ping-interval", "0"]
+    mode = CompressionMode(env.get("WS_COMPRESSION", CompressionMode.DEFAULT.value))
+    if mode is CompressionMode.SHARED:
+        options += ["--ws", SHARED_DEFLATE_PROTOCOL]
+    elif mode is CompressionMode.OFF:
+        options += ["--ws-per-message-deflate", "false"]
+    return options
+
+
+def start_server(args):
+    env = dict(os.environ, UVICORN_WORKERS=str(args.workers))
+    if args.workers > 1:
+        env.setdefault("BROADCAST_BACKEND", args.backend)
+    log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning", *server_options(env)],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    wait_for_port("127.0.0.1", args.port)
+    time.sleep(1)
+    return server
+
+
+def run(args):
+    server = None
+    url = args.url
+    if url is None:
+        server = start_server(args)
+        url = f"ws://127.0.0.1:{args.port}/ws"
+    server_pid = server.pid if server else args.server_pid
+
+    try:
+        rss_before, cpu_before = server_usage(server_pid) if server_pid else (0, 0)
+        processes, queue = [], multiprocessing.Queue()
+        per_process = [args.connections // args.client_procs + (i < args.connections % args.client_procs)
+                       for i in range(args.client_procs)]
+        probe_every = max(1, args.connections // args.probes) if args.probes else 0
+        started = time.time()
+        for count in per_process:
+            process = multiprocessing.Process(
+                target=client_process,
+                args=(url, count, args.connect_rate / args.client_procs, args.duration, probe_every,
+                      args.probe_interval, queue),
+            )
+            process.start()
+            processes.append(process)
+
+        # sample the server once every client process is connected and idle
+        time.sleep(args.connections / args.connect_rate + min(2.0, args.duration / 4))
+        rss_loaded, cpu_loaded = server_usage(server_pid) if server_pid else (0, 0)
+        window_started = time.time()
+
+        results = [queue.get() for _ in processes]
+        window = time.time() - window_started
+        _, cpu_after = server_usage(server_pid) if server_pid else (0, 0)
+        for process in processes:
+            process.join()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    connected = sum(r["connected"] for r in results)
+    receipts = [receipt for r in results for receipt in r["scheduled"]]
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "func"},
+        "started_at": started,
+        "connections": connected,
+        "connect_failures": sum(r["failed"] for r in results),
+        "connect_rate": round(connected / max(r["connect_seconds"] for r in results), 1),
+        "scheduled_latency_ms": percentiles(scheduled_latencies(receipts, args.workers == 1 and args.url is None)),
+        "send_now_rtt_ms": percentiles([v for r in results for v in r["send_now"]]),
+        "ping_rtt_ms": percentiles([v for r in results for v in r["ping"]]),
+        "rss_per_connection_bytes": round((rss_loaded - rss_before) / connected) if server_pid and connected else None,
+        "server_cpu_percent": round((cpu_after - cpu_loaded) / window * 100, 1) if server_pid and window else None,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+def lookup(report, path):
+    value = report
+    for key in path.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    regressions = 0
+    print(f"{'metric':<28} {'baseline':>12} {'candidate':>12} {'change':>9}")
+    for metric, higher_is_better in COMPARED.items():
+        before, after = lookup(baseline, metric), lookup(candidate, metric)
+        if before is None or after is None:
+            print(f"{metric:<28} {str(before):>12} {str(after):>12} {'n/a':>9}")
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        worse = change < -args.threshold if higher_is_better else change > args.threshold
+        regressions += worse
+        print(f"{metric:<28} {before:>12} {after:>12} {change:>8.1f}%{'  REGRESSION' if worse else ''}")
+
+    sys.exit(1 if regressions else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(required=True)
+
+    run_parser = commands.add_parser("run", help="generate load and write a JSON report")
+    run_parser.add_argument("--connections", type=int, default=1000)
+    run_parser.add_argument("--connect-rate", type=float, default=500, help="new connections per second")
+    run_parser.add_argument("--duration", type=float, default=25, help="seconds to hold the connections")
+    run_parser.add_argument("--client-procs", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    run_parser.add_argument("--probes", type=int, default=50, help="clients measuring send_now/ping RTT")
+    run_parser.add_argument("--probe-interval", type=float, default=1.0)
+    run_parser.add_argument("--workers", type=int, default=1)
+    run_parser.add_argument("--backend", default="local", help="BROADCAST_BACKEND when --workers > 1")
+    run_parser.add_argument("--port", type=int, default=8100)
+    run_parser.add_argument("--url", help="attach to a running server instead of starting one")
+    run_parser.add_argument("--server-pid", type=int, help="pid of the attached server, for RSS and CPU")
+    run_parser.add_argument("--server-log", help="file for the server output (discarded by default)")
+    run_parser.add_argument("--output", help="JSON report path")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two JSON reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="allowed change in percent")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
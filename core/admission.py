@@ -0,0 +1,100 @@
+import asyncio
+import os
+import random
+import time
+from enum import Enum
+from typing import Optional
+
+from core import metrics
+from core.rate_limit import TokenBucket
+
+# 1013 Try Again Later: the server is overloaded, the client should retry after the hint
+ADMISSION_CLOSE_CODE = 1013
+
+
+class RejectReason(str, Enum):
+    """
+        Why a handshake was turned away:
+        - MAX_CONNECTIONS: the worker holds MAX_CONNECTIONS connections.
+        - OVERLOADED: the event loop lags more than ADMISSION_MAX_LAG seconds.
+        - FAIR_SHARE: the worker holds more than ADMISSION_FAIR_SHARE times the cluster average.
+        - RATE: the accept-rate limiter would hold the handshake longer than ACCEPT_QUEUE_TIMEOUT.
+    """
+    MAX_CONNECTIONS = "max_connections"
+    OVERLOADED = "overloaded"
+    FAIR_SHARE = "fair_share"
+    RATE = "rate"
+
+
+class Admission:
+    """
+        Admission control for new connections of one worker, checked before a handshake is accepted:
+        - a cap on connections per worker (MAX_CONNECTIONS, 0 = none).
+        - an event loop lag ceiling (ADMISSION_MAX_LAG), from the loop lag monitor.
+        - a fair share of the cluster: the Redis heartbeat reports the cluster total and the number of live workers,
+          and a worker with more than ADMISSION_FAIR_SHARE times the average (once it has ADMISSION_FAIR_SHARE_MIN
+          connections) turns new clients away, so they land on a less loaded worker when they retry.
+        - an accept-rate token bucket (ACCEPT_RATE per second, ACCEPT_BURST): a handshake over the rate is queued
+          until its token is due if that is within ACCEPT_QUEUE_TIMEOUT, otherwise it is rejected.
+        A rejected client gets 1013 with a `reconnect_after_ms=<n>` reason jittered around ADMISSION_RETRY_AFTER,
+        so a reconnect storm spreads out instead of hitting the fleet again at once.
+        Nothing here talks to Redis: the cluster view is whatever the last heartbeat brought.
+    """
+
+    def __init__(self, manager, clock=time.monotonic):
+        self._manager = manager
+        self._clock = clock
+        self.max_connections = int(os.getenv("MAX_CONNECTIONS", 0))
+        self.max_lag = float(os.getenv("ADMISSION_MAX_LAG", 0.5))
+        self.fair_share = float(os.getenv("ADMISSION_FAIR_SHARE", 2.0))
+        self.fair_share_min = int(os.getenv("ADMISSION_FAIR_SHARE_MIN", 1000))
+        self.queue_timeout = float(os.getenv("ACCEPT_QUEUE_TIMEOUT", 1.0))
+        self.retry_after = float(os.getenv("ADMISSION_RETRY_AFTER", 2.0))
+        rate = float(os.getenv("ACCEPT_RATE", 0))
+        self._bucket = TokenBucket(rate, float(os.getenv("ACCEPT_BURST", rate)), clock()) if rate > 0 else None
+        self.cluster_connections = 0
+        self.cluster_workers = 0
+        self.waiting = 0
+        self._rejected = {reason: metrics.admission_rejected.labels(metrics.worker, reason.value)
+                          for reason in RejectReason}
+        metrics.register_callback("ws_admission_waiting", "Handshakes waiting for the accept-rate limiter",
+                                  lambda: self.waiting)
+
+    def observe_cluster(self, connections: int, workers: int):
+        self.cluster_connections = connections
+        self.cluster_workers = workers
+
+    def _check(self) -> Optional[RejectReason]:
+        connections = len(self._manager.connections) + self.waiting
+        if self.max_connections and connections >= self.max_connections:
+            return RejectReason.MAX_CONNECTIONS
+        if self.max_lag and metrics.loop_lag.value > self.max_lag:
+            return RejectReason.OVERLOADED
+        if self.fair_share and self.cluster_workers > 1 and connections >= self.fair_share_min:
+            if connections > self.fair_share * self.cluster_connections / self.cluster_workers:
+                return RejectReason.FAIR_SHARE
+        return None
+
+    async def admit(self) -> Optional[RejectReason]:
+        """
+            None once the handshake may be accepted (possibly after waiting for the rate limiter), else the reason
+        """
+        reason = self._check()
+        if reason is None and self._bucket is not None:
+            delay = self._bucket.reserve(self._clock())
+            if delay > self.queue_timeout:
+                self._bucket.refund()
+                reason = RejectReason.RATE
+            elif delay > 0:
+                self.waiting += 1
+                metrics.admission_queued.inc()
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self.waiting -= 1
+        if reason is not None:
+            self._rejected[reason].inc()
+        return reason
+
+    def retry_after_ms(self) -> int:
+        return int(self.retry_after * random.uniform(0.5, 1.5) * 1000)
@@ -1,8 +1,8 @@
 import asyncio
-import os
-from datetime import datetime, timedelta
 
 from core.connection_manager import ConnectionManager
+from core.fanout import FanOut
+from core.frames import PreparedMessage
 from core.singeltone import Singleton
 import logging
 
@@ -13,37 +13,44 @@ logger = logging.getLogger('socket_logger')
 class Broadcaster(metaclass=Singleton):
     def __init__(self):
         self._manager = ConnectionManager()
-        self._recently_notified = set()
         self._broadcast_task = None
+        self._fanout = FanOut("scheduled")
 
     def mark_recent(self, websocket):
         """
             An implementation of an interface to indicate a connection to which a response should be sent immediately
         """
-        self._recently_notified.add(websocket)
+        self._manager.mark_recent(websocket)
+
+    async def publish(self, topic: str, message: str):
+        """
+            Sends a message to the subscribers of a topic
+        """
+        message = PreparedMessage.for_topic(topic, message)
+        self._manager.recent.add(message)
+        await self._fanout.send(self._manager.get_subscribers(topic), message)
 
     def start(self):
         if self._broadcast_task is None:
             self._broadcast_task = asyncio.create_task(self._broadcast_loop())
 
+    @property
+    def ready(self) -> bool:
+        return self._broadcast_task is not None
+
     async def _broadcast_loop(self):
-        """ A broadcast loop that checks every second:
-            - whether it is time for each WebSocket to receive a scheduled message by next message from conn manager.
-            - if so — sends "Scheduled broadcast", updates the time of the next broadcast.
-            - if the connection is broken — deletes it from the manager
+        """ A broadcast loop driven by the connection manager's deadline scheduler:
+            - sleeps until the earliest connection is due to receive a scheduled message.
+            - sends "Scheduled broadcast" to the due connections concurrently and reschedules them.
+            - broken connections are deleted from the manager by the fan-out
+            - the tick is one prepared message for the life of the loop: encoded once and recorded once as recent
         """
-        while True:
-            now = datetime.utcnow()
-
-            for ws, next_time in list(self._manager.get_connections().items()):
-                if now >= next_time:
-                    try:
-                        logger.info(f"[{os.getpid()}] Sent scheduled message to: {ws}")
-                        await ws.send_text("Scheduled broadcast")
-                        self._manager.active_connections[ws] = now + timedelta(seconds=10)
-                    except:
-                        await self._manager.disconnect(ws)
+        scheduler = self._manager.scheduler
+        message = PreparedMessage("Scheduled broadcast")
 
-            await asyncio.sleep(1)
-
-broadcast = Broadcaster()
\ No newline at end of file
+        while True:
+            due = await scheduler.wait_due()
+            self._manager.recent.add(message)
+            await self._fanout.send(due, message)
+            for record in due:
+                self._manager.reschedule(record)
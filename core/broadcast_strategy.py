@@ -2,62 +2,198 @@ import logging
 import os
 from abc import ABC, abstractmethod
 
-from core.broadcast import broadcast
-from core.redis_broadcaster import redis_broadcast
+from core.broadcast import Broadcaster
+from core.connection_manager import ConnectionManager
+from core.local_broadcaster import LocalBusBroadcaster
+from core.redis_broadcaster import RedisBroadcaster
+from core.stream_broadcaster import StreamBroadcaster
 
 logger = logging.getLogger('socket_logger')
 
 class Context:
-    def __init__(self, workers_number):
+    """
+        The strategy (and its broadcaster with its Redis clients) is built on first use, and only the selected one:
+        importing this module builds nothing, a single worker never creates a Redis client.
+    """
+
+    def __init__(self, workers_number, backend="pubsub"):
         self.workers_number = workers_number
-        self._strategy = self.mathc_url_to_strategy()
+        self.backend = backend
+        self._selected = None
+
+    @property
+    def _strategy(self):
+        if self._selected is None:
+            self._selected = self.mathc_url_to_strategy()
+        return self._selected
+
+    @property
+    def ready(self) -> bool:
+        """
+            The broadcaster is started and connected to its transport: new clients get every broadcast
+        """
+        return self._selected is not None and self._selected.is_ready()
 
     def start(self):
-        logger.info(f"Strategy selected: {self._strategy.__class__.__name__}")
+        logger.info("[%s] Strategy selected: %s", os.getpid(), self._strategy.__class__.__name__)
         self._strategy.start_broadcaster()
 
     def mathc_url_to_strategy(self):
         if self.workers_number > 1:
+            if self.backend == "streams":
+                return StreamBroadcasterStrategy()
+            if self.backend == "local":
+                return LocalBusStrategy()
             return RedisBroadcasterStrategy()
         else:
             return SingleBroadcasterStrategy()
 
+    async def stop(self):
+        await self._strategy.stop_broadcaster()
+
     def call_broadcaster(self):
-        logging.info(f"Set strategy {self._strategy}")
+        logger.info("[%s] Set strategy %s", os.getpid(), self._strategy)
         error = self._strategy.start_broadcaster()
         return error
 
     def mark_recent(self, websocket):
         self._strategy.mark_recent(websocket)
 
+    async def publish(self, topic, message):
+        await self._strategy.publish(topic, message)
+
+    async def resume(self, websocket, last_id=None):
+        return await self._strategy.resume(websocket, last_id)
+
+    async def send_to_clients(self, client_ids, message) -> int:
+        """
+            Sends a message to the given client ids wherever they are connected, returns how many were reached
+        """
+        return await self._strategy.send_to_clients(client_ids, message)
+
+    async def send_to_client(self, client_id, message) -> bool:
+        return await self._strategy.send_to_clients((client_id,), message) > 0
+
 
 class Strategy(ABC):
     """This is an abstraction class that describes an interface to strategies of
-    RedisBroadcaster for multi-workers and of SingleBroadcaster for one-worker logic """
+    RedisBroadcaster (pub/sub or streams) or LocalBusBroadcaster for multi-workers
+    and of SingleBroadcaster for one-worker logic """
 
     @abstractmethod
     def start_broadcaster(self):
         pass
 
+    @abstractmethod
+    async def stop_broadcaster(self):
+        pass
+
     @abstractmethod
     def mark_recent(self, websocket):
         pass
 
+    @abstractmethod
+    async def publish(self, topic, message):
+        pass
+
+    @abstractmethod
+    async def resume(self, websocket, last_id=None):
+        pass
+
+    @abstractmethod
+    async def send_to_clients(self, client_ids, message):
+        pass
+
+    @abstractmethod
+    def is_ready(self) -> bool:
+        pass
+
 
 class RedisBroadcasterStrategy(Strategy):
+    def __init__(self, broadcaster: RedisBroadcaster = None):
+        self.broadcaster = broadcaster or RedisBroadcaster()
+
+    def start_broadcaster(self):
+        self.broadcaster.start()
+
+    async def stop_broadcaster(self):
+        await self.broadcaster.stop()
+
+    def mark_recent(self, websocket):
+        self.broadcaster.mark_recent(websocket)
+
+    async def publish(self, topic, message):
+        await self.broadcaster.publish(topic, message)
+
+    async def resume(self, websocket, last_id=None):
+        return False
+
+    async def send_to_clients(self, client_ids, message):
+        return await self.broadcaster.send_to_clients(client_ids, message)
+
+    def is_ready(self) -> bool:
+        return self.broadcaster.ready
+
+
+class StreamBroadcasterStrategy(RedisBroadcasterStrategy):
+    def __init__(self, broadcaster: StreamBroadcaster = None):
+        super().__init__(broadcaster or StreamBroadcaster())
+
+    async def resume(self, websocket, last_id=None):
+        return await self.broadcaster.resume(websocket, last_id)
+
+
+class LocalBusStrategy(Strategy):
+    def __init__(self):
+        self.broadcaster = LocalBusBroadcaster()
+
     def start_broadcaster(self):
-        redis_broadcast.start()
+        self.broadcaster.start()
+
+    async def stop_broadcaster(self):
+        await self.broadcaster.stop()
 
     def mark_recent(self, websocket):
-        redis_broadcast.mark_recent(websocket)
+        self.broadcaster.mark_recent(websocket)
+
+    async def publish(self, topic, message):
+        await self.broadcaster.publish(topic, message)
+
+    async def resume(self, websocket, last_id=None):
+        return False
+
+    async def send_to_clients(self, client_ids, message):
+        # no directory on the local bus: only the clients of this worker are reached
+        return ConnectionManager().send_to_clients(client_ids, message)
+
+    def is_ready(self) -> bool:
+        return self.broadcaster.ready
 
 
 class SingleBroadcasterStrategy(Strategy):
+    def __init__(self):
+        self.broadcaster = Broadcaster()
+
     def start_broadcaster(self):
-        broadcast.start()
+        self.broadcaster.start()
+
+    async def stop_broadcaster(self):
+        pass
 
     def mark_recent(self, websocket):
-        broadcast.mark_recent(websocket)
+        self.broadcaster.mark_recent(websocket)
+
+    async def publish(self, topic, message):
+        await self.broadcaster.publish(topic, message)
+
+    async def resume(self, websocket, last_id=None):
+        return False
+
+    async def send_to_clients(self, client_ids, message):
+        return ConnectionManager().send_to_clients(client_ids, message)
+
+    def is_ready(self) -> bool:
+        return self.broadcaster.ready
 
 
-context = Context(workers_number=int(os.getenv("UVICORN_WORKERS", 1)))
\ No newline at end of file
+context = Context(workers_number=int(os.getenv("UVICORN_WORKERS", 1)), backend=os.getenv("BROADCAST_BACKEND", "pubsub"))
\ No newline at end of file
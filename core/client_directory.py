@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Iterable, Set
+
+from redis_client import get_pubsub_redis, get_redis
+from core import metrics
+from core.connection_manager import ConnectionManager
+
+logger = logging.getLogger('socket_logger')
+
+
+UPDATE_SCRIPT = """
+local added = tonumber(ARGV[3])
+for i = 1, added do
+    redis.call('SET', KEYS[i], ARGV[1], 'PX', ARGV[2])
+end
+for i = added + 1, #KEYS do
+    if redis.call('GET', KEYS[i]) == ARGV[1] then
+        redis.call('DEL', KEYS[i])
+    end
+end
+return #KEYS
+"""
+
+SEND_SCRIPT = """
+local groups, workers = {}, {}
+for i, key in ipairs(KEYS) do
+    local worker = redis.call('GET', key)
+    if worker and worker ~= ARGV[2] then
+        if not groups[worker] then
+            groups[worker] = {}
+            table.insert(workers, worker)
+        end
+        table.insert(groups[worker], ARGV[i + 3])
+    end
+end
+local routed = 0
+for _, worker in ipairs(workers) do
+    redis.call('PUBLISH', ARGV[1] .. worker, table.concat(groups[worker], ',') .. ' ' .. ARGV[3])
+    routed = routed + #groups[worker]
+end
+return routed
+"""
+
+
+class ClientDirectory:
+    """
+        A cluster-wide directory of client id -> worker in Redis, for messages to given clients wherever they are:
+        - `ws:client:<id>` holds the id of the worker with the client's connection and expires after DIRECTORY_TTL;
+          a worker re-registers all its clients every TTL/3, so the entries of a dead worker expire on their own.
+        - changes are batched: the ConnectionManager's client events only mark ids as changed, and every
+          DIRECTORY_FLUSH_INTERVAL one script call per DIRECTORY_BATCH ids writes them. A removal only deletes
+          an entry that still points to this worker (the client may have reconnected elsewhere meanwhile).
+        - every worker listens on its own `ws_direct:<worker id>` channel. send_to_clients() queues to local clients
+          directly, and one script call looks the others up and PUBLISHes once per owning worker
+          "<id>,<id>,... <message>", so a targeted send is never a cluster-wide fan-out.
+          The pub/sub broadcaster subscribes that channel on its own listener connection and hands the messages
+          to deliver(); otherwise (streams backend) the directory listens itself, on the pub/sub client.
+    """
+
+    key_prefix = "ws:client:"
+    channel_prefix = "ws_direct:"
+
+    def __init__(self, client=None, worker_id: str = None, ttl: float = None, flush_interval: float = None,
+                 batch: int = None, pubsub_client=None):
+        self._redis = client or get_redis()
+        self._pubsub_redis = pubsub_client or client or get_pubsub_redis()
+        self._manager = ConnectionManager()
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.ttl = float(os.getenv("DIRECTORY_TTL", 60)) if ttl is None else ttl
+        self.flush_interval = float(os.getenv("DIRECTORY_FLUSH_INTERVAL", 0.5)) if flush_interval is None \
+            else flush_interval
+        self.batch = int(os.getenv("DIRECTORY_BATCH", 500)) if batch is None else batch
+        self._changed: Set[str] = set()
+        self._wakeup = asyncio.Event()
+        self._flush_task = None
+        self._listen_task = None
+        self._listening = asyncio.Event()
+        self._update = self._redis.register_script(UPDATE_SCRIPT)
+        self._send = self._redis.register_script(SEND_SCRIPT)
+        self.scripts = (self._update, self._send)
+        self._latency = metrics.redis_latency.labels(metrics.worker, "directory")
+
+    @property
+    def channel(self) -> str:
+        return f"{self.channel_prefix}{self.worker_id}"
+
+    def key(self, client_id: str) -> str:
+        return f"{self.key_prefix}{client_id}"
+
+    def start(self, listen: bool = True):
+        if not self._flush_task:
+            self._manager.add_client_listener(self._on_client_change)
+            self._changed.update(self._manager.clients)
+            self._flush_task = asyncio.create_task(self.flush_loop())
+        if listen and not self._listen_task:
+            self._listen_task = asyncio.create_task(self.listen())
+
+    async def stop(self):
+        """
+            Stops registering clients and deletes this worker's entries; targeted messages that are already
+            routed here are still delivered while the connections drain
+        """
+        if self._flush_task:
+            self._flush_task.cancel()
+        await self._write([], list(self._manager.clients))
+
+    def _on_client_change(self, client_id: str, active: bool):
+        self._changed.add(client_id)
+        self._wakeup.set()
+
+    async def flush_loop(self):
+        loop = asyncio.get_running_loop()
+        refresh_every = self.ttl / 3
+        next_refresh = loop.time() + refresh_every
+
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, next_refresh - loop.time()))
+                # let the changes of the next flush_interval join this batch
+                await asyncio.sleep(self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if loop.time() >= next_refresh:
+                self._changed.update(self._manager.clients)
+                next_refresh = loop.time() + refresh_every
+
+            changed, self._changed = self._changed, set()
+            try:
+                await self.flush(changed)
+            except Exception as e:
+                logger.error("[%s] Client directory update failed: %s", os.getpid(), e)
+                self._changed |= changed
+                await asyncio.sleep(1)
+
+    async def flush(self, changed: Iterable[str]):
+        """
+            Writes the current state of the changed client ids: present on this worker or gone
+        """
+        clients = self._manager.clients
+        added, removed = [], []
+        for client_id in changed:
+            (added if client_id in clients else removed).append(client_id)
+        await self._write(added, removed)
+
+    async def _write(self, added: list, removed: list):
+        ttl_ms = int(self.ttl * 1000)
+        for client_ids, adding in ((added, True), (removed, False)):
+            for start in range(0, len(client_ids), self.batch):
+                keys = [self.key(client_id) for client_id in client_ids[start:start + self.batch]]
+                started = time.perf_counter()
+                await self._update(keys=keys, args=[self.worker_id, ttl_ms, len(keys) if adding else 0])
+                self._latency.observe(time.perf_counter() - started)
+
+    async def send_to_clients(self, client_ids: Iterable[str], message: str) -> int:
+        """
+            Sends a message to the given clients wherever they are connected.
+            Returns the number of clients it was queued or routed to (clients that aren't in the directory are skipped).
+        """
+        delivered, remote = 0, []
+        for client_id in client_ids:
+            if self._manager.send_to_client(client_id, message):
+                delivered += 1
+            else:
+                remote.append(client_id)
+        if remote:
+            keys = [self.key(client_id) for client_id in remote]
+            delivered += int(await self._send(keys=keys, args=[self.channel_prefix, self.worker_id, message, *remote]))
+        return delivered
+
+    async def send_to_client(self, client_id: str, message: str) -> bool:
+        return await self.send_to_clients((client_id,), message) > 0
+
+    def deliver(self, data: str):
+        """
+            Queues a message of this worker's channel, "<id>,<id>,... <message>", to those of the clients still here
+        """
+        client_ids, _, message = data.partition(" ")
+        self._manager.send_to_clients(client_ids.split(","), message)
+
+    async def listen(self):
+        pubsub = self._pubsub_redis.pubsub()
+        await pubsub.subscribe(self.channel)
+        self._listening.set()
+
+        async for msg in pubsub.listen():
+            if msg["type"] == "message":
+                self.deliver(msg["data"])
@@ -0,0 +1,85 @@
+import logging
+import os
+from enum import Enum
+
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+from websockets.server import ServerProtocol
+
+from core.frames import DEFLATE_MEM_LEVEL
+
+SHARED_DEFLATE_PROTOCOL = "core.compression:SharedDeflateProtocol"
+
+WINDOW_BITS = 12
+
+
+class CompressionMode(str, Enum):
+    """
+        permessage-deflate of the WebSocket connections (WS_COMPRESSION):
+        - DEFAULT: uvicorn's per-connection deflate with context takeover, every message is compressed for every
+          connection and every connection keeps its own zlib contexts.
+        - SHARED: deflate without context takeover in both directions, so no connection keeps a zlib context;
+          a broadcast is deflated once and the compressed frame is shared by all connections (see core.frames).
+        - OFF: no compression.
+    """
+    DEFAULT = "default"
+    SHARED = "shared"
+    OFF = "off"
+
+
+def shared_deflate_factory() -> ServerPerMessageDeflateFactory:
+    return ServerPerMessageDeflateFactory(
+        server_no_context_takeover=True,
+        client_no_context_takeover=True,
+        server_max_window_bits=WINDOW_BITS,
+        client_max_window_bits=WINDOW_BITS,
+        compress_settings={"memLevel": DEFLATE_MEM_LEVEL},
+    )
+
+
+_shared_deflate_protocol = None
+
+
+def shared_deflate_protocol() -> type:
+    """
+        uvicorn's sans-I/O WebSocket protocol negotiating permessage-deflate without context takeover.
+        Built on first use, so only the shared mode imports uvicorn's sans-I/O implementation (uvicorn >= 0.35).
+        It replaces the protocol's `conn` (a websockets ServerProtocol built in __init__), a uvicorn internal:
+        requirements.txt pins the uvicorn release this is written against and test_compression checks it.
+    """
+    global _shared_deflate_protocol
+    if _shared_deflate_protocol is None:
+        from uvicorn.protocols.websockets.websockets_sansio_impl import WebSocketsSansIOProtocol
+
+        class SharedDeflateProtocol(WebSocketsSansIOProtocol):
+            def __init__(self, config, server_state, app_state, _loop=None):
+                super().__init__(config, server_state, app_state, _loop)
+                if config.ws_per_message_deflate:
+                    self.conn = ServerProtocol(
+                        extensions=[shared_deflate_factory()],
+                        max_size=config.ws_max_size,
+                        logger=logging.getLogger("uvicorn.error"),
+                    )
+
+        _shared_deflate_protocol = SharedDeflateProtocol
+    return _shared_deflate_protocol
+
+
+def __getattr__(name: str):
+    # `--ws core.compression:SharedDeflateProtocol` resolves here
+    if name == "SharedDeflateProtocol":
+        return shared_deflate_protocol()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def uvicorn_options(mode: str = None) -> dict:
+    """
+        uvicorn.run() keyword arguments for the compression mode
+    """
+    mode = CompressionMode(mode or os.getenv("WS_COMPRESSION", CompressionMode.DEFAULT.value))
+    if mode is CompressionMode.SHARED:
+        # fail at startup, not at the first handshake, if the installed uvicorn lacks the sans-I/O implementation
+        shared_deflate_protocol()
+        return {"ws": SHARED_DEFLATE_PROTOCOL}
+    if mode is CompressionMode.OFF:
+        return {"ws_per_message_deflate": False}
+    return {}
@@ -1,31 +1,361 @@
-from typing import Dict
+import asyncio
+import os
+import random
+import re
+import uuid
+from typing import Callable, Dict, List, Optional, Set
 from fastapi import WebSocket
-from datetime import datetime, timedelta
 import logging
+from core import envelope, metrics
+from core.admission import ADMISSION_CLOSE_CODE, Admission
+from core.connection_registry import Connection, ConnectionRegistry
+from core.keepalive import Keepalive
+from core.outbound import OutboundQueue, OutboundStats, OverflowPolicy
+from core.recent import RecentMessages
+from core.scheduler import DeadlineScheduler
 from core.singeltone import Singleton
+from logger import sampler
 
 logger = logging.getLogger('socket_logger')
 
+CLIENT_ID_PATTERN = re.compile(r"[A-Za-z0-9_.:-]{1,64}")
+
+# 1012 Service Restart: the server goes away, reconnecting (elsewhere) is expected
+DRAIN_CLOSE_CODE = 1012
+
 class ConnectionManager(metaclass=Singleton):
     """
-        A connection manager that tracks new connections and implements methods for checking the connection status
+        A connection manager that tracks the connections of this worker.
+        Every connection is one slotted record (core.connection_registry.Connection) in a dense registry,
+        holding its scheduler deadline, outbound queue, broadcast sequence, topics and client id.
+        The endpoint addresses connections by websocket, broadcasters iterate and fan out to the records.
     """
 
+    interval = 10
+
     def __init__(self):
-        self.active_connections: Dict[WebSocket, datetime] = {}
+        self.connections = ConnectionRegistry()
+        self.outbound_stats = OutboundStats()
+        self.topics: Dict[str, Set[Connection]] = {}
+        self.broadcast_seq = 0
+        self._topic_listeners = []
+        self._client_listeners = []
+        self.clients: Dict[str, Connection] = {}
+        self._disconnect_listeners = []
+        self.scheduler = DeadlineScheduler()
+        self.keepalive = Keepalive(self)
+        self.admission = Admission(self)
+        self.queue_size = int(os.getenv("OUTBOUND_QUEUE_SIZE", 64))
+        self.overflow_policy = OverflowPolicy(os.getenv("OUTBOUND_OVERFLOW_POLICY", OverflowPolicy.COALESCE.value))
+        self.send_timeout = float(os.getenv("FANOUT_SEND_TIMEOUT", 1.0))
+        self._send_semaphore = None
+        self._broken: Dict[int, List[WebSocket]] = {}
+        self._broken_flush = None
+        self.draining = False
+        self.reconnect_spread = float(os.getenv("DRAIN_RECONNECT_SPREAD", 30))
+        self.recent = RecentMessages()
+        self.snapshots = os.getenv("RECENT_SNAPSHOT", "0") != "0"
+        self._register_metrics()
+
+    @property
+    def active_connections(self) -> Dict[WebSocket, Connection]:
+        return self.connections.by_websocket
+
+    def _register_metrics(self):
+        metrics.register_callback("ws_active_connections", "Open WebSocket connections",
+                                  lambda: len(self.connections))
+        metrics.register_callback("ws_topics", "Topics with local subscribers", lambda: len(self.topics))
+        metrics.register_callback("ws_recent_messages_bytes", "Bytes held by the recent-message buffers",
+                                  lambda: self.recent.bytes)
+        stats = self.outbound_stats
+        metrics.register_callback("ws_outbound_queue_depth", "Messages waiting in outbound queues", lambda: stats.depth)
+        for name in ("sent", "batched", "dropped", "coalesced", "overflow_disconnects", "send_failures"):
+            metrics.register_callback(f"ws_outbound_{name}_total", f"Outbound queue counter: {name}",
+                                      lambda name=name: getattr(stats, name), kind="counter")
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket) -> Optional[Connection]:
+        """
+            Accepts and registers the connection, or turns it away (None) while the worker drains
+            or when admission control (core.admission) rejects it.
+            A client that offers the envelope subprotocol gets binary envelopes (see core.envelope), others text.
+        """
+        if self.draining:
+            await self._turn_away(websocket, DRAIN_CLOSE_CODE, self.drain_retry_after_ms())
+            return None
+        reason = await self.admission.admit()
+        if reason is not None:
+            hint = self.admission.retry_after_ms()
+            if sampler.hit():
+                logger.info("[%s] Rejected a connection (%s), retry in %d ms", os.getpid(), reason.value, hint)
+            await self._turn_away(websocket, ADMISSION_CLOSE_CODE, hint)
+            return None
+        subprotocol = envelope.negotiate(websocket.scope.get("subprotocols", ()))
+        await websocket.accept(subprotocol=subprotocol)
+        client_id = websocket.query_params.get("client_id")
+        if client_id is not None and not CLIENT_ID_PATTERN.fullmatch(client_id):
+            logger.info("[%s] Ignoring an invalid client id %r", os.getpid(), client_id[:80])
+            client_id = None
+        record = self.register(websocket, binary=subprotocol is not None, client_id=client_id)
+        if self.snapshots:
+            self.send_snapshot(websocket)
+        return record
+
+    @staticmethod
+    async def _turn_away(websocket: WebSocket, code: int, retry_after_ms: int):
+        # the close code and the hint only reach the client over an accepted connection,
+        # a close before accept() becomes an HTTP 403
         await websocket.accept()
-        self.active_connections[websocket] = datetime.utcnow() + timedelta(seconds=10)
+        await websocket.close(code=code, reason=f"reconnect_after_ms={retry_after_ms}")
+
+    def drain_retry_after_ms(self) -> int:
+        """
+            A reconnect hint for a client closed by a draining worker, random up to DRAIN_RECONNECT_SPREAD seconds,
+            so the clients of a worker do not all reconnect to the others at once
+        """
+        return int(random.uniform(0, self.reconnect_spread) * 1000)
+
+    def register(self, websocket: WebSocket, binary: bool = False, client_id: str = None) -> Connection:
+        """
+            Registers an accepted connection: it gets a bounded outbound queue (all messages to the client
+            go through send()), a deadline in the scheduler, so broadcasters only touch the connections that are due,
+            and server pings (core.keepalive) that reap it when a pong is missing
+        """
+        metrics.connects.inc()
+        if self._send_semaphore is None:
+            self._send_semaphore = asyncio.Semaphore(int(os.getenv("FANOUT_CONCURRENCY", 1000)))
+        record = self.connections.add(websocket)
+        record.outbound = OutboundQueue(
+            websocket, self, self.outbound_stats, self._send_semaphore,
+            maxsize=self.queue_size, policy=self.overflow_policy, send_timeout=self.send_timeout,
+            binary=binary,
+        )
+        record.deadline = self.scheduler.schedule(record, self.interval)
+        self.keepalive.track(record)
+        if client_id is not None:
+            self.identify(record, client_id)
+        return record
+
+    def identify(self, record: Connection, client_id: str = None) -> str:
+        """
+            Gives the connection a client id (`?client_id=`, or a random one for the `whoami` command) and returns it.
+            A client id belongs to one connection: a newer connection with the same id takes it over.
+            Client listeners are told when an id appears on or leaves this worker, so a directory can route to it.
+        """
+        if record.client_id is not None:
+            return record.client_id
+        client_id = client_id or uuid.uuid4().hex
+        previous = self.clients.get(client_id)
+        self.clients[client_id] = record
+        record.client_id = client_id
+        if previous is None:
+            self._notify_client(client_id, True)
+        return client_id
+
+    def get(self, websocket: WebSocket) -> Optional[Connection]:
+        return self.connections.get(websocket)
+
+    async def disconnect(self, websocket: WebSocket, code: int = None):
+        record = self.connections.get(websocket)
+        if record is not None:
+            self.remove(record, code)
+
+    async def disconnect_many(self, websockets, code: int = None):
+        """
+            Removes a batch of broken connections
+        """
+        records = [record for record in map(self.connections.get, websockets) if record is not None]
+        await self.remove_many(records, code)
+        logger.info("[%s] Disconnected %d broken connections", os.getpid(), len(records))
+
+    def disconnect_later(self, websocket: WebSocket, code: int = None):
+        """
+            Queues a connection whose send failed. The failures of one loop iteration (e.g. the timed-out writers
+            of one fan-out) are disconnected together by disconnect_many on the next one.
+        """
+        self._broken.setdefault(code, []).append(websocket)
+        if self._broken_flush is None:
+            self._broken_flush = asyncio.create_task(self._disconnect_broken())
+
+    async def _disconnect_broken(self):
+        broken, self._broken, self._broken_flush = self._broken, {}, None
+        for code, websockets in broken.items():
+            await self.disconnect_many(websockets, code)
+
+    async def remove_many(self, records, code: int = None):
+        """
+            Removes a batch of connection records, e.g. the rejected sends of one fan-out
+        """
+        for record in records:
+            self.remove(record, code)
+
+    def remove(self, record: Connection, code: int = None, reason: str = None):
+        """
+            Forgets the connection; with a close code the socket is closed as well (with an optional reason)
+        """
+        if not self.connections.remove(record):
+            return
+        metrics.disconnects.inc()
+        self.scheduler.cancel(record)
+        self.keepalive.forget(record)
+        record.outbound.close(code, reason)
+        for topic in record.topics or ():
+            self._leave_topic(record, topic)
+        record.topics = None
+        if record.client_id is not None and self.clients.get(record.client_id) is record:
+            del self.clients[record.client_id]
+            self._notify_client(record.client_id, False)
+        for callback in self._disconnect_listeners:
+            callback(record)
+
+    def add_disconnect_listener(self, callback: Callable[[Connection], None]):
+        """
+            callback(record) is called after a connection was removed, whatever the reason
+        """
+        self._disconnect_listeners.append(callback)
+
+    def remove_disconnect_listener(self, callback: Callable[[Connection], None]):
+        if callback in self._disconnect_listeners:
+            self._disconnect_listeners.remove(callback)
+
+    def add_topic_listener(self, callback: Callable[[str, bool], None]):
+        """
+            callback(topic, active) is called when a topic gets its first local subscriber (True)
+            or loses its last one (False)
+        """
+        self._topic_listeners.append(callback)
+
+    def add_client_listener(self, callback: Callable[[str, bool], None]):
+        """
+            callback(client_id, active) is called when a client id appears on this worker (True) or leaves it (False)
+        """
+        self._client_listeners.append(callback)
+
+    def _notify_client(self, client_id: str, active: bool):
+        for callback in self._client_listeners:
+            callback(client_id, active)
+
+    def send_to_client(self, client_id: str, message) -> bool:
+        """
+            Queues a message for the local connection of a client id, False if the client isn't on this worker
+        """
+        record = self.clients.get(client_id)
+        return record is not None and record.outbound.put(message)
+
+    def send_to_clients(self, client_ids, message) -> int:
+        return sum(self.send_to_client(client_id, message) for client_id in client_ids)
+
+    def subscribe(self, websocket: WebSocket, topic: str) -> bool:
+        """
+            Subscribes the connection to a topic. Topic listeners are told when a topic gets its first local
+            subscriber or loses its last one, so a broadcaster only listens to the topics of this worker.
+        """
+        record = self.connections.get(websocket)
+        if record is None:
+            return False
+        subscribers = self.topics.get(topic)
+        if subscribers is None:
+            subscribers = self.topics[topic] = set()
+            self._notify_topic(topic, True)
+        subscribers.add(record)
+        if record.topics is None:
+            record.topics = set()
+        record.topics.add(topic)
+        return True
+
+    def unsubscribe(self, websocket: WebSocket, topic: str) -> bool:
+        record = self.connections.get(websocket)
+        if record is None or not record.topics or topic not in record.topics:
+            return False
+        record.topics.discard(topic)
+        self._leave_topic(record, topic)
+        return True
+
+    def get_subscribers(self, topic: str) -> Set[Connection]:
+        return self.topics.get(topic, set())
+
+    def get_topics(self, websocket: WebSocket) -> Set[str]:
+        record = self.connections.get(websocket)
+        return (record.topics or set()) if record is not None else set()
+
+    def _leave_topic(self, record: Connection, topic: str):
+        subscribers = self.topics.get(topic)
+        if subscribers is None:
+            return
+        subscribers.discard(record)
+        if not subscribers:
+            del self.topics[topic]
+            self._notify_topic(topic, False)
+
+    def _notify_topic(self, topic: str, active: bool):
+        for callback in self._topic_listeners:
+            callback(topic, active)
+
+    def send(self, websocket: WebSocket, message) -> bool:
+        """
+            Queues a message for the connection without waiting for the socket.
+            Returns False if the connection is gone or its queue rejected the message.
+        """
+        record = self.connections.get(websocket)
+        if record is None:
+            return False
+        return record.outbound.put(message)
+
+    def send_snapshot(self, websocket: WebSocket, topic: str = None) -> bool:
+        """
+            Queues the recent messages (of a topic, or the global broadcasts) as one batch: one text frame
+            with a message per line, or envelopes the writer packs into one binary frame.
+            Broadcasters record what they deliver in `recent` (core.recent); with RECENT_SNAPSHOT=1 a new connection
+            gets the global snapshot and a new subscriber the topic's.
+        """
+        record = self.connections.get(websocket)
+        messages = self.recent.snapshot(topic)
+        if record is None or not messages:
+            return False
+        if record.outbound.binary:
+            return all(record.outbound.put(message) for message in messages)
+        return record.outbound.put("\n".join(messages))
+
+    def mark_recent(self, websocket: WebSocket):
+        """
+            The connection was just notified directly, so it counts as served for the next global broadcast
+        """
+        record = self.connections.get(websocket)
+        if record is not None:
+            record.seq = self.broadcast_seq + 1
+
+    def begin_broadcast(self) -> List[Connection]:
+        """
+            Numbers a new global broadcast and returns the connections that were not served it yet.
+            Every record keeps the number of the last broadcast it was served, so skipping the clients
+            that were just notified (mark_recent) is an integer compare per connection.
+            Nothing awaits in between, so a mark_recent() that arrives during the fan-out
+            applies to the following broadcast instead of being lost.
+        """
+        self.broadcast_seq = seq = self.broadcast_seq + 1
+        targets = []
+        for record in self.connections:
+            if record.seq < seq:
+                record.seq = seq
+                targets.append(record)
+        return targets
 
-    async def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.pop(websocket, None)
+    def reschedule(self, record: Connection, delay: float = None):
+        """
+            Puts the connection back into the scheduler after a scheduled message was sent
+        """
+        if record.index >= 0:
+            delay = self.interval if delay is None else delay
+            record.deadline = self.scheduler.schedule(record, delay)
 
     def has_connections(self) -> bool:
-        return bool(self.active_connections)
+        return bool(self.connections)
 
 
-    def get_connections(self) -> Dict[WebSocket, datetime]:
-        return self.active_connections
+    def get_connections(self) -> Dict[WebSocket, Connection]:
+        return self.connections.by_websocket
 
+    def get_outbound_stats(self) -> dict:
+        """
+            Queue depth and drop counters of this worker
+        """
+        return self.outbound_stats.as_dict()
@@ -0,0 +1,100 @@
+import os
+import struct
+from enum import IntEnum
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from core.frames import PreparedMessage
+
+# Sec-WebSocket-Protocol value a client offers to get binary envelopes instead of text frames
+SUBPROTOCOL = "ws.envelope.v1"
+
+# type, seq, topic length, body length; then the UTF-8 topic and body
+HEADER = struct.Struct("!BIHI")
+
+# messages packed into one binary frame at most
+BATCH_MAX = int(os.getenv("ENVELOPE_BATCH_MAX", 64))
+
+
+class EnvelopeType(IntEnum):
+    """
+        - BROADCAST: a global broadcast (including "Scheduled broadcast").
+        - TOPIC: a message published to the envelope's topic.
+        - REPLY: a direct reply to the connection ("pong", "subscribed <topic>", a resume batch, ...).
+        - COMMAND: client to server, the topic is the command and the body its argument.
+    """
+    BROADCAST = 1
+    TOPIC = 2
+    REPLY = 3
+    COMMAND = 16
+
+
+class Envelope(NamedTuple):
+    type: int
+    seq: int
+    topic: str
+    body: str
+
+
+def negotiate(subprotocols: Iterable[str]) -> Optional[str]:
+    """
+        The subprotocol to accept the connection with: SUBPROTOCOL if the client offered it, None for text
+    """
+    return SUBPROTOCOL if SUBPROTOCOL in subprotocols else None
+
+
+def message_parts(message: str) -> Tuple[int, bytes, bytes]:
+    """
+        (type, topic, body) of a queued message. A PreparedMessage is shared by all recipients,
+        so its parts are encoded once and cached on it; any other str is a reply.
+    """
+    if isinstance(message, PreparedMessage):
+        parts = message.__dict__.get("_parts")
+        if parts is None:
+            if message.topic is None:
+                parts = (EnvelopeType.BROADCAST, b"", message.body.encode("utf-8"))
+            else:
+                parts = (EnvelopeType.TOPIC, message.topic.encode("utf-8"), message.body.encode("utf-8"))
+            message.__dict__["_parts"] = parts
+        return parts
+    return EnvelopeType.REPLY, b"", message.encode("utf-8")
+
+
+def encode(type: int, seq: int, topic: str = "", body: str = "") -> bytes:
+    topic, body = topic.encode("utf-8"), body.encode("utf-8")
+    return HEADER.pack(type, seq, len(topic), len(body)) + topic + body
+
+
+def encode_batch(messages: Sequence[str], seq: int) -> bytes:
+    """
+        Packs queued messages into the payload of one binary frame, numbered seq + 1, seq + 2, ...
+    """
+    chunks = []
+    for message in messages:
+        seq = (seq + 1) & 0xFFFFFFFF
+        type, topic, body = message_parts(message)
+        chunks += (HEADER.pack(type, seq, len(topic), len(body)), topic, body)
+    return b"".join(chunks)
+
+
+def decode(payload: bytes) -> List[Envelope]:
+    """
+        Splits a binary frame into its envelopes, raises ValueError on a truncated or malformed frame
+    """
+    envelopes = []
+    offset, size = 0, len(payload)
+    while offset < size:
+        if size - offset < HEADER.size:
+            raise ValueError("truncated envelope header")
+        type, seq, topic_length, body_length = HEADER.unpack_from(payload, offset)
+        offset += HEADER.size
+        end = offset + topic_length + body_length
+        if end > size:
+            raise ValueError("truncated envelope")
+        try:
+            topic = payload[offset:offset + topic_length].decode("utf-8")
+            body = payload[offset + topic_length:end].decode("utf-8")
+        except UnicodeDecodeError as e:
+            raise ValueError(str(e)) from None
+        envelopes.append(Envelope(type, seq, topic, body))
+        offset = end
+    return envelopes
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, List
+
+from core import metrics
+from core.connection_manager import ConnectionManager
+from core.frames import PreparedMessage
+from core.outbound import SLOW_CONSUMER_CLOSE_CODE
+
+logger = logging.getLogger('socket_logger')
+
+
+@dataclass
+class FanOutResult:
+    targets: int = 0
+    sent: int = 0
+    failed: List = field(default_factory=list)
+    duration: float = 0.0
+
+    @property
+    def failed_count(self) -> int:
+        return len(self.failed)
+
+
+class FanOut:
+    """
+        Delivers one message to many connection records without waiting for any of them.
+        - the message is put into every connection's bounded outbound queue; the per-connection writer tasks
+          send concurrently, at most FANOUT_CONCURRENCY at a time and each bounded by FANOUT_SEND_TIMEOUT,
+          so a client with a full TCP window only delays its own queue.
+        - the message is wrapped once into a PreparedMessage, so its frame is encoded once for all recipients.
+        - connections whose queue rejected the message (slow consumers under the disconnect policy)
+          are disconnected from the manager in one batch.
+        - broadcast() can phase-spread a global broadcast over BROADCAST_SPREAD seconds: connection `id % slots`
+          picks one of BROADCAST_SPREAD_SLOTS slices, so every connection keeps a fixed offset into the period
+          (and the same cadence) while the worker sends 1/slots of the broadcast at a time instead of all at once.
+    """
+
+    def __init__(self, name: str = "default"):
+        self._manager = ConnectionManager()
+        self.spread = float(os.getenv("BROADCAST_SPREAD", 0))
+        self.slots = int(os.getenv("BROADCAST_SPREAD_SLOTS", 20))
+        self._spreading = set()
+        self._duration = metrics.fanout_duration.labels(metrics.worker, name)
+        self._failures = metrics.fanout_failures.labels(metrics.worker, name)
+
+    async def send(self, targets: Iterable, message: str) -> FanOutResult:
+        started = time.perf_counter()
+        result = FanOutResult()
+        if not isinstance(message, PreparedMessage):
+            message = PreparedMessage(message)
+
+        for record in targets:
+            result.targets += 1
+            if record.outbound.put(message):
+                result.sent += 1
+            else:
+                result.failed.append(record)
+
+        if result.failed:
+            await self._manager.remove_many(result.failed, code=SLOW_CONSUMER_CLOSE_CODE)
+
+        result.duration = time.perf_counter() - started
+        self._duration.observe(result.duration)
+        if result.failed:
+            self._failures.inc(result.failed_count)
+        logger.info(
+            "[%s] Fan-out of %r to %d sockets: queued %d, failed %d in %.1f ms",
+            os.getpid(), message, result.targets, result.sent, result.failed_count, result.duration * 1000,
+        )
+        return result
+
+    async def broadcast(self, targets: Iterable, message: str):
+        """
+            Sends a global broadcast at once, or in the background spread over `spread` seconds when it is enabled
+        """
+        if self.spread <= 0 or self.slots < 2:
+            await self.send(targets, message)
+            return
+        if not isinstance(message, PreparedMessage):
+            message = PreparedMessage(message)
+        task = asyncio.create_task(self._send_spread(list(targets), message))
+        self._spreading.add(task)
+        task.add_done_callback(self._spreading.discard)
+
+    async def _send_spread(self, targets: List, message: PreparedMessage):
+        slots = [[] for _ in range(self.slots)]
+        for record in targets:
+            slots[record.id % self.slots].append(record)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        step = self.spread / self.slots
+        for i, slot in enumerate(slots):
+            delay = started + i * step - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # connections may have gone while waiting for their slot
+            slot = [record for record in slot if record.index >= 0]
+            if slot:
+                await self.send(slot, message)
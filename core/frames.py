@@ -0,0 +1,229 @@
+import os
+import struct
+import zlib
+from typing import Optional
+
+from websockets.protocol import State
+
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_PING = 0x9
+
+PROTOCOL_SCOPE_KEY = "ws.protocol"
+
+# payloads below this size go out uncompressed even to permessage-deflate connections
+DEFLATE_MIN_SIZE = int(os.getenv("BROADCAST_COMPRESSION_MIN_SIZE", 1024))
+DEFLATE_MEM_LEVEL = 5
+
+# a Z_SYNC_FLUSH ends with an empty stored block, permessage-deflate leaves it out
+_EMPTY_BLOCK = b"\x00\x00\xff\xff"
+
+
+def encode_frame(payload: bytes, opcode: int = OP_TEXT, rsv1: bool = False) -> bytes:
+    """
+        Builds a complete, unmasked (server to client) WebSocket frame: header plus payload.
+    """
+    head = 0x80 | opcode | (0x40 if rsv1 else 0)
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", head, length)
+    elif length < 65536:
+        header = struct.pack("!BBH", head, 126, length)
+    else:
+        header = struct.pack("!BBQ", head, 127, length)
+    return header + payload
+
+
+def deflate(payload: bytes, wbits: int) -> bytes:
+    """
+        Compresses one message for permessage-deflate without context takeover: a fresh raw deflate stream
+        with the connection's window size, sync-flushed and without the trailing empty block.
+    """
+    encoder = zlib.compressobj(wbits=-wbits, memLevel=DEFLATE_MEM_LEVEL)
+    data = encoder.compress(payload) + encoder.flush(zlib.Z_SYNC_FLUSH)
+    return data[:-4] if data.endswith(_EMPTY_BLOCK) else data
+
+
+def build_frame(payload: bytes, opcode: int = OP_TEXT, deflate_wbits: int = 0) -> bytes:
+    """
+        A complete frame for a connection with shared-deflate window bits `deflate_wbits` (0 = no compression).
+        Small payloads, and payloads that don't get smaller, are sent uncompressed, which permessage-deflate allows.
+    """
+    if deflate_wbits and len(payload) >= DEFLATE_MIN_SIZE:
+        compressed = deflate(payload, deflate_wbits)
+        if len(compressed) < len(payload):
+            return encode_frame(compressed, opcode, rsv1=True)
+    return encode_frame(payload, opcode)
+
+
+class PreparedMessage(str):
+    """
+        A broadcast message that is encoded at most once.
+        It still is the original str (coalescing, fallback send_text() and logging keep working),
+        and `frame` holds the UTF-8 text frame built on first use and shared by every recipient.
+        frame_for() also builds the compressed frame for permessage-deflate connections without context takeover
+        once per window size, so a large broadcast is deflated once instead of once per connection.
+        A topic message is the text "<topic>: <body>" and keeps `topic` and `body` apart for binary envelopes
+        (see core.envelope); for a broadcast `topic` is None and `body` the text itself.
+    """
+
+    def __new__(cls, text: str, topic: str = None, body: str = None):
+        message = super().__new__(cls, text)
+        message.topic = topic
+        message.body = text if body is None else body
+        return message
+
+    @classmethod
+    def for_topic(cls, topic: str, body: str, prefix: str = "") -> "PreparedMessage":
+        return cls(f"{prefix}{topic}: {body}", topic=topic, body=f"{prefix}{body}")
+
+    @property
+    def frame(self) -> bytes:
+        return self.frame_for(0)
+
+    def frame_for(self, deflate_wbits: int) -> bytes:
+        frames = self.__dict__.get("_frames")
+        if frames is None:
+            frames = self.__dict__["_frames"] = {}
+        frame = frames.get(deflate_wbits)
+        if frame is None:
+            frame = frames[deflate_wbits] = build_frame(self.encode("utf-8"), OP_TEXT, deflate_wbits)
+        return frame
+
+
+def _extensions(protocol) -> Optional[list]:
+    if hasattr(protocol, "drain") and hasattr(protocol, "open") and getattr(protocol, "is_client", True) is False:
+        return protocol.extensions
+    conn = getattr(protocol, "conn", None)
+    if conn is not None and hasattr(protocol, "writable"):
+        return conn.extensions
+    return None
+
+
+def frame_deflate(protocol) -> Optional[int]:
+    """
+        How prepared frames are compressed for the connection: 0 without extensions, the window bits
+        for permessage-deflate without server context takeover (every message is compressed on its own,
+        so the same compressed frame fits every such connection), None if it needs per-connection framing.
+    """
+    extensions = _extensions(protocol)
+    if extensions is None:
+        return None
+    if not extensions:
+        return 0
+    if len(extensions) == 1 and getattr(extensions[0], "local_no_context_takeover", False):
+        return extensions[0].local_max_window_bits
+    return None
+
+
+def is_open(protocol) -> bool:
+    conn = getattr(protocol, "conn", None)
+    if conn is not None:
+        return conn.state is State.OPEN
+    return protocol.open
+
+
+def raw_protocol(websocket) -> Optional[object]:
+    """
+        Returns the server protocol of the connection if prepared frames can be written to its transport directly:
+        uvicorn's `websockets` or `websockets-sansio` implementation, exposed by ProtocolScopeMiddleware,
+        without extensions or with shared permessage-deflate (see frame_deflate()).
+        Other extensions (e.g. deflate with context takeover) need per-connection framing and get None.
+    """
+    protocol = getattr(websocket, "scope", {}).get(PROTOCOL_SCOPE_KEY)
+    if protocol is None or getattr(protocol, "transport", None) is None:
+        return None
+    if frame_deflate(protocol) is None:
+        return None
+    return protocol
+
+
+def ping_protocol(websocket) -> Optional[object]:
+    """
+        Returns the server protocol of the connection if it can send protocol-level pings:
+        uvicorn's `websockets` (ping()) or `websockets-sansio` (conn.send_ping()) implementation.
+        Extensions don't matter for control frames.
+    """
+    protocol = getattr(websocket, "scope", {}).get(PROTOCOL_SCOPE_KEY)
+    if protocol is None or getattr(protocol, "transport", None) is None:
+        return None
+    if hasattr(protocol, "ping") and getattr(protocol, "is_client", True) is False:
+        return protocol
+    if hasattr(getattr(protocol, "conn", None), "send_ping") and hasattr(protocol, "pending_ping_payload"):
+        return protocol
+    return None
+
+
+def stop_server_keepalive(protocol):
+    """
+        Stops the ping loop of uvicorn's own keepalive (--ws-ping-interval) on a protocol returned by ping_protocol(),
+        for a connection that core.keepalive pings instead: `uvicorn app:app` without `--ws-ping-interval 0`
+        would ping every connection twice, and the sans-I/O protocol tracks a single ping in flight.
+    """
+    if hasattr(protocol, "stop_keepalive"):
+        protocol.stop_keepalive()
+        protocol.ping_interval = None
+        return
+    task = getattr(protocol, "keepalive_ping_task", None)
+    if task is not None:
+        task.cancel()
+
+
+class SansIOPong:
+    """
+        Pong waiter for uvicorn's sans-I/O protocol: its handle_pong() clears `pending_ping_payload`
+        when the pong for that payload arrives.
+    """
+    __slots__ = ("protocol", "payload")
+
+    def __init__(self, protocol, payload: bytes):
+        self.protocol = protocol
+        self.payload = payload
+
+    def done(self) -> bool:
+        return self.protocol.pending_ping_payload is not self.payload
+
+
+async def send_ping(protocol):
+    """
+        Sends a ping on a protocol returned by ping_protocol(); returns an object whose done() is True once
+        the pong arrived
+    """
+    if hasattr(protocol, "ping"):
+        return await protocol.ping()
+    payload = os.urandom(4)
+    protocol.conn.send_ping(payload)
+    protocol.pending_ping_payload = payload
+    protocol.ping_sent_at = protocol.loop.time()
+    protocol.transport.write(b"".join(protocol.conn.data_to_send()))
+    return SansIOPong(protocol, payload)
+
+
+async def write_frame(protocol, frame: bytes):
+    """
+        Writes a prepared frame to the protocol's transport and waits for the write buffer to drain.
+    """
+    transport = protocol.transport
+    if transport.is_closing() or not is_open(protocol):
+        raise ConnectionError("connection is closing")
+    transport.write(frame)
+    if hasattr(protocol, "drain"):
+        await protocol.drain()
+    else:
+        # sans-I/O: pause_writing() clears `writable` until the buffer drained
+        await protocol.writable.wait()
+
+
+class ProtocolScopeMiddleware:
+    """
+        ASGI middleware that stores the server protocol instance in the WebSocket scope,
+        the uvicorn send callable is a bound method of it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            scope[PROTOCOL_SCOPE_KEY] = getattr(send, "__self__", None)
+        await self.app(scope, receive, send)
@@ -0,0 +1,99 @@
+import logging
+import os
+
+from core import metrics
+from core.frames import ping_protocol, send_ping, stop_server_keepalive
+from core.scheduler import DeadlineScheduler
+
+logger = logging.getLogger('socket_logger')
+
+# 1011: the close code websockets uses for a keepalive ping timeout
+KEEPALIVE_CLOSE_CODE = 1011
+
+# record.pong of a connection that could not be pinged because its write buffer was full
+_STALLED = object()
+
+
+class Keepalive:
+    """
+        Server-initiated protocol pings for every connection, driven by a DeadlineScheduler:
+        one loop for the worker, no task or timer per connection.
+        - every `interval` seconds a connection gets a ping (core.frames.send_ping), its pong waiter is kept
+          on the record and the connection is due again `timeout` seconds later.
+        - if the pong has not arrived by then, the connection is reaped; the dead connections of one tick
+          are removed in one batch with close code 1011.
+        - a connection whose transport is over its write high-water mark is not pinged (the ping would wait
+          for the buffer); if it is still over the mark at the next check, it is reaped like a missing pong.
+        Connections without a ping-capable protocol (e.g. other ASGI servers) are not tracked;
+        a tracked connection has uvicorn's own ping loop stopped (core.frames.stop_server_keepalive).
+    """
+
+    def __init__(self, manager, interval: float = None, timeout: float = None):
+        self._manager = manager
+        self.interval = float(os.getenv("KEEPALIVE_INTERVAL", 20)) if interval is None else interval
+        self.timeout = float(os.getenv("KEEPALIVE_TIMEOUT", 10)) if timeout is None else timeout
+        self.scheduler = DeadlineScheduler(resolution=0.25)
+        self.pings = 0
+        self.reaped = 0
+        metrics.register_callback("ws_keepalive_pings_total", "Keepalive pings sent", lambda: self.pings, kind="counter")
+        metrics.register_callback("ws_keepalive_reaped_total", "Connections reaped for a missing pong",
+                                  lambda: self.reaped, kind="counter")
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def track(self, record):
+        if not self.enabled:
+            return
+        protocol = ping_protocol(record.websocket)
+        if protocol is not None:
+            stop_server_keepalive(protocol)
+            self.scheduler.schedule(record, self.interval)
+
+    def forget(self, record):
+        self.scheduler.cancel(record)
+        record.pong = None
+
+    async def run(self):
+        pid = os.getpid()
+        while True:
+            due = await self.scheduler.wait_due()
+            dead = []
+            for record in due:
+                if record.index < 0:
+                    continue
+                pong = record.pong
+                if pong is not None and pong is not _STALLED:
+                    if not pong.done():
+                        dead.append(record)
+                        continue
+                    record.pong = None
+                    self.scheduler.schedule(record, max(0.0, self.interval - self.timeout))
+                    continue
+                if not await self._ping(record, stalled=pong is _STALLED):
+                    dead.append(record)
+
+            if dead:
+                self.reaped += len(dead)
+                await self._manager.remove_many(dead, code=KEEPALIVE_CLOSE_CODE)
+                logger.info("[%s] Reaped %d connections without pong", pid, len(dead))
+
+    async def _ping(self, record, stalled: bool = False) -> bool:
+        protocol = ping_protocol(record.websocket)
+        transport = protocol.transport if protocol is not None else None
+        if transport is None or transport.is_closing():
+            return False
+        if transport.get_write_buffer_size() >= transport.get_write_buffer_limits()[1]:
+            if stalled:
+                return False
+            record.pong = _STALLED
+            self.scheduler.schedule(record, self.timeout)
+            return True
+        self.scheduler.schedule(record, self.timeout)
+        try:
+            record.pong = await send_ping(protocol)
+        except Exception:
+            return False
+        self.pings += 1
+        return True
@@ -0,0 +1,183 @@
+import os
+import socket
+from typing import Optional, Tuple
+
+from redis_client import get_redis
+
+
+ACQUIRE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+
+local current = redis.call('GET', KEYS[1])
+if not current then
+    current = ARGV[1] .. ' ' .. redis.call('INCR', KEYS[2])
+    redis.call('SET', KEYS[1], current, 'PX', ARGV[2])
+elseif string.sub(current, 1, #ARGV[1] + 1) == ARGV[1] .. ' ' then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+
+local last = redis.call('GET', KEYS[3])
+local since = -1
+if last then
+    since = now - tonumber(last)
+end
+return {current, tostring(since)}
+"""
+
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+FENCED_PUBLISH_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return -1
+end
+local now = redis.call('TIME')
+redis.call('SET', KEYS[2], now[1] .. '.' .. string.format('%06d', tonumber(now[2])))
+return redis.call('PUBLISH', ARGV[2], ARGV[3])
+"""
+
+FENCED_XADD_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return false
+end
+local now = redis.call('TIME')
+redis.call('SET', KEYS[2], now[1] .. '.' .. string.format('%06d', tonumber(now[2])))
+return redis.call('XADD', KEYS[3], 'MAXLEN', '~', ARGV[2], '*', 'data', ARGV[3], 'fence', ARGV[4])
+"""
+
+
+def parse_holder(value: Optional[str]) -> Tuple[Optional[str], int]:
+    """
+        "<owner> <token>" -> (owner, token), (None, 0) for a free lease
+    """
+    if not value:
+        return None, 0
+    owner, _, token = value.rpartition(" ")
+    return owner, int(token)
+
+
+class Lease:
+    """
+        A leadership lease in Redis with fencing tokens, replacing `SET broadcast_lock NX EX` + blind `expire`:
+        - acquire() takes a free lease with a fresh token from a counter (INCR), so every new leader
+          has a larger token than all the previous ones; the lease value is "<owner> <token>".
+        - renew() is a compare-and-set: it extends the lease only if it still holds this owner's token,
+          so a leader that stalled past the TTL finds out instead of extending somebody else's lease.
+        - publish() / xadd() are fenced on the Redis side (refused unless the lease is still ours)
+          and carry the token, so receivers can also drop messages from a superseded leader.
+        - the fenced writes record the time of the last broadcast, acquire() returns the time since then,
+          so a new leader keeps the broadcast cadence of the old one.
+        Standbys call acquire() every `poll_interval` seconds (at most 1s), which both takes over an expired
+        lease and reports the current holder.
+    """
+
+    def __init__(self, client=None, owner: str = None, key: str = "broadcast_lock", ttl: float = 3.0):
+        self._redis = client or get_redis()
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.key = key
+        self.ttl = ttl
+        self.poll_interval = min(1.0, ttl / 3)
+        self.token: Optional[int] = None
+        self.holder: Optional[str] = None
+        self.since_last_broadcast: Optional[float] = None
+        self._acquire = self._redis.register_script(ACQUIRE_SCRIPT)
+        self._renew = self._redis.register_script(RENEW_SCRIPT)
+        self._release = self._redis.register_script(RELEASE_SCRIPT)
+        self._publish = self._redis.register_script(FENCED_PUBLISH_SCRIPT)
+        self._xadd = self._redis.register_script(FENCED_XADD_SCRIPT)
+        self.scripts = (self._acquire, self._renew, self._release, self._publish, self._xadd)
+
+    @property
+    def token_key(self) -> str:
+        return f"{self.key}:token"
+
+    @property
+    def last_broadcast_key(self) -> str:
+        return f"{self.key}:last"
+
+    @property
+    def is_held(self) -> bool:
+        return self.token is not None
+
+    @property
+    def _value(self) -> str:
+        return f"{self.owner} {self.token}"
+
+    @property
+    def _ttl_ms(self) -> int:
+        return int(self.ttl * 1000)
+
+    async def acquire(self) -> Optional[int]:
+        """
+            Takes the lease if it is free (or already ours) and returns our token, None if somebody else holds it.
+            Either way `holder` is the current "<owner> <token>".
+        """
+        current, since = await self._acquire(
+            keys=[self.key, self.token_key, self.last_broadcast_key], args=[self.owner, self._ttl_ms])
+        owner, token = parse_holder(current)
+        self.holder = current
+        self.since_last_broadcast = None if float(since) < 0 else float(since)
+        self.token = token if owner == self.owner else None
+        return self.token
+
+    async def renew(self) -> bool:
+        if self.token is None:
+            return False
+        return self.renewed(await self._renew(keys=[self.key], args=[self._value, self._ttl_ms]))
+
+    def queue_renew(self, pipeline):
+        """
+            Queues the renewal on a pipeline as a bare EVALSHA, for a caller that batches it with other commands;
+            the script must be loaded already (a NOSCRIPT error is the caller's to handle, e.g. by calling renew())
+        """
+        pipeline.evalsha(self._renew.sha, 1, self.key, self._value, self._ttl_ms)
+
+    def renewed(self, result) -> bool:
+        if result:
+            return True
+        self.token = None
+        return False
+
+    async def release(self) -> bool:
+        if self.token is None:
+            return False
+        released = await self._release(keys=[self.key], args=[self._value])
+        self.token = None
+        return bool(released)
+
+    async def publish(self, channel: str, message: str) -> bool:
+        """
+            PUBLISHes "<token> <message>" if the lease is still ours, otherwise gives the lease up and returns False
+        """
+        if self.token is None:
+            return False
+        result = await self._publish(
+            keys=[self.key, self.last_broadcast_key], args=[self._value, channel, f"{self.token} {message}"])
+        if int(result) < 0:
+            self.token = None
+            return False
+        return True
+
+    async def xadd(self, stream: str, message: str, maxlen: int) -> Optional[str]:
+        """
+            XADDs {data, fence} if the lease is still ours and returns the entry id, otherwise gives the lease up
+        """
+        if self.token is None:
+            return None
+        entry_id = await self._xadd(
+            keys=[self.key, self.last_broadcast_key, stream], args=[self._value, maxlen, message, self.token])
+        if entry_id is None:
+            self.token = None
+        return entry_id
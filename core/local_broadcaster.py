@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from core import metrics
+from core.connection_manager import ConnectionManager
+from core.fanout import FanOut
+from core.frames import PreparedMessage
+from core.local_bus import LocalBus
+
+logger = logging.getLogger('socket_logger')
+
+
+class LocalBusBroadcaster:
+    """
+        Multi-worker broadcasting for a single host without Redis.
+        The workers exchange broadcasts over a LocalBus (Unix socket or loopback hub),
+        the worker that hosts the hub is the leader and publishes the scheduled broadcast
+        while any worker of the host has connections.
+        Delivery works like RedisBroadcaster: everybody except the recently notified clients (by broadcast sequence),
+        topic messages only to the topic's subscribers.
+    """
+
+    def __init__(self, address: str = None):
+        self._manager = ConnectionManager()
+        self._fanout = FanOut("local")
+        self._bus = LocalBus(self._deliver, address=address)
+        self._bus_task = None
+        self._publish_task = None
+        self._state_task = None
+        self._state_changed = asyncio.Event()
+
+    def mark_recent(self, websocket):
+        """
+            An implementation of an interface to indicate a connection to which a response should be sent immediately
+        """
+        self._manager.mark_recent(websocket)
+
+    def start(self):
+        if not self._bus_task:
+            self._bus_task = asyncio.create_task(self._bus.run())
+        if not self._publish_task:
+            self._publish_task = asyncio.create_task(self.publisher_loop())
+        if not self._state_task:
+            self._manager.add_topic_listener(self._on_topic_change)
+            self._state_task = asyncio.create_task(self.state_loop())
+
+    async def stop(self):
+        """
+            Stops publishing and reports no connections to the hub, so the host stops counting this worker.
+            A hub worker steps down at once, like the Redis lease is released: a standby takes the hub over
+            and publishes the scheduled broadcasts, and this worker follows it while its connections drain.
+        """
+        for task in (self._publish_task, self._state_task):
+            if task:
+                task.cancel()
+        await self._bus.update_state(0, set())
+        was_leader = self._bus.is_leader
+        self._bus.step_down()
+        if was_leader:
+            metrics.is_leader.set(0)
+            logger.info("[%s] Stepped down as the local bus hub", os.getpid())
+            self._bus_task = asyncio.create_task(self._bus.run())
+
+    @property
+    def is_leader(self) -> bool:
+        return self._bus.is_leader
+
+    @property
+    def ready(self) -> bool:
+        """
+            The worker hosts the hub or is connected to it, so it receives the host's broadcasts
+        """
+        return self._bus.connected
+
+    async def publish(self, topic: str, message: str):
+        await self._bus.publish(topic, message)
+
+    async def publish_broadcast(self, message: str):
+        await self._bus.publish(None, message)
+
+    async def _deliver(self, topic: Optional[str], data: str):
+        if topic is not None:
+            message = PreparedMessage.for_topic(topic, data)
+            self._manager.recent.add(message)
+            await self._fanout.send(self._manager.get_subscribers(topic), message)
+            return
+
+        logger.info("[%s] Received message from the local bus: %s", os.getpid(), data)
+        message = PreparedMessage(data)
+        self._manager.recent.add(message)
+        await self._fanout.broadcast(self._manager.begin_broadcast(), message)
+
+    def _on_topic_change(self, topic: str, active: bool):
+        self._state_changed.set()
+
+    async def state_loop(self):
+        """
+            Reports the connection count and topics of this worker to the hub:
+            at once when topics change, at least every second otherwise
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self._state_changed.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+            self._state_changed.clear()
+            try:
+                await self._bus.update_state(len(self._manager.connections), set(self._manager.topics))
+            except Exception as e:
+                logger.error("[%s] Failed to report state to the local bus: %s", os.getpid(), e)
+
+    async def publisher_loop(self):
+        """
+            Only the hub worker publishes "Scheduled broadcast", once every 10 seconds
+        """
+        pid = os.getpid()
+        await self._bus.wait_leader()
+        logger.info("[%s] I'm the leader", pid)
+        metrics.is_leader.set(1)
+        metrics.set_leader(f"{pid}")
+
+        while True:
+            await asyncio.sleep(10)
+            try:
+                if self._bus.total_connections():
+                    await self.publish_broadcast("Scheduled broadcast")
+                    logger.info("[%s] Published Scheduled broadcast", pid)
+                else:
+                    logger.info("[%s] No active clients. Skipping.", pid)
+            except Exception as e:
+                logger.error("Failed to publish: %s", e)
+
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import tempfile
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger('socket_logger')
+
+LINE_LIMIT = 16 * 1024 * 1024
+
+
+def default_address() -> str:
+    if fcntl is not None and hasattr(socket, "AF_UNIX"):
+        return os.path.join(tempfile.gettempdir(), "ws_broadcast.sock")
+    return "tcp://127.0.0.1:8765"
+
+
+class _Peer:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.connections = 0
+        self.topics: Set[str] = set()
+
+
+class LocalBus:
+    """
+        A message bus between the uvicorn workers of one host, without Redis.
+        The worker that wins the election hosts the hub; the others connect to it and send their state
+        (connection count, topics of interest) and their publishes. The hub routes every message to itself
+        and to the workers interested in it, as JSON lines.
+        - `address` is a Unix socket path (election by an exclusive flock on `<path>.lock`)
+          or `tcp://127.0.0.1:<port>` where flock or Unix sockets are missing (election by binding the port).
+        - when the hub dies, the followers see EOF at once, one of them wins the next election
+          and the others reconnect to it.
+    """
+
+    def __init__(self, on_message: Callable[[Optional[str], str], Awaitable[None]], address: str = None,
+                 retry_delay: float = 0.1):
+        self.address = address or os.getenv("LOCAL_BUS_ADDRESS") or default_address()
+        self.retry_delay = retry_delay
+        self.is_leader = False
+        self.can_lead = True
+        self._on_message = on_message
+        self._peers: Dict[asyncio.StreamWriter, _Peer] = {}
+        self._hub_writer: Optional[asyncio.StreamWriter] = None
+        self._server = None
+        self._lock_fd = None
+        self._connections = 0
+        self._topics: Set[str] = set()
+        self._became_leader = asyncio.Event()
+
+    async def run(self):
+        pid = os.getpid()
+        while not self.is_leader:
+            if self.can_lead and await self._try_lead():
+                self.is_leader = True
+                self._became_leader.set()
+                logger.info("[%s] I'm the local bus hub on %s", pid, self.address)
+                return
+
+            try:
+                reader, writer = await self._open_connection()
+            except OSError:
+                await asyncio.sleep(self.retry_delay)
+                continue
+
+            logger.info("[%s] Connected to the local bus hub on %s", pid, self.address)
+            self._hub_writer = writer
+            await self._write(writer, self._state())
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    message = json.loads(line)
+                    await self._on_message(message.get("topic"), message["data"])
+            except (OSError, ValueError) as e:
+                logger.error("[%s] Local bus connection failed: %s", pid, e)
+            finally:
+                self._hub_writer = None
+                writer.close()
+            logger.info("[%s] Local bus hub is gone, re-electing", pid)
+
+    async def wait_leader(self):
+        await self._became_leader.wait()
+
+    @property
+    def connected(self) -> bool:
+        return self.is_leader or self._hub_writer is not None
+
+    def total_connections(self) -> int:
+        """
+            Connections on every worker of the host, known to the hub only
+        """
+        return self._connections + sum(peer.connections for peer in self._peers.values())
+
+    async def update_state(self, connections: int, topics: Set[str]):
+        """
+            Tells the hub how many connections and which topics this worker has
+        """
+        changed = connections != self._connections or topics != self._topics
+        self._connections = connections
+        self._topics = set(topics)
+        if changed and self._hub_writer is not None:
+            await self._write(self._hub_writer, self._state())
+
+    async def publish(self, topic: Optional[str], data: str):
+        message = {"type": "publish", "topic": topic, "data": data}
+        if self.is_leader:
+            await self._route(message)
+        elif self._hub_writer is not None:
+            await self._write(self._hub_writer, message)
+        else:
+            raise ConnectionError("local bus hub is not reachable")
+
+    def step_down(self):
+        """
+            Gives the hub up for good (a draining worker): the server and the election lock are released first,
+            then the followers see EOF and one of them wins the next election.
+            run() again joins the new hub as a follower, this bus never competes for it again.
+        """
+        self.can_lead = False
+        if not self.is_leader:
+            return
+        self.is_leader = False
+        self._became_leader.clear()
+        self._release_hub()
+        for writer in list(self._peers):
+            writer.close()
+        self._peers.clear()
+
+    def close(self):
+        self._release_hub()
+        for writer in list(self._peers):
+            writer.close()
+        if self._hub_writer is not None:
+            self._hub_writer.close()
+
+    def _release_hub(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _state(self) -> dict:
+        return {"type": "state", "connections": self._connections, "topics": sorted(self._topics)}
+
+    def _tcp_address(self):
+        host, _, port = self.address[len("tcp://"):].rpartition(":")
+        return host, int(port)
+
+    async def _open_connection(self):
+        if self.address.startswith("tcp://"):
+            host, port = self._tcp_address()
+            return await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+        return await asyncio.open_unix_connection(self.address, limit=LINE_LIMIT)
+
+    async def _try_lead(self) -> bool:
+        if self.address.startswith("tcp://"):
+            host, port = self._tcp_address()
+            try:
+                self._server = await asyncio.start_server(self._serve_peer, host, port, limit=LINE_LIMIT)
+            except OSError:
+                return False
+            return True
+
+        fd = os.open(self.address + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+
+        self._lock_fd = fd
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self._server = await asyncio.start_unix_server(self._serve_peer, path=self.address, limit=LINE_LIMIT)
+        return True
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = self._peers[writer] = _Peer(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if message["type"] == "state":
+                    peer.connections = message["connections"]
+                    peer.topics = set(message["topics"])
+                elif message["type"] == "publish":
+                    await self._route(message)
+        except (OSError, ValueError) as e:
+            logger.error("[%s] Local bus peer failed: %s", os.getpid(), e)
+        finally:
+            self._peers.pop(writer, None)
+            writer.close()
+
+    async def _route(self, message: dict):
+        topic = message["topic"]
+        line = json.dumps({"topic": topic, "data": message["data"]}).encode() + b"\n"
+        for writer, peer in list(self._peers.items()):
+            if topic is None or topic in peer.topics:
+                try:
+                    writer.write(line)
+                    await writer.drain()
+                except OSError:
+                    self._peers.pop(writer, None)
+        if topic is None or topic in self._topics:
+            await self._on_message(topic, message["data"])
+
+    async def _write(self, writer: asyncio.StreamWriter, message: dict):
+        writer.write(json.dumps(message).encode() + b"\n")
+        await writer.drain()
@@ -0,0 +1,201 @@
+import asyncio
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    """
+        Base of the metric families. Children per label values are created once (labels()) and kept by the caller,
+        so the hot path only touches plain attributes: no locks (one event loop per worker) and no allocations.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._children.items():
+            lines.extend(self._render_child(_labels(self.labelnames, values), child))
+        return lines
+
+    def _render_child(self, labels: str, child) -> List[str]:
+        return [f"{self.name}{labels} {child.value}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+
+class CallbackGauge(Metric):
+    """
+        A gauge (or counter) whose value is read from a callback at scrape time, for state that already exists
+        (connection count, outbound queue counters), so nothing is updated on the hot path.
+    """
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float], kind: str = "gauge"):
+        super().__init__(name, documentation, ("worker",))
+        self.kind = kind
+        self._callback = callback
+        self._children[(worker,)] = None
+
+    def _render_child(self, labels: str, child) -> List[str]:
+        return [f"{self.name}{labels} {self._callback()}"]
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _Histogram(self.buckets)
+
+    def _render_child(self, labels: str, child) -> List[str]:
+        inner = labels[1:-1] + "," if labels else ""
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{self.name}_bucket{{{inner}le="{le}"}} {cumulative}')
+        lines.append(f"{self.name}_sum{labels} {child.sum}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+worker = str(os.getpid())
+
+connects = registry.register(Counter("ws_connects_total", "Accepted WebSocket connections", ("worker",))).labels(worker)
+disconnects = registry.register(Counter("ws_disconnects_total", "Removed WebSocket connections", ("worker",))).labels(worker)
+fanout_duration = registry.register(Histogram(
+    "ws_fanout_duration_seconds", "Time to hand one broadcast to every recipient", ("worker", "broadcaster")))
+fanout_failures = registry.register(Counter(
+    "ws_fanout_failed_sends_total", "Recipients rejected by a fan-out", ("worker", "broadcaster")))
+redis_latency = registry.register(Histogram(
+    "ws_redis_latency_seconds", "Round trip of periodic Redis operations", ("worker", "operation")))
+stale_leader_drops = registry.register(Counter(
+    "ws_stale_leader_messages_total", "Broadcasts dropped because their fencing token was superseded",
+    ("worker",))).labels(worker)
+leader = registry.register(Gauge("ws_leader", "Current broadcast leader as seen by this worker", ("worker", "leader")))
+is_leader = registry.register(Gauge("ws_is_leader", "1 if this worker is the broadcast leader", ("worker",))).labels(worker)
+throttled_frames = registry.register(Counter(
+    "ws_throttled_frames_total", "Inbound frames over their command's rate limit", ("worker", "command")))
+throttle_closes = registry.register(Counter(
+    "ws_throttle_closes_total", "Connections closed for exceeding a rate limit", ("worker",))).labels(worker)
+admission_rejected = registry.register(Counter(
+    "ws_admission_rejected_total", "Handshakes turned away with 1013 by admission control", ("worker", "reason")))
+admission_queued = registry.register(Counter(
+    "ws_admission_queued_total", "Handshakes held back by the accept-rate limiter", ("worker",))).labels(worker)
+draining = registry.register(Gauge("ws_draining", "1 while the worker drains for shutdown", ("worker",))).labels(worker)
+loop_lag = registry.register(Gauge("ws_event_loop_lag_seconds", "Last measured event loop lag", ("worker",))).labels(worker)
+loop_lag_max = registry.register(Gauge(
+    "ws_event_loop_lag_max_seconds", "Largest event loop lag since start", ("worker",))).labels(worker)
+
+
+def set_leader(identity: str):
+    """
+        Keeps exactly one ws_leader series, the leader this worker saw last
+    """
+    leader._children.clear()
+    leader.labels(worker, identity or "").set(1)
+
+
+def register_callback(name: str, documentation: str, callback: Callable[[], float], kind: str = "gauge"):
+    """
+        Registers a scrape-time metric; a second registration under the same name replaces the first,
+        so the series follows the object that registered last (e.g. a rebuilt keepalive)
+    """
+    registry.register(CallbackGauge(name, documentation, callback, kind))
+
+
+async def monitor_event_loop(interval: float = 0.5):
+    """
+        Measures how late a sleep wakes up: the time callbacks waited for the loop
+    """
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - started - interval)
+        loop_lag.set(lag)
+        if lag > loop_lag_max.value:
+            loop_lag_max.set(lag)
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from enum import Enum
+
+from core import envelope
+from core.frames import (OP_BINARY, OP_TEXT, PreparedMessage, build_frame, frame_deflate, is_open, raw_protocol,
+                         write_frame)
+from logger import sampler
+
+logger = logging.getLogger('socket_logger')
+
+
+class OverflowPolicy(str, Enum):
+    """
+        What a connection's outbound queue does when a message arrives and the queue is full:
+        - DROP_OLDEST: the oldest pending message is dropped.
+        - COALESCE: a pending duplicate of a coalescible message ("Scheduled broadcast") absorbs the new one,
+          otherwise the oldest pending coalescible message is dropped, otherwise the oldest message.
+        - DISCONNECT: the message is rejected and the connection is disconnected as a slow consumer.
+    """
+    DROP_OLDEST = "drop_oldest"
+    COALESCE = "coalesce"
+    DISCONNECT = "disconnect"
+
+
+COALESCIBLE = frozenset({"Scheduled broadcast"})
+
+SLOW_CONSUMER_CLOSE_CODE = 1008
+
+_UNRESOLVED = object()
+
+
+class OutboundStats:
+    """
+        Per-worker counters shared by all outbound queues.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.enqueued = 0
+        self.sent = 0
+        self.batched = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.overflow_disconnects = 0
+        self.send_failures = 0
+
+    def as_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+class OutboundQueue:
+    """
+        A bounded queue of messages for one connection, drained by a writer task.
+        Writers (broadcast fan-out, endpoint replies) only call put(), which never blocks,
+        so a slow consumer only delays its own queue and its memory is capped at `maxsize` messages.
+        The writer task and the deque only exist while messages are pending: an idle connection
+        costs a slotted object and nothing else. Writers share a per-worker semaphore that bounds
+        the number of sends in flight.
+        Messages are written to the transport as ready-made frames when the connection allows it
+        (see core.frames.raw_protocol), otherwise they go through send_text(). Prepared broadcast frames,
+        deflated or not, are shared with every connection that has the same framing (see core.frames.frame_deflate).
+        A binary connection (see core.envelope) gets every message as an envelope, and a writer that finds
+        a backlog packs up to ENVELOPE_BATCH_MAX pending messages into one binary frame.
+        A writer whose send fails hands the connection to the manager's batched disconnect (disconnect_later).
+    """
+
+    __slots__ = ("websocket", "maxsize", "policy", "send_timeout", "binary", "seq", "_manager", "_stats",
+                 "_semaphore", "_pending", "_closed", "_protocol", "_deflate", "_task")
+
+    def __init__(self, websocket, manager, stats: OutboundStats, semaphore: asyncio.Semaphore,
+                 maxsize: int, policy: OverflowPolicy, send_timeout: float, binary: bool = False):
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.binary = binary
+        self.seq = 0
+        self._manager = manager
+        self._stats = stats
+        self._semaphore = semaphore
+        self._pending = None
+        self._closed = False
+        self._protocol = _UNRESOLVED
+        self._deflate = 0
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._pending) if self._pending else 0
+
+    def put(self, message) -> bool:
+        """
+            Queues a message without blocking. Returns False if the message was rejected
+            and the connection has to be disconnected.
+        """
+        if self._closed:
+            return False
+
+        pending = self._pending
+        if pending is None:
+            pending = self._pending = deque()
+        elif len(pending) >= self.maxsize:
+            if self.policy is OverflowPolicy.DISCONNECT:
+                self._stats.overflow_disconnects += 1
+                return False
+
+            if self.policy is OverflowPolicy.COALESCE:
+                if message in COALESCIBLE and message in pending:
+                    self._stats.coalesced += 1
+                    return True
+                self._drop(self._oldest_coalescible())
+            else:
+                self._drop(0)
+
+        pending.append(message)
+        self._stats.enqueued += 1
+        self._stats.depth += 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._writer())
+        return True
+
+    def _oldest_coalescible(self) -> int:
+        for i, queued in enumerate(self._pending):
+            if queued in COALESCIBLE:
+                return i
+        return 0
+
+    def _drop(self, index: int):
+        del self._pending[index]
+        self._stats.dropped += 1
+        self._stats.depth -= 1
+
+    def close(self, code: int = None, reason: str = None):
+        """
+            Stops the writer and drops pending messages.
+            With a close code the socket itself is closed as well (e.g. a slow consumer, a drain).
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._stats.depth -= len(self)
+        self._pending = None
+
+        task = self._task
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        if code is not None:
+            asyncio.create_task(self._close_socket(code, reason))
+
+    async def _close_socket(self, code: int, reason: str = None):
+        close = self.websocket.close(code=code, reason=reason) if reason else self.websocket.close(code=code)
+        try:
+            await asyncio.wait_for(close, timeout=self.send_timeout)
+        except Exception:
+            pass
+
+    def _raw_protocol(self):
+        protocol = self._protocol
+        if protocol is _UNRESOLVED:
+            protocol = raw_protocol(self.websocket)
+            # extensions are only known once the handshake completed and the connection is open
+            if protocol is not None:
+                if not is_open(protocol):
+                    return None
+                self._deflate = frame_deflate(protocol)
+            self._protocol = protocol
+        return protocol
+
+    async def _send_batch(self, messages):
+        payload = envelope.encode_batch(messages, self.seq)
+        self.seq = (self.seq + len(messages)) & 0xFFFFFFFF
+        protocol = self._raw_protocol()
+        if protocol is not None:
+            await write_frame(protocol, build_frame(payload, OP_BINARY, self._deflate))
+            return
+        await self.websocket.send_bytes(payload)
+
+    async def _send(self, message):
+        protocol = self._raw_protocol()
+        if protocol is not None:
+            if isinstance(message, PreparedMessage):
+                frame = message.frame_for(self._deflate)
+            else:
+                frame = build_frame(message.encode("utf-8"), OP_TEXT, self._deflate)
+            await write_frame(protocol, frame)
+            return
+        await self.websocket.send_text(message)
+
+    async def _writer(self):
+        pending = self._pending
+        while pending and not self._closed:
+            if self.binary:
+                batch = [pending.popleft() for _ in range(min(len(pending), envelope.BATCH_MAX))]
+            else:
+                batch = (pending.popleft(),)
+            self._stats.depth -= len(batch)
+            try:
+                async with self._semaphore:
+                    send = self._send_batch(batch) if self.binary else self._send(batch[0])
+                    await asyncio.wait_for(send, timeout=self.send_timeout)
+                self._stats.sent += len(batch)
+                if len(batch) > 1:
+                    self._stats.batched += 1
+                if sampler.hit():
+                    logger.debug("[%s] Sent message to: %r", os.getpid(), self.websocket)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats.send_failures += 1
+                if sampler.hit():
+                    logger.info("[%s] Send failed, disconnecting %r: %r", os.getpid(), self.websocket, e)
+                self._manager.disconnect_later(self.websocket, code=SLOW_CONSUMER_CLOSE_CODE)
+                return
+
+        # drained: release the deque and let the next put() start a new writer
+        if not self._closed:
+            self._pending = None
+        self._task = None
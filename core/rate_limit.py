@@ -0,0 +1,88 @@
+import os
+import time
+from enum import Enum
+from typing import Dict, Tuple
+
+from core import metrics
+
+DEFAULT_LIMITS = "send_now=2:5,resume=1:3,*=50:100"
+
+
+class RateLimitAction(str, Enum):
+    """
+        What happens to a frame over its command's budget:
+        - DROP: the frame is ignored.
+        - CLOSE: the connection is closed with 1008 (policy violation).
+    """
+    DROP = "drop"
+    CLOSE = "close"
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if tokens < 1:
+            self.tokens = tokens
+            return False
+        self.tokens = tokens - 1
+        return True
+
+    def reserve(self, now: float) -> float:
+        """
+            Takes a token even if it isn't there yet and returns how long to wait until it is
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate) - 1
+        self.updated = now
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self):
+        self.tokens += 1
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """
+        "send_now=2:5,*=50:100" -> {"send_now": (2.0, 5.0), "*": (50.0, 100.0)}: rate per second and burst per command,
+        `*` is the budget of every other frame
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        command, _, budget = item.partition("=")
+        rate, _, burst = budget.partition(":")
+        limits[command.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+class RateLimits:
+    """
+        Per-command token-bucket budgets for inbound frames (RATE_LIMITS, RATE_LIMIT_ACTION).
+        The buckets of a connection live in a dict owned by its endpoint and are created on first use,
+        so a connection only pays for the commands it actually sends.
+    """
+
+    def __init__(self, spec: str = None, action: str = None, clock=time.monotonic):
+        self.limits = parse_limits(os.getenv("RATE_LIMITS", DEFAULT_LIMITS) if spec is None else spec)
+        self.action = RateLimitAction(action or os.getenv("RATE_LIMIT_ACTION", RateLimitAction.DROP.value))
+        self._clock = clock
+        self._throttled = {key: metrics.throttled_frames.labels(metrics.worker, key) for key in self.limits}
+
+    def allow(self, buckets: dict, command: str) -> bool:
+        key = command if command in self.limits else "*"
+        bucket = buckets.get(key)
+        if bucket is None:
+            budget = self.limits.get(key)
+            if budget is None:
+                return True
+            bucket = buckets[key] = TokenBucket(*budget, self._clock())
+        if bucket.take(self._clock()):
+            return True
+        self._throttled[key].inc()
+        return False
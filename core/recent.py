@@ -0,0 +1,72 @@
+import os
+from collections import OrderedDict, deque
+from typing import List, Optional
+
+from core.frames import PreparedMessage
+
+
+class RingBuffer:
+    __slots__ = ("messages", "size")
+
+    def __init__(self):
+        self.messages = deque()
+        self.size = 0
+
+
+class RecentMessages:
+    """
+        The last broadcasts a worker delivered, kept in memory so a new client gets a snapshot without asking Redis:
+        one ring buffer for global broadcasts and one per topic (keyed by PreparedMessage.topic).
+        - every buffer keeps at most RECENT_MESSAGES_COUNT messages and RECENT_MESSAGES_BYTES bytes of frames,
+          the oldest messages are evicted first.
+        - at most RECENT_TOPICS topic buffers are kept, the one written least recently is evicted first.
+        - adding the message that already is the newest one (the same prepared object, e.g. the scheduled tick
+          sent to the next batch of due connections) doesn't grow the history.
+        Messages are the PreparedMessage objects of the fan-out, so a snapshot reuses their encoded frames.
+    """
+
+    def __init__(self, count: int = None, size: int = None, topics: int = None):
+        self.count = int(os.getenv("RECENT_MESSAGES_COUNT", 20)) if count is None else count
+        self.size = int(os.getenv("RECENT_MESSAGES_BYTES", 65536)) if size is None else size
+        self.max_topics = int(os.getenv("RECENT_TOPICS", 1000)) if topics is None else topics
+        self.bytes = 0
+        self._buffers: "OrderedDict[Optional[str], RingBuffer]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return sum(len(buffer.messages) for buffer in self._buffers.values())
+
+    def add(self, message: PreparedMessage):
+        if self.count <= 0:
+            return
+        key = message.topic
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = RingBuffer()
+            if key is not None and len(self._buffers) - (None in self._buffers) > self.max_topics:
+                self._evict_topic()
+        else:
+            self._buffers.move_to_end(key)
+            if buffer.messages and buffer.messages[-1] is message:
+                return
+
+        size = len(message.frame)
+        buffer.messages.append(message)
+        buffer.size += size
+        self.bytes += size
+        while buffer.messages and (len(buffer.messages) > self.count or buffer.size > self.size):
+            self._drop_oldest(buffer)
+
+    def snapshot(self, topic: str = None) -> List[PreparedMessage]:
+        buffer = self._buffers.get(topic)
+        return list(buffer.messages) if buffer is not None else []
+
+    def _drop_oldest(self, buffer: RingBuffer):
+        size = len(buffer.messages.popleft().frame)
+        buffer.size -= size
+        self.bytes -= size
+
+    def _evict_topic(self):
+        for key in self._buffers:
+            if key is not None:
+                self.bytes -= self._buffers.pop(key).size
+                return
@@ -1,10 +1,19 @@
 import asyncio
 import logging
 import os
-from typing import Set
+import time
+from typing import Set, Tuple
 
-from  redis_client import redis
+from redis.exceptions import NoScriptError
+
+from redis_client import get_pubsub_redis, get_redis
+from core import metrics
 from core.connection_manager import ConnectionManager
+from core.client_directory import ClientDirectory
+from core.fanout import FanOut
+from core.frames import PreparedMessage
+from core.lease import Lease, parse_holder
+from core.worker_registry import WorkerRegistry
 
 logger = logging.getLogger('socket_logger')
 
@@ -17,47 +26,252 @@ class RedisBroadcaster:
         They know nothing about each other without an additional intermediary.
         All workers listening to Redis support this event and
         send messages to their clients (except the one that has already received).
+        Topic messages go to `<channel>:<topic>` channels, and a worker is subscribed to such a channel
+        only while at least one of its own connections is subscribed to the topic.
+        Messages to given clients go through the ClientDirectory (core.client_directory): one publish
+        to the worker that holds the client, not to everybody.
+        The scheduled broadcast is published by the holder of a fenced Lease (core.lease);
+        every global message carries the leader's fencing token and a message with a token lower
+        than one already seen (from messages or from polling the lease) comes from a superseded leader and is dropped.
+        Redis resources: commands go through the pooled client of redis_client.get_redis(), the listener holds
+        the one long-lived subscription on the pub/sub client (for the broadcast, topic and direct channels),
+        and `ready` is true once warm() opened the pool and the listener is subscribed.
     """
-    def __init__(self, channel_name="ws_broadcast"):
+
+    interval = 10
+    # the pub/sub listener also serves the client directory's channel
+    listens_direct = True
+
+    def __init__(self, channel_name="ws_broadcast", client=None, pubsub_client=None):
         self.channel = channel_name
+        self._redis = client or get_redis()
+        self._pubsub_redis = pubsub_client or client or get_pubsub_redis()
         self._manager = ConnectionManager()
-        self._recently_notified: Set = set()
         self._listen_task = None
         self._publish_task = None
         self._heartbeat_task = None
+        self._interest_task = None
+        self._pubsub = None
+        self._listening = asyncio.Event()
+        self._warmed = asyncio.Event()
+        self.warm_connections = int(os.getenv("REDIS_POOL_WARM", 4))
+        self._topics_changed = asyncio.Event()
+        self._subscribed_topics: Set[str] = set()
+        self._fanout = FanOut("redis")
+        self._registry = WorkerRegistry(self._redis)
+        self._directory = ClientDirectory(self._redis, worker_id=self._registry.worker_id,
+                                          pubsub_client=self._pubsub_redis)
+        self._lease = Lease(self._redis, ttl=float(os.getenv("LEADER_LEASE_TTL", 3)))
+        self._fence = 0
+        self.reconnect_delay = 0.1
+        self.reconnect_max_delay = float(os.getenv("REDIS_RECONNECT_MAX_DELAY", 5.0))
+        self._heartbeat_latency = metrics.redis_latency.labels(metrics.worker, "heartbeat")
+        self._publish_latency = metrics.redis_latency.labels(metrics.worker, "publish")
+        self._renewal_latency = metrics.redis_latency.labels(metrics.worker, "lock_renewal")
 
     def mark_recent(self, websocket):
         """
             An implementation of an interface to indicate a connection to which a response should be sent immediately
         """
-        self._recently_notified.add(websocket)
+        self._manager.mark_recent(websocket)
 
     def start(self):
         if not self._listen_task:
-            self._listen_task = asyncio.create_task(self.listen_and_broadcast())
+            self._listen_task = asyncio.create_task(self._warm_and_listen())
         if not self._publish_task:
             self._publish_task = asyncio.create_task(self.publisher_loop())
         if not self._heartbeat_task:
             self._heartbeat_task = asyncio.create_task(self.heartbeat_loop())
+        if not self._interest_task:
+            self._manager.add_topic_listener(self._on_topic_change)
+            self._interest_task = asyncio.create_task(self.interest_loop())
+        self._directory.start(listen=not self.listens_direct)
+
+    @property
+    def ready(self) -> bool:
+        """
+            Redis is warmed and the listener is subscribed: a client accepted now gets every broadcast
+        """
+        return (self._warmed.is_set() and self._listening.is_set()
+                and self._listen_task is not None and not self._listen_task.done())
+
+    async def warm(self):
+        """
+            Opens REDIS_POOL_WARM connections of the command pool at once and loads the Lua scripts in one pipeline,
+            so the first heartbeat, lease poll and client commands neither wait for a connect nor retry on NOSCRIPT.
+            Retries every second until Redis answers.
+        """
+        pid = os.getpid()
+        scripts = (*self._lease.scripts, *self._registry.scripts, *self._directory.scripts)
+        while True:
+            try:
+                await asyncio.gather(*(self._redis.ping() for _ in range(self.warm_connections)))
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    for script in scripts:
+                        pipe.script_load(script.script)
+                    await pipe.execute()
+                break
+            except Exception as e:
+                logger.error("[%s] Redis is not reachable yet: %s", pid, e)
+                await asyncio.sleep(1)
+        self._warmed.set()
+        logger.info("[%s] Redis warmed: %d connections, %d scripts", pid, self.warm_connections, len(scripts))
+
+    async def _warm_and_listen(self):
+        await self.warm()
+        await self.listen_and_broadcast()
+
+    async def stop(self):
+        """
+            Leaves the cluster at once when the worker drains: no more heartbeats or scheduled publishes,
+            the lease goes to a standby without waiting for the TTL and this worker's connections
+            leave the cluster total. Delivery to the remaining local connections goes on.
+        """
+        for task in (self._publish_task, self._heartbeat_task):
+            if task:
+                task.cancel()
+        if self._lease.is_held:
+            await self._lease.release()
+            metrics.is_leader.set(0)
+        await self._registry.deregister()
+        await self._directory.stop()
+
+    def topic_channel(self, topic: str) -> str:
+        return f"{self.channel}:{topic}"
+
+    async def publish(self, topic: str, message: str):
+        """
+            Sends a message to the subscribers of a topic on every worker
+        """
+        await self._redis.publish(self.topic_channel(topic), message)
+
+    async def send_to_clients(self, client_ids, message: str) -> int:
+        """
+            Sends a message to the given client ids on whatever worker they are connected to
+        """
+        return await self._directory.send_to_clients(client_ids, message)
+
+    async def publish_broadcast(self, message: str) -> bool:
+        """
+            Sends a message to every connection on every worker.
+            Only the lease holder can: returns False (and steps down) if the lease was lost.
+        """
+        return await self._lease.publish(self.channel, message)
+
+    def _observe_fence(self, token: int):
+        """
+            Follows the token of the current lease holder. A holder token lower than the fence means the token
+            counter was reset (Redis restarted without persistence or was flushed): the fence is rebased on it,
+            otherwise every broadcast of the new leader would be dropped as stale.
+        """
+        if not token:
+            return
+        if token < self._fence:
+            logger.warning("[%s] Lease token counter was reset (holder token %d < %d), rebasing the fence",
+                           os.getpid(), token, self._fence)
+        self._fence = token
+
+    def _accept_fence(self, token) -> bool:
+        """
+            Drops a global message whose fencing token is lower than the newest one this worker has seen
+        """
+        try:
+            token = int(token)
+        except (TypeError, ValueError):
+            token = 0
+        if token < self._fence:
+            metrics.stale_leader_drops.inc()
+            logger.warning("[%s] Dropped a broadcast of a superseded leader (token %d < %d)",
+                           os.getpid(), token, self._fence)
+            return False
+        self._fence = token
+        return True
 
     async def listen_and_broadcast(self):
-        pubsub = redis.pubsub()
-        await pubsub.subscribe(self.channel)
-
-        async for msg in pubsub.listen():
-            if msg["type"] == "message":
-                logger.info(f"[{os.getpid()}] Received message from Redis: {msg['data']}")
-                for ws in list(self._manager.get_connections()):
-                    if ws in self._recently_notified:
-                        logger.info(f"{os.getpid()}: Skipping recently notified client: {ws}")
-                        continue
-                    try:
-                        await ws.send_text(msg["data"])
-                        logger.info(f"[{os.getpid()}] Sent message to: {ws}")
-                    except:
-                        await self._manager.disconnect(ws)
-
-                self._recently_notified.clear()
+        """
+            Listens to the broadcast, direct and topic channels on one pub/sub connection.
+            A lost connection is reopened with an exponential backoff (up to REDIS_RECONNECT_MAX_DELAY seconds)
+            and every channel, topics included, is subscribed again; the worker is not ready in between.
+        """
+        pid = os.getpid()
+        delay = self.reconnect_delay
+        while True:
+            pubsub = self._pubsub = self._pubsub_redis.pubsub()
+            try:
+                topics = set(self._manager.topics)
+                await pubsub.subscribe(self.channel, self._directory.channel,
+                                       *(self.topic_channel(topic) for topic in topics))
+                self._subscribed_topics = topics
+                self._topics_changed.set()
+                self._listening.set()
+                delay = self.reconnect_delay
+                async for msg in pubsub.listen():
+                    if msg["type"] == "message":
+                        await self._on_pubsub_message(msg)
+                raise ConnectionError("subscription ended")
+            except Exception as e:
+                self._listening.clear()
+                logger.error("[%s] Redis listener failed, reconnecting in %.1fs: %s", pid, delay, e)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.reconnect_max_delay)
+
+    async def _on_pubsub_message(self, msg: dict):
+        if msg["channel"] == self._directory.channel:
+            self._directory.deliver(msg["data"])
+            return
+
+        if msg["channel"] != self.channel:
+            topic = msg["channel"][len(self.topic_channel("")):]
+            message = PreparedMessage.for_topic(topic, msg["data"])
+            self._manager.recent.add(message)
+            await self._fanout.send(self._manager.get_subscribers(topic), message)
+            return
+
+        token, _, data = msg["data"].partition(" ")
+        if not self._accept_fence(token):
+            return
+
+        targets = self._manager.begin_broadcast()
+        logger.info("[%s] Received message from Redis: %s, skipping %d recently notified clients",
+                    os.getpid(), data, len(self._manager.connections) - len(targets))
+
+        message = PreparedMessage(data)
+        self._manager.recent.add(message)
+        await self._fanout.broadcast(targets, message)
+
+    def _on_topic_change(self, topic: str, active: bool):
+        self._topics_changed.set()
+
+    async def interest_loop(self):
+        """
+            Keeps the Redis topic subscriptions of this worker equal to the topics its connections subscribed to.
+            Changes are batched: one SUBSCRIBE/UNSUBSCRIBE per wakeup whatever the number of changed topics.
+        """
+        await self._listening.wait()
+
+        while True:
+            await self._topics_changed.wait()
+            self._topics_changed.clear()
+
+            wanted = set(self._manager.topics)
+            added = wanted - self._subscribed_topics
+            removed = self._subscribed_topics - wanted
+            try:
+                if added:
+                    await self._pubsub.subscribe(*(self.topic_channel(topic) for topic in added))
+                if removed:
+                    await self._pubsub.unsubscribe(*(self.topic_channel(topic) for topic in removed))
+                self._subscribed_topics = wanted
+                logger.debug("[%s] Topic channels: +%d -%d", os.getpid(), len(added), len(removed))
+            except Exception as e:
+                logger.error("[%s] Failed to update topic subscriptions: %s", os.getpid(), e)
+                self._topics_changed.set()
+                await asyncio.sleep(1)
 
     async def publisher_loop(self):
         """
@@ -68,60 +282,101 @@ class RedisBroadcaster:
             each client will receive 3 identical messages
             Redis will be spammed
             mark_recent will not have time to process — we will get duplicates
+            Only the holder of the lease publishes. Every `poll_interval` (at most a second) the leader renews it
+            with a compare-and-set and the standbys try to take it over, so a dead leader is replaced
+            within LEADER_LEASE_TTL + 1s, and the new leader continues the cadence of the old one.
+            The renewal and the read of the cluster total go in one pipeline, one round trip per poll.
         """
 
-        lock_key = "broadcast_lock"
-        lock_ttl = 15
         pid = os.getpid()
-        i_am_leader = False
+        lease = self._lease
+        loop = asyncio.get_running_loop()
+        next_publish = None
 
         while True:
+            total = None
             try:
-                if not i_am_leader:
-                    is_leader = await redis.set(lock_key, pid, ex=lock_ttl, nx=True)
-                    if is_leader:
-                        i_am_leader = True
-                        logger.info(f"[{pid}] I'm the leader")
+                if not lease.is_held:
+                    if await lease.acquire():
+                        since = lease.since_last_broadcast
+                        delay = self.interval - since if since is not None else 0.0
+                        next_publish = loop.time() + max(0.0, delay)
+                        logger.info("[%s] I'm the leader, fencing token %s", pid, lease.token)
+                        metrics.is_leader.set(1)
                     else:
-                        logger.debug(f"[{pid}] Not a leader")
-
-                if i_am_leader:
-                    await redis.expire(lock_key, lock_ttl)
+                        logger.debug("[%s] Not a leader", pid)
+                    metrics.set_leader(lease.holder)
+                    self._observe_fence(parse_holder(lease.holder)[1])
+                else:
+                    started = time.perf_counter()
+                    renewed, total = await self._renew_and_count()
+                    self._renewal_latency.observe(time.perf_counter() - started)
+                    if not renewed:
+                        logger.warning("[%s] Lost the lease, stepping down", pid)
 
-                    active_keys = await redis.keys("active_clients:*")
-                    if active_keys:
-                        await redis.publish(self.channel, "Scheduled broadcast")
-                        logger.info(f"[{pid}] Published Scheduled broadcast")
+                if lease.is_held and loop.time() >= next_publish:
+                    next_publish += self.interval
+                    if total is None:
+                        total = await self._registry.total_connections()
+                    if total:
+                        started = time.perf_counter()
+                        published = await self.publish_broadcast("Scheduled broadcast")
+                        self._publish_latency.observe(time.perf_counter() - started)
+                        if published:
+                            logger.info("[%s] Published Scheduled broadcast", pid)
+                        else:
+                            logger.warning("[%s] Publish refused, the lease was taken over", pid)
                     else:
-                        logger.info(f"[{pid}] No active clients. Skipping.")
+                        logger.info("[%s] No active clients. Skipping.", pid)
 
             except Exception as e:
-                logger.error(f"Failed to publish: {e}")
-                i_am_leader = False
+                logger.error("Failed to publish: %s", e)
+                # the lease may still be ours: acquire() reclaims it with the same token
+                lease.token = None
 
-            await asyncio.sleep(10)
+            if not lease.is_held:
+                metrics.is_leader.set(0)
+            await asyncio.sleep(lease.poll_interval)
 
 
+    async def _renew_and_count(self) -> Tuple[bool, int]:
+        """
+            Renews the lease and reads the cluster total in one round trip.
+            The renewal is a bare EVALSHA of the script warm() loaded; if Redis lost it (a restart or a flush)
+            both run on their own once, which loads the script again.
+        """
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                self._lease.queue_renew(pipe)
+                pipe.get(self._registry.total_key)
+                renewed, total = await pipe.execute()
+        except NoScriptError:
+            return await self._lease.renew(), await self._registry.total_connections()
+        return self._lease.renewed(renewed), int(total or 0)
+
     async def heartbeat_loop(self):
         """
-            If the keys are there, the leader decides that it's time to send the message
+            Every worker reports its connection count and load to the worker registry,
+            the leader publishes only while the cluster total is above zero
+            and admission control compares this worker with the cluster average
         """
 
         pid = os.getpid()
-        key = f"active_clients:{pid}"
 
         while True:
             try:
-                if self._manager.has_connections():
-                    await redis.set(key, "1", ex=15)
-                    logger.debug(f"[{pid}] Heartbeat: active clients")
-                else:
-                    await redis.delete(key)
-                    logger.debug(f"[{pid}] No clients, heartbeat key removed")
+                started = time.perf_counter()
+                total = await self._registry.heartbeat(len(self._manager.connections), metrics.loop_lag.value)
+                self._heartbeat_latency.observe(time.perf_counter() - started)
+                self._manager.admission.observe_cluster(total, self._registry.live_workers)
+                logger.debug("[%s] Heartbeat: %d connections in the cluster", pid, total)
             except Exception as e:
-                logger.error(f"[{pid}] Heartbeat failed: {e}")
+                logger.error("[%s] Heartbeat failed: %s", pid, e)
 
             await asyncio.sleep(5)
 
-
-redis_broadcast = RedisBroadcaster()
\ No newline at end of file
+    async def cluster_connections(self) -> int:
+        """
+            Number of connections across all live workers, without scanning the keyspace
+        """
+        return await self._registry.total_connections()
@@ -0,0 +1,127 @@
+import asyncio
+import heapq
+import math
+import time
+from typing import Any, Dict, Hashable, List, Optional
+
+
+class DeadlineScheduler:
+    """
+        A timing wheel of monotonic deadlines keyed by connection.
+        Deadlines are rounded up to a tick of `resolution` seconds and every tick owns a bucket (dict),
+        so per-connection operations are dict operations:
+        - schedule() / reschedule is O(1) plus O(log b) when it opens a new bucket (b = number of non-empty ticks).
+        - cancel() is O(1).
+        - wait_due() sleeps until the earliest non-empty tick (or until an earlier one is scheduled)
+          and returns only the keys that are due, so an idle loop costs nothing per connection.
+        A key is never returned before its deadline; it may be returned up to one tick late.
+    """
+
+    def __init__(self, resolution: float = 0.05, clock=time.monotonic):
+        self.resolution = resolution
+        self._clock = clock
+        self._buckets: Dict[int, Dict[Hashable, float]] = {}
+        self._ticks: List[int] = []
+        self._slot: Dict[Hashable, int] = {}
+        self._wakeup = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._slot)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._slot
+
+    def now(self) -> float:
+        return self._clock()
+
+    def schedule(self, key: Hashable, delay: float) -> float:
+        return self.schedule_at(key, self._clock() + delay)
+
+    def schedule_at(self, key: Hashable, deadline: float) -> float:
+        tick = math.ceil(deadline / self.resolution)
+        old = self._slot.get(key)
+        if old is not None:
+            if old == tick:
+                self._buckets[old][key] = deadline
+                return deadline
+            self._discard(key, old)
+
+        bucket = self._buckets.get(tick)
+        if bucket is None:
+            bucket = self._buckets[tick] = {}
+            heapq.heappush(self._ticks, tick)
+            if self._ticks[0] == tick:
+                self._wakeup.set()
+        bucket[key] = deadline
+        self._slot[key] = tick
+        return deadline
+
+    def cancel(self, key: Hashable) -> bool:
+        tick = self._slot.get(key)
+        if tick is None:
+            return False
+        self._discard(key, tick)
+        return True
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        tick = self._slot.get(key)
+        return self._buckets[tick][key] if tick is not None else None
+
+    def next_deadline(self) -> Optional[float]:
+        ticks = self._ticks
+        while ticks and ticks[0] not in self._buckets:
+            heapq.heappop(ticks)
+        return ticks[0] * self.resolution if ticks else None
+
+    def pop_due(self, now: Optional[float] = None) -> List[Any]:
+        """
+            Removes and returns every key whose tick has passed, earliest tick first.
+            Popped keys are no longer scheduled until schedule() is called for them again.
+        """
+        if now is None:
+            now = self._clock()
+        return self._pop_until(math.floor(now / self.resolution))
+
+    def _pop_until(self, current: int) -> List[Any]:
+        ticks = self._ticks
+        due = []
+        while ticks and ticks[0] <= current:
+            bucket = self._buckets.pop(heapq.heappop(ticks), None)
+            if not bucket:
+                continue
+            for key in bucket:
+                del self._slot[key]
+            due.extend(bucket)
+        return due
+
+    async def wait_due(self) -> List[Any]:
+        """
+            Sleeps until at least one key is due and returns the due keys.
+        """
+        while True:
+            self._wakeup.clear()
+            deadline = self.next_deadline()
+            if deadline is None:
+                await self._wakeup.wait()
+                continue
+
+            delay = deadline - self._clock()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # the deadline has passed, so its tick is due even if float rounding says otherwise
+            due = self._pop_until(max(math.floor(self._clock() / self.resolution), self._ticks[0]))
+            if due:
+                return due
+
+    def _discard(self, key: Hashable, tick: int):
+        del self._slot[key]
+        bucket = self._buckets[tick]
+        del bucket[key]
+        if not bucket:
+            # the tick stays in the heap and is skipped once it reaches the top
+            del self._buckets[tick]
@@ -1,11 +1,16 @@
 import asyncio
 import logging
+import math
 import os
 import signal
-from core.connection_manager import ConnectionManager
+from core import metrics
+from core.broadcast_strategy import context
+from core.connection_manager import DRAIN_CLOSE_CODE, ConnectionManager
+from logger import stop_logging
 
 logger = logging.getLogger("socket_logger")
 
+
 class GracefulShutdown:
     """
     1. Worker:
@@ -13,15 +18,22 @@ class GracefulShutdown:
         ConnectionManager is a single in-memory object that knows exactly about all connections
         When received Ctrl+C (SIGINT), GracefulShutdown:
         sees active connections
-        waits for them to close themselves (or timeout)
+        closes them in paced batches (at most TIMEOUT seconds)
         completes the process
     2. Multi-workers:
         After SIGINT, all workers simultaneously:
+        Leave the cluster at once: the leadership lease is released and the worker is deregistered
+        from the worker registry (or reports zero connections to the local bus), so the cluster stops counting it.
         Checking their local WebSocket connections.
-        If there is, they wait up to 60 seconds (checking every 5).
+        If there is, they are closed right away over DRAIN_PERIOD seconds in batches every
+        DRAIN_BATCH_INTERVAL, with close code 1012 and a random `reconnect_after_ms=<n>` reason
+        (up to DRAIN_RECONNECT_SPREAD seconds), so clients do not all reconnect to the other workers at once.
+        There is no passive wait for clients to leave on their own (it would hold every rolling deploy);
+        TIMEOUT (60, 0 for none) is a hard cap on the drain, whatever is still open then is closed at once.
+        Clients that leave by themselves are skipped, progress is logged every 10%.
         If there are no connections → they are terminated immediately.
         Role of Redis:
-        Defines the leader (one who follows active_clients:* and sends broadcast).
+        Defines the leader (the lease holder that follows the worker registry and sends broadcast).
         But completion occurs independently for each worker, Redis does not decide when to "kill" the process.
         We don't use @app.on_event("shutdown"), because FastAPI will close the
         WebSocket connection first — and we need to wait before closing.
@@ -30,9 +42,13 @@ class GracefulShutdown:
 
     def __init__(self):
         self.manager = ConnectionManager()
-        self.interval = int(os.getenv("INTERVAL", 5))
-        self.timeout = int(os.getenv("TIMEOUT", 60))
+        self.timeout = float(os.getenv("TIMEOUT", 60))
+        self.drain_period = float(os.getenv("DRAIN_PERIOD", 10))
+        self.batch_interval = float(os.getenv("DRAIN_BATCH_INTERVAL", 0.5))
         self.loop = asyncio.get_event_loop()
+        self._task = None
+        self._initial = 0
+        self._next_report = 0
         self._register_signals()
 
     def _register_signals(self):
@@ -40,18 +56,69 @@ class GracefulShutdown:
         signal.signal(signal.SIGTERM, self._handle_signal)
 
     def _handle_signal(self, signum, frame):
-        logger.info(f"Signal {signum} received of {os.getpid()}. Evaluating shutdown...")
-        self.loop.create_task(self._shutdown())
+        logger.info("Signal %s received of %s. Evaluating shutdown...", signum, os.getpid())
+        # signal handlers run between bytecodes: hand over to the loop and wake it up
+        self.loop.call_soon_threadsafe(self._start)
+
+    def _start(self):
+        if self._task is None:
+            self._task = self.loop.create_task(self._shutdown())
+        else:
+            logger.info("[%s] Drain already in progress", os.getpid())
+
+    def _on_disconnect(self, record):
+        remaining = len(self.manager.connections)
+        if remaining <= self._next_report:
+            logger.info("[%s] Drain: %d/%d closed, %d left",
+                        os.getpid(), self._initial - remaining, self._initial, remaining)
+            self._next_report = remaining - max(1, self._initial // 10)
 
     async def _shutdown(self):
-        logger.info("Graceful shutdown initiated")
-        waited = 0
+        pid = os.getpid()
+        logger.info("[%s] Graceful shutdown initiated", pid)
+        metrics.draining.set(1)
+        self.manager.draining = True
+
+        try:
+            await context.stop()
+        except Exception as e:
+            logger.error("[%s] Failed to leave the cluster: %s", pid, e)
+
+        self._initial = len(self.manager.connections)
+        self._next_report = self._initial - max(1, self._initial // 10)
+        self.manager.add_disconnect_listener(self._on_disconnect)
+        if self.manager.has_connections():
+            try:
+                await asyncio.wait_for(self._drain(), timeout=self.timeout or None)
+            except asyncio.TimeoutError:
+                logger.info("[%s] Drain cut at %.0fs, closing %d connections at once",
+                            pid, self.timeout, len(self.manager.connections))
+                self._close(self.manager.connections.snapshot())
+            # let the close frames of the last batch go out
+            await asyncio.sleep(self.manager.send_timeout)
+
+        self.manager.remove_disconnect_listener(self._on_disconnect)
+        logger.info("[%s] No active clients. Shutting down.", pid)
+        stop_logging()
+        os._exit(0)
+
+    async def _drain(self):
+        """
+            Closes the remaining connections in equal batches spread over drain_period
+        """
+        records = self.manager.connections.snapshot()
+        batches = max(1, round(self.drain_period / self.batch_interval)) if self.batch_interval > 0 else 1
+        size = math.ceil(len(records) / batches)
+        logger.info("[%s] Draining %d connections in batches of %d every %ss",
+                    os.getpid(), len(records), size, self.batch_interval)
 
-        while self.manager.has_connections() and waited < self.timeout:
-            logger.info(
-                f" Pid {os.getpid()} Waiting for connections to close... {len(self.manager.get_connections())} active")
-            await asyncio.sleep(self.interval)
-            waited += self.interval
+        for start in range(0, len(records), size):
+            self._close(records[start:start + size])
+            if not self.manager.has_connections():
+                return
+            await asyncio.sleep(self.batch_interval)
 
-        logger.info(f"[{os.getpid()}] No active clients or timeout reached. Shutting down.")
-        os._exit(0)
\ No newline at end of file
+    def _close(self, records):
+        for record in records:
+            hint = self.manager.drain_retry_after_ms()
+            self.manager.remove(record, DRAIN_CLOSE_CODE, reason=f"reconnect_after_ms={hint}")
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import os
+import weakref
+from typing import Dict, List, Tuple
+
+from redis.exceptions import ResponseError
+
+from core.fanout import FanOut
+from core.frames import PreparedMessage
+from core.redis_broadcaster import RedisBroadcaster
+
+logger = logging.getLogger('socket_logger')
+
+
+ID_LIMIT = 2 ** 64
+
+
+def parse_id(stream_id: str) -> Tuple[int, int]:
+    """
+        (ms, seq) of a stream id; ValueError for anything Redis would refuse, including parts out of 64 bits
+    """
+    ms, _, seq = stream_id.partition("-")
+    parts = int(ms), int(seq or 0)
+    if not all(0 <= part < ID_LIMIT for part in parts):
+        raise ValueError(f"stream id out of range: {stream_id}")
+    return parts
+
+
+class StreamBroadcaster(RedisBroadcaster):
+    """
+        A RedisBroadcaster backend on Redis Streams instead of pub/sub.
+        - the leader (same lock and worker registry) XADDs to the `<channel>` stream, topics go to `<channel>:<topic>`;
+          streams are capped with an approximate MAXLEN of STREAM_MAXLEN entries.
+          Global entries are {data, fence}: the leader's XADD is fenced by its lease like PUBLISH.
+        - every worker reads with XREAD from the last id it delivered, so a Redis blip or a slow loop
+          does not lose messages: the worker continues where it stopped.
+        - a client that sends `resume <last id>` gets the entries it missed (global stream and its topics)
+          as one batch frame, read with XREAD COUNT, before it switches to live delivery.
+          From then on every message it receives is prefixed with its stream id, `<id> <message>`.
+        The live XREAD BLOCK runs on the pub/sub client, so it never holds a connection of the command pool;
+        with no subscription of its own, the client directory listens on its channel itself.
+    """
+
+    listens_direct = False
+
+    def __init__(self, channel_name="ws_broadcast", client=None, pubsub_client=None):
+        super().__init__(channel_name, client, pubsub_client)
+        self._fanout = FanOut("stream")
+        self.maxlen = int(os.getenv("STREAM_MAXLEN", 10000))
+        self.batch = int(os.getenv("STREAM_REPLAY_COUNT", 100))
+        self.block_ms = int(os.getenv("STREAM_BLOCK_MS", 1000))
+        self._last_ids: Dict[str, str] = {}
+        self._tagged = weakref.WeakSet()
+        self._replaying = weakref.WeakSet()
+
+    async def publish(self, topic: str, message: str):
+        await self._redis.xadd(self.topic_channel(topic), {"data": message}, maxlen=self.maxlen, approximate=True)
+
+    async def publish_broadcast(self, message: str):
+        return await self._lease.xadd(self.channel, message, self.maxlen)
+
+    async def interest_loop(self):
+        """
+            Nothing to subscribe: every XREAD is issued for the streams of the current local topics.
+        """
+        return
+
+    async def _tail_id(self, stream: str) -> str:
+        entries = await self._redis.xrevrange(stream, count=1)
+        return entries[0][0] if entries else "0-0"
+
+    async def _streams_of_interest(self) -> Dict[str, str]:
+        streams = {self.channel: None}
+        for topic in self._manager.topics:
+            streams[self.topic_channel(topic)] = None
+
+        for stream in streams:
+            if stream not in self._last_ids:
+                self._last_ids[stream] = await self._tail_id(stream)
+            streams[stream] = self._last_ids[stream]
+
+        for stream in list(self._last_ids):
+            if stream not in streams:
+                del self._last_ids[stream]
+        return streams
+
+    async def listen_and_broadcast(self):
+        pid = os.getpid()
+        topic_prefix = self.topic_channel("")
+        self._listening.set()
+
+        while True:
+            try:
+                streams = await self._streams_of_interest()
+                response = await self._pubsub_redis.xread(streams, count=self.batch, block=self.block_ms)
+            except Exception as e:
+                logger.error("[%s] Failed to read streams: %s", pid, e)
+                await asyncio.sleep(1)
+                continue
+
+            for stream, entries in response or ():
+                for entry_id, fields in entries:
+                    self._last_ids[stream] = entry_id
+                    if stream == self.channel:
+                        if not self._accept_fence(fields.get("fence")):
+                            continue
+                        logger.info("[%s] Received message from Redis stream: %s", pid, fields["data"])
+                        await self._deliver(self._manager.begin_broadcast(), entry_id, fields["data"], spread=True)
+                    else:
+                        topic = stream[len(topic_prefix):]
+                        await self._deliver(self._manager.get_subscribers(topic), entry_id, fields["data"], topic=topic)
+
+    async def _deliver(self, targets, entry_id: str, message: str, topic: str = None, spread: bool = False):
+        plain, tagged = [], []
+        for record in targets:
+            if record.websocket in self._replaying:
+                continue
+            (tagged if record.websocket in self._tagged else plain).append(record)
+
+        send = self._fanout.broadcast if spread else self._fanout.send
+        prepared = self._prepare(message, topic)
+        self._manager.recent.add(prepared)
+        if plain:
+            await send(plain, prepared)
+        if tagged:
+            await send(tagged, self._prepare(message, topic, f"{entry_id} "))
+
+    @staticmethod
+    def _prepare(message: str, topic: str = None, prefix: str = "") -> PreparedMessage:
+        if topic is None:
+            return PreparedMessage(f"{prefix}{message}")
+        return PreparedMessage.for_topic(topic, message, prefix)
+
+    async def resume(self, websocket, last_id: str = None) -> bool:
+        """
+            Replays what the client missed after `last_id`, then switches it to live, id-tagged delivery.
+            While replaying, live delivery skips the client. The replay stops at the id the live loop last read
+            for every stream (inclusive): what comes after it is left to the live loop, so nothing is lost or sent twice.
+            The client is switched to tagged delivery once the replay is done: an id that is invalid
+            or that Redis refuses changes nothing and returns False.
+        """
+        if last_id:
+            try:
+                parse_id(last_id)
+            except ValueError:
+                return False
+        else:
+            self._tagged.add(websocket)
+            return True
+
+        self._replaying.add(websocket)
+        try:
+            streams = {self.channel: last_id}
+            for topic in self._manager.get_topics(websocket):
+                streams[self.topic_channel(topic)] = last_id
+            topic_prefix = self.topic_channel("")
+
+            while websocket in self._manager.get_connections():
+                try:
+                    response = await self._redis.xread(streams, count=self.batch)
+                except ResponseError as e:
+                    logger.info("[%s] Resume from %r refused by Redis: %s", os.getpid(), last_id[:80], e)
+                    return False
+                batch: List[Tuple[Tuple[int, int], str]] = []
+                unread = set()
+                for stream, entries in response or ():
+                    live_id = self._last_ids.get(stream)
+                    for entry_id, fields in entries:
+                        if live_id is not None and parse_id(entry_id) > parse_id(live_id):
+                            # the live loop delivers it: everything up to its id was in this response
+                            streams[stream] = live_id
+                            break
+                        streams[stream] = entry_id
+                        text = fields["data"] if stream == self.channel else f"{stream[len(topic_prefix):]}: {fields['data']}"
+                        batch.append((parse_id(entry_id), f"{entry_id} {text}"))
+                    else:
+                        if len(entries) == self.batch:
+                            unread.add(stream)
+
+                if batch:
+                    batch.sort()
+                    self._manager.send(websocket, "\n".join(line for _, line in batch))
+
+                caught_up = all(
+                    parse_id(streams[stream]) >= parse_id(live_id)
+                    for stream, live_id in self._last_ids.items() if stream in streams
+                )
+                # nothing read: the streams the live loop still tracks are gone (e.g. deleted)
+                if not response or (caught_up and not unread):
+                    break
+            self._tagged.add(websocket)
+        finally:
+            self._replaying.discard(websocket)
+        return True
@@ -0,0 +1,91 @@
+import os
+import socket
+
+from redis_client import get_redis
+
+
+HEARTBEAT_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local total = 0
+
+local stale = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now - tonumber(ARGV[3]))
+for _, worker in ipairs(stale) do
+    if worker ~= ARGV[1] then
+        total = total - tonumber(redis.call('HGET', KEYS[2], worker) or '0')
+        redis.call('HDEL', KEYS[2], worker)
+        redis.call('HDEL', KEYS[4], worker)
+        redis.call('ZREM', KEYS[1], worker)
+    end
+end
+
+local count = tonumber(ARGV[2])
+total = total + count - tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or '0')
+redis.call('HSET', KEYS[2], ARGV[1], count)
+redis.call('HSET', KEYS[4], ARGV[1], ARGV[4])
+redis.call('ZADD', KEYS[1], now, ARGV[1])
+return {redis.call('INCRBY', KEYS[3], total), redis.call('ZCARD', KEYS[1])}
+"""
+
+DEREGISTER_SCRIPT = """
+local count = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or '0')
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[4], ARGV[1])
+redis.call('ZREM', KEYS[1], ARGV[1])
+return redis.call('INCRBY', KEYS[3], -count)
+"""
+
+
+class WorkerRegistry:
+    """
+        A cluster-wide registry of workers in Redis, replacing the `active_clients:<pid>` keys and KEYS scans:
+        - a sorted set of worker id -> last heartbeat (Redis server time, so hosts don't need synced clocks),
+        - a hash of worker id -> local connection count,
+        - a counter with the sum of that hash,
+        - a hash of worker id -> load (event loop lag in seconds), for admission control and dashboards.
+        One Lua script per heartbeat updates all four and prunes workers whose score is older than `stale_after`,
+        so the total is always readable with a single GET, whatever the size of the keyspace.
+    """
+
+    workers_key = "ws:workers"
+    counts_key = "ws:worker_connections"
+    total_key = "ws:connections_total"
+    loads_key = "ws:worker_load"
+
+    def __init__(self, client=None, worker_id: str = None, stale_after: int = 15):
+        self._redis = client or get_redis()
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.stale_after = stale_after
+        self.live_workers = 0
+        self._heartbeat = self._redis.register_script(HEARTBEAT_SCRIPT)
+        self._deregister = self._redis.register_script(DEREGISTER_SCRIPT)
+        self.scripts = (self._heartbeat, self._deregister)
+
+    @property
+    def _keys(self):
+        return [self.workers_key, self.counts_key, self.total_key, self.loads_key]
+
+    async def heartbeat(self, connections: int, load: float = 0.0) -> int:
+        """
+            Publishes this worker's connection count and load, prunes stale workers and returns the cluster total;
+            `live_workers` is updated with the number of workers that are still beating
+        """
+        total, workers = await self._heartbeat(
+            keys=self._keys, args=[self.worker_id, connections, self.stale_after, f"{load:.3f}"])
+        self.live_workers = int(workers)
+        return int(total)
+
+    async def deregister(self) -> int:
+        return int(await self._deregister(keys=self._keys, args=[self.worker_id]))
+
+    async def total_connections(self) -> int:
+        """
+            Connections across all live workers, O(1)
+        """
+        return int(await self._redis.get(self.total_key) or 0)
+
+    async def workers(self) -> dict:
+        return {worker: int(count) for worker, count in (await self._redis.hgetall(self.counts_key)).items()}
+
+    async def loads(self) -> dict:
+        return {worker: float(load) for worker, load in (await self._redis.hgetall(self.loads_key)).items()}
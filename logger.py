@@ -1,8 +1,54 @@
 import logging.config
+import logging.handlers
+import os
+import queue
 import sys
 
+_listener = None
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+        A QueueHandler that leaves formatting to the listener thread:
+        the event loop only builds the record and puts it into the queue.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class Sampler:
+    """
+        Lets one in `every` events through, for per-connection debug events on the hot path.
+        every=0 disables the events, every=1 lets all of them through.
+    """
+
+    def __init__(self, every: int):
+        self.every = every
+        self._count = 0
+
+    def hit(self) -> bool:
+        if not self.every:
+            return False
+        self._count += 1
+        if self._count >= self.every:
+            self._count = 0
+            return True
+        return False
+
+
+sampler = Sampler(int(os.getenv("LOG_SAMPLE_EVERY", 0)))
+
+
+def setup_logging(use_queue: bool = None):
+    """
+        With use_queue (LOG_QUEUE, on by default) the console handler runs on a background thread behind a queue,
+        so writing to stdout never blocks the event loop.
+    """
+    if use_queue is None:
+        use_queue = os.getenv("LOG_QUEUE", "1") != "0"
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
 
-def setup_logging():
     logging_config = {
         'version': 1,
         'disable_existing_loggers': False,
@@ -16,17 +62,39 @@ def setup_logging():
                 'class': 'logging.StreamHandler',
                 'stream': sys.stdout,
                 'formatter': 'default',
-                'level': logging.INFO,
+                'level': level,
             },
         },
         'loggers': {
             'socket_logger': {
                 'handlers': ['console'],
-                'level': logging.INFO,
+                'level': level,
                 'stream': sys.stdout,
                 'propagate': False,
             },
         },
     }
 
-    logging.config.dictConfig(logging_config)
\ No newline at end of file
+    logging.config.dictConfig(logging_config)
+
+    if use_queue:
+        global _listener
+        stop_logging()
+        socket_logger = logging.getLogger('socket_logger')
+        handlers = list(socket_logger.handlers)
+        records = queue.SimpleQueue()
+        for handler in handlers:
+            socket_logger.removeHandler(handler)
+        socket_logger.addHandler(DeferredQueueHandler(records))
+        _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        _listener.start()
+
+
+def stop_logging():
+    """
+        Flushes the queued records and stops the writer thread, needed before os._exit()
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
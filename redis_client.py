@@ -1,3 +1,56 @@
 import os
-from redis.asyncio import Redis
-redis = Redis(host=os.getenv("REDIS_HOST"), port=int(os.getenv("REDIS_PORT",6379)), decode_responses=True)
\ No newline at end of file
+from typing import Optional
+
+from redis.asyncio import BlockingConnectionPool, ConnectionPool, Redis
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError, TimeoutError
+from redis.retry import Retry
+
+_redis: Optional[Redis] = None
+_pubsub_redis: Optional[Redis] = None
+
+
+def _connection_kwargs(socket_timeout: Optional[float]) -> dict:
+    return dict(
+        host=os.getenv("REDIS_HOST"),
+        port=int(os.getenv("REDIS_PORT", 6379)),
+        decode_responses=True,
+        socket_connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", 2.0)),
+        socket_timeout=socket_timeout,
+        socket_keepalive=True,
+        health_check_interval=int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30)),
+        retry=Retry(ExponentialBackoff(cap=1.0, base=0.05), int(os.getenv("REDIS_RETRIES", 3))),
+        retry_on_error=[ConnectionError, TimeoutError],
+    )
+
+
+def get_redis() -> Redis:
+    """
+        The client for commands, built on first use (a single-worker server never builds it):
+        - a pool of at most REDIS_POOL_SIZE connections; a command that finds them all busy waits up to
+          REDIS_POOL_TIMEOUT seconds for one instead of failing with "Too many connections".
+        - REDIS_SOCKET_TIMEOUT / REDIS_CONNECT_TIMEOUT bound a command on a hung server, failed commands are
+          retried REDIS_RETRIES times with an exponential backoff and idle connections are health-checked.
+    """
+    global _redis
+    if _redis is None:
+        pool = BlockingConnectionPool(
+            max_connections=int(os.getenv("REDIS_POOL_SIZE", 16)),
+            timeout=float(os.getenv("REDIS_POOL_TIMEOUT", 5.0)),
+            **_connection_kwargs(float(os.getenv("REDIS_SOCKET_TIMEOUT", 5.0))),
+        )
+        _redis = Redis(connection_pool=pool)
+    return _redis
+
+
+def get_pubsub_redis() -> Redis:
+    """
+        The client for subscriptions and blocking reads (the broadcast listener, XREAD BLOCK), on its own pool,
+        so a long-lived subscription never holds a connection of the command pool.
+        No socket timeout: a subscription is idle for as long as nothing is published.
+        Two connections: the listener and, with the streams backend, the client directory's channel.
+    """
+    global _pubsub_redis
+    if _pubsub_redis is None:
+        _pubsub_redis = Redis(connection_pool=ConnectionPool(max_connections=2, **_connection_kwargs(None)))
+    return _pubsub_redis
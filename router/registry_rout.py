@@ -1,5 +1,7 @@
 from fastapi import FastAPI
-from socket_service.endpoints import websocket_endpoint
+from socket_service.endpoints import metrics_endpoint, ready_endpoint, websocket_endpoint
 
 def add_api_websocket_rout(app: FastAPI):
-    app.add_api_websocket_route("/ws", websocket_endpoint)
\ No newline at end of file
+    app.add_api_websocket_route("/ws", websocket_endpoint)
+    app.add_api_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
+    app.add_api_route("/ready", ready_endpoint, methods=["GET"], include_in_schema=False)
\ No newline at end of file
@@ -1,27 +1,126 @@
 import os
 
 from fastapi import  WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
+from core import envelope, metrics
 from core.connection_manager import ConnectionManager
 from core.broadcast_strategy import context
+from core.rate_limit import RateLimitAction, RateLimits
 import logging
 
 logger = logging.getLogger('socket_logger')
 
+POLICY_VIOLATION_CLOSE_CODE = 1008
+INTERNAL_ERROR_CLOSE_CODE = 1011
+
+limits = RateLimits()
+
+
+async def send_now(manager: ConnectionManager, websocket: WebSocket, arg: str):
+    context.mark_recent(websocket)
+    logger.info("%s Send message immediately", os.getpid())
+    manager.send(websocket, "Immediate message sent")
+
+
+async def ping(manager: ConnectionManager, websocket: WebSocket, arg: str):
+    manager.send(websocket, "pong")
+
+
+async def subscribe(manager: ConnectionManager, websocket: WebSocket, topic: str):
+    if topic and manager.subscribe(websocket, topic):
+        manager.send(websocket, f"subscribed {topic}")
+        if manager.snapshots:
+            manager.send_snapshot(websocket, topic)
+
+
+async def unsubscribe(manager: ConnectionManager, websocket: WebSocket, topic: str):
+    if manager.unsubscribe(websocket, topic):
+        manager.send(websocket, f"unsubscribed {topic}")
+
+
+async def whoami(manager: ConnectionManager, websocket: WebSocket, arg: str):
+    record = manager.get(websocket)
+    if record is not None:
+        manager.send(websocket, f"client_id {manager.identify(record)}")
+
+
+async def resume(manager: ConnectionManager, websocket: WebSocket, last_id: str):
+    if not await context.resume(websocket, last_id or None):
+        manager.send(websocket, "resume unsupported")
+
+
+# "<command> <argument>": one dict lookup per frame, whatever the number of commands
+COMMANDS = {
+    "send_now": send_now,
+    "ping": ping,
+    "subscribe": subscribe,
+    "unsubscribe": unsubscribe,
+    "resume": resume,
+    "whoami": whoami,
+}
+
+
+def read_commands(message: dict):
+    """
+        (command, argument) pairs of a received frame: a text frame is "<command> <argument>",
+        a binary frame carries COMMAND envelopes (topic = command, body = argument)
+    """
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    text = message.get("text")
+    if text is not None:
+        command, _, arg = text.partition(" ")
+        return ((command, arg),)
+    try:
+        envelopes = envelope.decode(message.get("bytes") or b"")
+    except ValueError as e:
+        logger.info("[%s] Ignoring a malformed binary frame: %s", os.getpid(), e)
+        return ()
+    return [(item.topic, item.body) for item in envelopes if item.type == envelope.EnvelopeType.COMMAND]
+
+
 async def websocket_endpoint(websocket: WebSocket):
-    await ConnectionManager().connect(websocket)
+    manager = ConnectionManager()
+    if await manager.connect(websocket) is None:
+        return
+    buckets = {}
 
     try:
         while True:
-            data = await websocket.receive_text()
+            for command, arg in read_commands(await websocket.receive()):
+                if not limits.allow(buckets, command):
+                    if limits.action is RateLimitAction.CLOSE:
+                        metrics.throttle_closes.inc()
+                        await manager.disconnect(websocket)
+                        await websocket.close(code=POLICY_VIOLATION_CLOSE_CODE)
+                        return
+                    continue
 
-            if data == "send_now":
-                context.mark_recent(websocket)
-                logger.info(f"{os.getpid()} Send message immediately")
-                await websocket.send_text("Immediate message sent")
+                handler = COMMANDS.get(command)
+                if handler is not None:
+                    await handler(manager, websocket, arg.strip())
 
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        # a failing command (e.g. a Redis error) must not leave the connection registered
+        logger.exception("[%s] Command failed, closing the connection", os.getpid())
+        await manager.disconnect(websocket, code=INTERNAL_ERROR_CLOSE_CODE)
+    finally:
+        await manager.disconnect(websocket)
 
-            elif data == "ping":
-                await websocket.send_text("pong")
+async def metrics_endpoint():
+    """
+        Prometheus text exposition of the worker that serves the request
+    """
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
 
-    except WebSocketDisconnect:
-        await ConnectionManager().disconnect(websocket)
\ No newline at end of file
+
+async def ready_endpoint():
+    """
+        Readiness of the worker that serves the request: 200 once its broadcaster is connected
+        (Redis warmed and the listener subscribed for the Redis backends), 503 before that and while it drains
+    """
+    if context.ready and not ConnectionManager().draining:
+        return PlainTextResponse("ready")
+    return PlainTextResponse("not ready", status_code=503)
@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+import pytest_asyncio
+
+from core.connection_manager import ConnectionManager
+
+
+class FakeWebSocket:
+    """
+        A stand-in for a Starlette WebSocket that records what the server does with it:
+        - text frames go to `received`, binary frames to `frames`, the close code and reason are kept.
+        - `delay` slows every send down, a `broken` socket fails every send like a closed connection.
+        - `scope` is the ASGI scope, e.g. with the server protocol (core.frames.PROTOCOL_SCOPE_KEY).
+    """
+
+    def __init__(self, delay=0.0, broken=False, scope=None):
+        self.delay = delay
+        self.broken = broken
+        self.scope = scope if scope is not None else {}
+        self.accepted = False
+        self.received = []
+        self.frames = []
+        self.received_at = None
+        self.close_code = None
+        self.close_reason = None
+        self.closed_at = None
+
+    async def accept(self, subprotocol=None):
+        self.accepted = True
+
+    async def send_text(self, message):
+        if self.broken:
+            raise RuntimeError("connection closed")
+        await asyncio.sleep(self.delay)
+        self.received.append(message)
+        self.received_at = time.perf_counter()
+
+    async def send_bytes(self, payload):
+        if self.broken:
+            raise RuntimeError("connection closed")
+        await asyncio.sleep(self.delay)
+        self.frames.append(payload)
+        self.received_at = time.perf_counter()
+
+    async def close(self, code=1000, reason=None):
+        self.close_code = code
+        self.close_reason = reason
+        self.closed_at = time.perf_counter()
+
+
+@pytest_asyncio.fixture
+async def manager():
+    manager = ConnectionManager()
+    yield manager
+    await manager.disconnect_many(list(manager.get_connections()))
@@ -0,0 +1,52 @@
+import asyncio
+import time
+
+import pytest
+
+from core import metrics
+from core.admission import Admission, RejectReason
+
+
+class FakeManager:
+    def __init__(self, connections=0):
+        self.connections = [object()] * connections
+
+
+@pytest.mark.asyncio
+async def test_rejects_over_the_cap_and_over_the_fair_share(monkeypatch):
+    """A worker at MAX_CONNECTIONS, or far above the cluster average, turns new clients away."""
+    monkeypatch.setenv("MAX_CONNECTIONS", "10")
+    monkeypatch.setenv("ADMISSION_FAIR_SHARE", "2")
+    monkeypatch.setenv("ADMISSION_FAIR_SHARE_MIN", "4")
+    manager = FakeManager(connections=5)
+    admission = Admission(manager)
+
+    assert await admission.admit() is None
+    admission.observe_cluster(connections=12, workers=3)
+    assert await admission.admit() is None
+    admission.observe_cluster(connections=6, workers=3)
+    assert await admission.admit() is RejectReason.FAIR_SHARE
+
+    manager.connections = [object()] * 10
+    assert await admission.admit() is RejectReason.MAX_CONNECTIONS
+    assert 1000 <= admission.retry_after_ms() <= 3000
+
+
+@pytest.mark.asyncio
+async def test_accept_rate_queues_a_burst_and_rejects_beyond_the_queue_timeout(monkeypatch):
+    """At 20 accepts/s with burst 2 and a 0.2s queue, 2 pass at once, 4 wait their turn and the rest are rejected."""
+    monkeypatch.setenv("ACCEPT_RATE", "20")
+    monkeypatch.setenv("ACCEPT_BURST", "2")
+    monkeypatch.setenv("ACCEPT_QUEUE_TIMEOUT", "0.2")
+    admission = Admission(FakeManager())
+    queued = metrics.admission_queued.value
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(admission.admit() for _ in range(10)))
+    elapsed = time.perf_counter() - started
+
+    assert results.count(None) == 6
+    assert results.count(RejectReason.RATE) == 4
+    assert metrics.admission_queued.value - queued == 4
+    assert 0.15 <= elapsed < 0.4
+    assert admission.waiting == 0
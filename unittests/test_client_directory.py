@@ -0,0 +1,70 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from core.client_directory import ClientDirectory
+from unittests.conftest import FakeWebSocket
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeAsyncRedis(decode_responses=True)
+
+
+async def next_message(pubsub):
+    while True:
+        msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1)
+        if msg is not None:
+            return msg["data"]
+
+
+@pytest.mark.asyncio
+async def test_directory_entries_follow_connections(client, manager):
+    """Entries carry the worker and a TTL; a removal leaves an entry that another worker took over."""
+    directory = ClientDirectory(client, worker_id="a", ttl=30, flush_interval=0)
+    first, second = FakeWebSocket(), FakeWebSocket()
+    records = [manager.register(first, client_id="c1"), manager.register(second, client_id="c2")]
+    await directory.flush(["c1", "c2"])
+    assert await client.mget("ws:client:c1", "ws:client:c2") == ["a", "a"]
+    assert 0 < await client.pttl("ws:client:c1") <= 30_000
+
+    await client.set("ws:client:c2", "b")
+    for record in records:
+        manager.remove(record)
+    await directory.flush(["c1", "c2"])
+    assert await client.mget("ws:client:c1", "ws:client:c2") == [None, "b"]
+
+
+@pytest.mark.asyncio
+async def test_targeted_send_is_one_publish_per_owning_worker(client, manager):
+    """Local clients are served directly, remote ones with one publish per worker, unknown ids are skipped."""
+    directory = ClientDirectory(client, worker_id="a")
+    local = FakeWebSocket()
+    manager.register(local, client_id="here")
+    await client.mset({"ws:client:x": "b", "ws:client:y": "b", "ws:client:z": "c"})
+
+    pubsub = client.pubsub()
+    await pubsub.subscribe("ws_direct:b", "ws_direct:c")
+    sent = await directory.send_to_clients(["here", "x", "y", "z", "nobody"], "hello")
+
+    assert sent == 4
+    assert sorted([await next_message(pubsub), await next_message(pubsub)]) == ["x,y hello", "z hello"]
+    await asyncio.sleep(0.05)
+    assert local.received == ["hello"]
+    await pubsub.aclose()
+
+
+@pytest.mark.asyncio
+async def test_worker_channel_delivers_to_local_clients(client, manager):
+    """A worker's channel delivers "<ids> <message>" to the listed clients it has, unknown ids are skipped."""
+    directory = ClientDirectory(client, worker_id="b")
+    ws = FakeWebSocket()
+    manager.register(ws, client_id="x")
+    task = asyncio.create_task(directory.listen())
+    await directory._listening.wait()
+
+    await client.publish("ws_direct:b", "x,gone hi there")
+    await asyncio.sleep(0.1)
+    assert ws.received == ["hi there"]
+    task.cancel()
@@ -0,0 +1,87 @@
+import asyncio
+import socket
+
+import pytest
+import pytest_asyncio
+import uvicorn
+import websockets
+from fastapi import FastAPI
+from uvicorn.protocols.websockets.websockets_sansio_impl import WebSocketsSansIOProtocol
+from uvicorn.server import ServerState
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+from websockets.server import ServerProtocol
+
+from core.compression import CompressionMode, SharedDeflateProtocol, uvicorn_options
+from core.connection_manager import ConnectionManager
+from core.fanout import FanOut
+from core.frames import DEFLATE_MIN_SIZE, PreparedMessage, ProtocolScopeMiddleware
+from router.registry_rout import add_api_websocket_rout
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest_asyncio.fixture
+async def server():
+    app = FastAPI()
+    app.add_middleware(ProtocolScopeMiddleware)
+    add_api_websocket_rout(app)
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, ws=SharedDeflateProtocol,
+                                           ws_ping_interval=None, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    yield f"ws://127.0.0.1:{port}/ws"
+    manager = ConnectionManager()
+    await manager.disconnect_many(list(manager.get_connections()))
+    server.should_exit = True
+    await task
+
+
+@pytest.mark.asyncio
+async def test_broadcast_is_deflated_once_for_all_clients(server):
+    """Clients negotiate deflate without context takeover and all decode the one shared compressed frame."""
+    manager = ConnectionManager()
+    clients = [await websockets.connect(server) for _ in range(3)]
+    while len(manager.connections) < 3:
+        await asyncio.sleep(0.01)
+
+    extension = clients[0].protocol.extensions[0]
+    assert extension.remote_no_context_takeover and extension.local_no_context_takeover
+
+    large = PreparedMessage('{"event": "tick", "value": 42} ' * (DEFLATE_MIN_SIZE // 8))
+    small = PreparedMessage("Scheduled broadcast")
+    for message in (large, small):
+        await FanOut().send(manager.connections.snapshot(), message)
+
+    for client in clients:
+        assert await asyncio.wait_for(client.recv(), 2) == large
+        assert await asyncio.wait_for(client.recv(), 2) == small
+    # written as prepared frames, not through per-connection send_text()
+    assert all(record.outbound._deflate == 12 for record in manager.connections)
+    for client in clients:
+        await client.close()
+
+    frame = large.frame_for(12)
+    assert frame[0] & 0x40 and len(frame) < len(large) // 4
+    assert not small.frame_for(12)[0] & 0x40
+
+
+@pytest.mark.asyncio
+async def test_uvicorn_internals_the_shared_protocol_replaces():
+    """SharedDeflateProtocol swaps uvicorn's private `conn`: this breaks if a uvicorn upgrade changes it."""
+    config = uvicorn.Config(FastAPI(), ws_max_size=1234)
+    config.load()
+    stock = WebSocketsSansIOProtocol(config, ServerState(), {})
+    assert isinstance(stock.conn, ServerProtocol)
+    assert isinstance(stock.conn.available_extensions[0], ServerPerMessageDeflateFactory)
+
+    shared = SharedDeflateProtocol(config, ServerState(), {})
+    factory = shared.conn.available_extensions[0]
+    assert factory.server_no_context_takeover and factory.client_no_context_takeover
+    assert shared.conn.max_message_size == 1234
+    assert uvicorn_options(CompressionMode.SHARED.value) == {"ws": "core.compression:SharedDeflateProtocol"}
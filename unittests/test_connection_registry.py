@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from core.connection_registry import ConnectionRegistry
+from unittests.conftest import FakeWebSocket
+
+
+def test_remove_keeps_records_dense():
+    """Removing a record moves the last one into its slot; lookups and iteration stay consistent."""
+    registry = ConnectionRegistry()
+    records = [registry.add(f"ws{i}") for i in range(5)]
+
+    assert registry.remove(records[1])
+    assert not registry.remove(records[1])
+    assert [record.index for record in registry] == [0, 1, 2, 3]
+    assert list(registry)[1] is records[4]
+    assert registry.get("ws1") is None
+    assert registry.get_by_id(records[4].id) is records[4]
+    assert len(registry) == 4 and "ws4" in registry
+
+
+@pytest.mark.asyncio
+async def test_idle_connection_has_no_writer(manager):
+    """The outbound writer and its deque only exist while a message is pending."""
+    ws = FakeWebSocket()
+    record = manager.register(ws)
+    assert record.outbound._task is None
+    assert record.deadline == manager.scheduler.deadline(record)
+
+    assert manager.subscribe(ws, "news")
+    assert manager.send(ws, "hello")
+    assert record.outbound._task is not None
+    await asyncio.sleep(0.01)
+    assert ws.received == ["hello"]
+    assert record.outbound._task is None and record.outbound._pending is None
+
+    await manager.disconnect(ws)
+    assert record.index == -1 and record not in manager.scheduler
+    assert "news" not in manager.topics
+
+
+@pytest.mark.asyncio
+async def test_mark_recent_skips_exactly_one_broadcast(manager):
+    """A client notified directly skips the next global broadcast only, even if it was marked during a fan-out."""
+    notified, other = FakeWebSocket(), FakeWebSocket()
+    manager.register(notified)
+    manager.register(other)
+
+    manager.mark_recent(notified)
+    assert [record.websocket for record in manager.begin_broadcast()] == [other]
+
+    targets = manager.begin_broadcast()
+    manager.mark_recent(notified)  # arrives while the second broadcast is being fanned out
+    assert {record.websocket for record in targets} == {notified, other}
+    assert [record.websocket for record in manager.begin_broadcast()] == [other]
+    assert len(manager.begin_broadcast()) == 2
@@ -0,0 +1,90 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+import core.shutdown as shutdown_module
+from core import metrics
+from core.broadcast_strategy import Context, RedisBroadcasterStrategy
+from core.connection_manager import DRAIN_CLOSE_CODE
+from core.redis_broadcaster import RedisBroadcaster
+from core.shutdown import GracefulShutdown
+from unittests.conftest import FakeWebSocket
+
+
+@pytest.fixture
+def exits(monkeypatch, manager):
+    monkeypatch.setenv("TIMEOUT", "5")
+    monkeypatch.setenv("DRAIN_PERIOD", "0.3")
+    monkeypatch.setenv("DRAIN_BATCH_INTERVAL", "0.1")
+    monkeypatch.setattr(manager, "reconnect_spread", 2.0)
+    monkeypatch.setattr(manager, "draining", False)
+    monkeypatch.setattr(manager, "send_timeout", 0.1)
+    monkeypatch.setattr(GracefulShutdown, "_register_signals", lambda self: None)
+    monkeypatch.setattr(shutdown_module, "stop_logging", lambda: None)
+    exits = []
+    monkeypatch.setattr(shutdown_module.os, "_exit", exits.append)
+    yield exits
+    metrics.draining.set(0)
+
+
+def reconnect_after_ms(websocket) -> int:
+    name, _, value = websocket.close_reason.partition("=")
+    assert name == "reconnect_after_ms"
+    return int(value)
+
+
+@pytest.mark.asyncio
+async def test_drain_leaves_the_cluster_and_closes_in_paced_batches(manager, exits, monkeypatch):
+    """The worker releases the lease and deregisters at once, then closes its connections right away with 1012
+    and a reconnect hint, in batches spread over DRAIN_PERIOD, and turns new clients away the same way."""
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    broadcaster = RedisBroadcaster(client=client)
+    context = Context(workers_number=2)
+    context._selected = RedisBroadcasterStrategy(broadcaster)
+    monkeypatch.setattr(shutdown_module, "context", context)
+    assert await broadcaster._lease.acquire()
+    sockets = [FakeWebSocket() for _ in range(6)]
+    for websocket in sockets:
+        manager.register(websocket)
+    await broadcaster._registry.heartbeat(len(sockets))
+
+    started = asyncio.get_running_loop().time()
+    drain = asyncio.create_task(GracefulShutdown()._shutdown())
+    await asyncio.sleep(0.05)
+    assert await client.get(broadcaster._lease.key) is None
+    assert await broadcaster._registry.total_connections() == 0
+    assert await broadcaster._registry.workers() == {}
+
+    late = FakeWebSocket()
+    assert await manager.connect(late) is None
+    assert late.accepted and late.close_code == DRAIN_CLOSE_CODE
+    assert 0 <= reconnect_after_ms(late) <= 2000
+
+    await drain
+    assert exits == [0]
+    assert asyncio.get_running_loop().time() - started < 0.5
+    assert all(ws.close_code == DRAIN_CLOSE_CODE and 0 <= reconnect_after_ms(ws) <= 2000 for ws in sockets)
+    # 3 batches of 2, DRAIN_BATCH_INTERVAL apart
+    closed = sorted(ws.closed_at for ws in sockets)
+    assert closed[1] - closed[0] < 0.05 and closed[3] - closed[2] < 0.05 and closed[5] - closed[4] < 0.05
+    assert 0.08 < closed[2] - closed[1] < 0.2 and 0.08 < closed[4] - closed[3] < 0.2
+
+
+@pytest.mark.asyncio
+async def test_timeout_caps_the_drain(manager, exits, monkeypatch):
+    """A drain that would outlast TIMEOUT is cut: the connections still open then are closed at once."""
+    monkeypatch.setenv("TIMEOUT", "0.25")
+    monkeypatch.setenv("DRAIN_PERIOD", "1")
+    monkeypatch.setattr(shutdown_module, "context", Context(workers_number=1))
+    sockets = [FakeWebSocket() for _ in range(10)]
+    for websocket in sockets:
+        manager.register(websocket)
+
+    await GracefulShutdown()._shutdown()
+    assert exits == [0]
+    closed = sorted(ws.closed_at for ws in sockets)
+    assert all(ws.close_code == DRAIN_CLOSE_CODE for ws in sockets)
+    # batches of one every 0.1s: 0, 0.1, 0.2, then the rest at the 0.25s cap
+    assert 0.15 < closed[3] - closed[0] < 0.35
+    assert closed[-1] - closed[3] < 0.05
@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from socket_service import endpoints
+from unittests.conftest import FakeWebSocket
+
+
+class ClientWebSocket(FakeWebSocket):
+    """A FakeWebSocket that also receives: the given text frames, then a disconnect."""
+
+    def __init__(self, *frames):
+        super().__init__()
+        self.query_params = {}
+        self._incoming = [{"type": "websocket.receive", "text": frame} for frame in frames]
+        self._incoming.append({"type": "websocket.disconnect", "code": 1000})
+
+    async def receive(self):
+        return self._incoming.pop(0)
+
+
+@pytest.mark.asyncio
+async def test_failing_command_releases_the_connection(manager, monkeypatch):
+    """A handler that raises closes the socket with 1011 and leaves nothing in the registry or the topics."""
+    async def broken(manager, websocket, arg):
+        raise ConnectionError("Redis went away")
+
+    monkeypatch.setitem(endpoints.COMMANDS, "broken", broken)
+    ws = ClientWebSocket("subscribe news", "broken now", "ping")
+    await endpoints.websocket_endpoint(ws)
+    await asyncio.sleep(0.05)
+
+    assert ws.accepted
+    assert ws.close_code == endpoints.INTERNAL_ERROR_CLOSE_CODE
+    assert manager.get(ws) is None
+    assert "news" not in manager.topics
+    assert not manager.has_connections()
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from core import envelope
+from core.envelope import EnvelopeType
+from core.fanout import FanOut
+from core.frames import PreparedMessage
+from unittests.conftest import FakeWebSocket
+
+
+def test_envelope_round_trip():
+    """Every queued message keeps its type and topic; numbering continues from the connection's last seq."""
+    messages = ["pong", PreparedMessage("Scheduled broadcast"), PreparedMessage.for_topic("news", "héllo")]
+    assert messages[2] == "news: héllo"
+
+    decoded = envelope.decode(envelope.encode_batch(messages, seq=41))
+    assert decoded == [
+        (EnvelopeType.REPLY, 42, "", "pong"),
+        (EnvelopeType.BROADCAST, 43, "", "Scheduled broadcast"),
+        (EnvelopeType.TOPIC, 44, "news", "héllo"),
+    ]
+    assert envelope.decode(envelope.encode(EnvelopeType.COMMAND, 1, "subscribe", "news")) == [
+        (EnvelopeType.COMMAND, 1, "subscribe", "news")]
+    with pytest.raises(ValueError):
+        envelope.decode(envelope.encode(EnvelopeType.COMMAND, 1, "ping")[:-1])
+
+
+@pytest.mark.asyncio
+async def test_backlog_is_packed_into_one_frame(manager):
+    """While the first frame is in flight the rest of the backlog queues up and goes out as one frame."""
+    ws = FakeWebSocket(delay=0.05)
+    record = manager.register(ws, binary=True)
+    fanout = FanOut()
+
+    await fanout.send([record], "Scheduled broadcast")
+    await asyncio.sleep(0.01)
+    for i in range(5):
+        await fanout.send([record], PreparedMessage.for_topic("news", str(i)))
+    manager.send(ws, "pong")
+    await asyncio.sleep(0.2)
+
+    assert len(ws.frames) == 2 and not ws.received
+    first, second = map(envelope.decode, ws.frames)
+    assert [item.body for item in first] == ["Scheduled broadcast"]
+    assert [item.body for item in second] == ["0", "1", "2", "3", "4", "pong"]
+    assert [item.seq for item in first + second] == list(range(1, 8))
+    assert manager.outbound_stats.batched >= 1
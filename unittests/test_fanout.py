@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import pytest
+
+from core.fanout import FanOut
+from core.outbound import OverflowPolicy
+from unittests.conftest import FakeWebSocket
+
+
+@pytest.mark.asyncio
+async def test_slow_client_does_not_delay_the_others(manager, monkeypatch):
+    """One client that never drains only costs its own send timeout; the rest receive immediately."""
+    monkeypatch.setattr(manager, "send_timeout", 0.2)
+    slow = FakeWebSocket(delay=10)
+    broken = FakeWebSocket(broken=True)
+    fast = [FakeWebSocket() for _ in range(50)]
+    records = [manager.register(ws) for ws in [slow, broken, *fast]]
+
+    started = time.perf_counter()
+    result = await FanOut().send(records, "Scheduled broadcast")
+    assert result.targets == result.sent == 52
+
+    await asyncio.sleep(0.3)
+    assert all(ws.received == ["Scheduled broadcast"] for ws in fast)
+    assert max(ws.received_at for ws in fast) - started < 0.1
+    assert slow not in manager.get_connections()
+    assert broken not in manager.get_connections()
+
+
+@pytest.mark.asyncio
+async def test_overflow_policies(manager, monkeypatch):
+    """A full queue coalesces scheduled broadcasts, drops the oldest message or disconnects the slow consumer."""
+    monkeypatch.setattr(manager, "queue_size", 2)
+    stalled = FakeWebSocket(delay=10)
+
+    monkeypatch.setattr(manager, "overflow_policy", OverflowPolicy.COALESCE)
+    manager.register(stalled)
+    await asyncio.sleep(0)
+    for message in ["Scheduled broadcast", "a", "Scheduled broadcast", "b"]:
+        assert manager.send(stalled, message)
+    assert list(manager.get(stalled).outbound._pending) == ["a", "b"]
+    await manager.disconnect(stalled)
+
+    monkeypatch.setattr(manager, "overflow_policy", OverflowPolicy.DROP_OLDEST)
+    manager.register(stalled)
+    await asyncio.sleep(0)
+    for message in ["a", "b", "c", "d"]:
+        assert manager.send(stalled, message)
+    assert list(manager.get(stalled).outbound._pending) == ["c", "d"]
+    await manager.disconnect(stalled)
+
+    monkeypatch.setattr(manager, "overflow_policy", OverflowPolicy.DISCONNECT)
+    record = manager.register(stalled)
+    await asyncio.sleep(0)
+    result = await FanOut().send([record] * 4, "a")
+    assert result.failed == [record, record]
+    assert stalled not in manager.get_connections()
+    await asyncio.sleep(0.01)
+    assert stalled.close_code == 1008
+
+
+@pytest.mark.asyncio
+async def test_failed_writers_are_disconnected_in_one_batch(manager, monkeypatch):
+    """Sends that fail together are removed by a single disconnect_many, closed as slow consumers."""
+    batches = []
+    disconnect_many = manager.disconnect_many
+
+    async def recording(websockets, code=None):
+        batches.append((list(websockets), code))
+        await disconnect_many(websockets, code)
+
+    monkeypatch.setattr(manager, "disconnect_many", recording)
+    broken = [FakeWebSocket(broken=True) for _ in range(5)]
+    healthy = FakeWebSocket()
+    records = [manager.register(ws) for ws in [*broken, healthy]]
+
+    await FanOut().send(records, "Scheduled broadcast")
+    await asyncio.sleep(0.05)
+    assert batches == [(broken, 1008)]
+    assert list(manager.get_connections()) == [healthy]
+    assert all(ws.close_code == 1008 for ws in broken)
+
+
+@pytest.mark.asyncio
+async def test_spread_broadcast_keeps_a_fixed_phase_per_connection(manager):
+    """A spread broadcast reaches every connection once, slot by slot, each at its own offset into the window."""
+    clients = [FakeWebSocket() for _ in range(8)]
+    records = [manager.register(ws) for ws in clients]
+    fanout = FanOut()
+    fanout.spread, fanout.slots = 0.4, 4
+
+    started = time.perf_counter()
+    await fanout.broadcast(records, "Scheduled broadcast")
+    await asyncio.sleep(0.5)
+
+    assert all(ws.received == ["Scheduled broadcast"] for ws in clients)
+    for record, ws in zip(records, clients):
+        offset = ws.received_at - started
+        assert (record.id % 4) * 0.1 <= offset < (record.id % 4) * 0.1 + 0.08
@@ -0,0 +1,17 @@
+import pytest
+from websockets.frames import Frame, Opcode
+
+from core.frames import PreparedMessage, encode_frame
+
+
+@pytest.mark.parametrize("size", [0, 125, 126, 65535, 65536])
+def test_prepared_frame_matches_websockets_serialization(size):
+    """The shared frame is byte-for-byte what the websockets library would write for the same text."""
+    text = "é" * (size // 2) + "x" * (size % 2)
+    expected = Frame(Opcode.TEXT, text.encode("utf-8")).serialize(mask=False, extensions=[])
+
+    message = PreparedMessage(text)
+    assert message == text
+    assert message.frame == expected
+    assert message.frame is message.frame
+    assert encode_frame(text.encode("utf-8")) == expected
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+import uvicorn
+from fastapi import FastAPI
+from uvicorn.protocols.websockets.websockets_sansio_impl import WebSocketsSansIOProtocol
+from uvicorn.server import ServerState
+
+from core import metrics
+from core.frames import PROTOCOL_SCOPE_KEY, stop_server_keepalive
+from core.keepalive import Keepalive
+from unittests.conftest import FakeWebSocket
+
+
+class FakeTransport:
+    def is_closing(self):
+        return False
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def get_write_buffer_limits(self):
+        return 16384, 65536
+
+
+class FakeProtocol:
+    is_client = False
+
+    def __init__(self, answers=True):
+        self.answers = answers
+        self.transport = FakeTransport()
+        self.pings = 0
+
+    async def ping(self):
+        self.pings += 1
+        waiter = asyncio.get_running_loop().create_future()
+        if self.answers:
+            waiter.set_result(0.001)
+        return waiter
+
+
+@pytest_asyncio.fixture
+async def manager(manager, monkeypatch):
+    # the test keepalive registers its own metric callbacks, the worker's come back afterwards
+    monkeypatch.setattr(metrics.registry, "_metrics", dict(metrics.registry._metrics))
+    keepalive = manager.keepalive
+    manager.keepalive = Keepalive(manager, interval=0.1, timeout=0.1)
+    task = asyncio.create_task(manager.keepalive.run())
+    yield manager
+    task.cancel()
+    await manager.disconnect_many(list(manager.get_connections()))
+    manager.keepalive = keepalive
+
+
+@pytest.mark.asyncio
+async def test_connections_without_pong_are_reaped(manager):
+    """Live connections are pinged every interval, a connection that misses a pong is reaped with 1011."""
+    alive, dead = FakeProtocol(), FakeProtocol(answers=False)
+    alive_ws, dead_ws = FakeWebSocket(scope={PROTOCOL_SCOPE_KEY: alive}), FakeWebSocket(scope={PROTOCOL_SCOPE_KEY: dead})
+    manager.register(alive_ws)
+    manager.register(dead_ws)
+
+    await asyncio.sleep(0.9)
+    assert alive_ws in manager.get_connections()
+    assert dead_ws not in manager.get_connections()
+    assert alive.pings >= 2 and dead.pings == 1
+    assert manager.keepalive.reaped == 1
+    await asyncio.sleep(0.01)
+    assert dead_ws.close_code == 1011
+
+
+@pytest.mark.asyncio
+async def test_uvicorn_ping_loop_is_stopped_for_tracked_connections():
+    """Without --ws-ping-interval 0, uvicorn's own ping timer is cancelled so a connection is not pinged twice."""
+    config = uvicorn.Config(FastAPI(), ws_ping_interval=20.0)
+    config.load()
+    protocol = WebSocketsSansIOProtocol(config, ServerState(), {})
+    protocol.start_keepalive()
+    assert protocol.ping_timer is not None
+
+    stop_server_keepalive(protocol)
+    assert protocol.ping_timer is None and protocol.ping_interval is None
+    protocol.start_keepalive()
+    assert protocol.ping_timer is None
@@ -0,0 +1,131 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from core.lease import Lease
+from core.redis_broadcaster import RedisBroadcaster
+from core.worker_registry import WorkerRegistry
+from unittests.conftest import FakeWebSocket
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeAsyncRedis(decode_responses=True)
+
+
+@pytest.mark.asyncio
+async def test_renewal_is_compare_and_set_and_writes_are_fenced(client):
+    """A leader that lost its lease can neither renew somebody else's lease nor publish."""
+    old, new = Lease(client, owner="old", ttl=0.3), Lease(client, owner="new", ttl=0.3)
+    assert await old.acquire() == 1
+    assert await new.acquire() is None
+    assert new.holder == "old 1"
+
+    await asyncio.sleep(0.4)  # old stalls past its TTL
+    assert await new.acquire() == 2
+    assert not await old.renew()
+    assert not old.is_held
+    old.token = 1
+    assert not await old.publish("ws_broadcast", "Scheduled broadcast")
+    assert await new.publish("ws_broadcast", "Scheduled broadcast")
+    assert await new.renew()
+
+    assert await new.release()
+    assert await old.acquire() == 3
+
+
+@pytest.mark.asyncio
+async def test_receivers_drop_messages_of_superseded_leaders(client, manager):
+    """A broadcast carrying a lower fencing token than one already delivered is dropped."""
+    broadcaster = RedisBroadcaster(client=client)
+    ws = FakeWebSocket()
+    manager.register(ws)
+    listener = asyncio.create_task(broadcaster.listen_and_broadcast())
+    await broadcaster._listening.wait()
+
+    for message in ["2 from the new leader", "1 from the old leader", "3 from the next one"]:
+        await client.publish(broadcaster.channel, message)
+    await asyncio.sleep(0.05)
+    listener.cancel()
+    assert ws.received == ["from the new leader", "from the next one"]
+
+
+@pytest.mark.asyncio
+async def test_fence_follows_a_token_counter_reset(client, manager):
+    """After Redis lost the token counter (a flush), standbys rebase their fence and deliver the new leader."""
+    broadcaster = RedisBroadcaster(client=client)
+    broadcaster._lease.poll_interval = 0.05
+    ws = FakeWebSocket()
+    manager.register(ws)
+    listener = asyncio.create_task(broadcaster.listen_and_broadcast())
+    await broadcaster._listening.wait()
+
+    old = Lease(client, owner="old")
+    for _ in range(6):
+        await client.incr(old.token_key)
+    assert await old.acquire() == 7
+    standby = asyncio.create_task(broadcaster.publisher_loop())
+    assert await old.publish(broadcaster.channel, "before the flush")
+    await asyncio.sleep(0.1)
+
+    # the standby is paused so that the new leader, not the standby, takes the flushed lease
+    standby.cancel()
+    await asyncio.gather(standby, return_exceptions=True)
+    await client.flushdb()
+    new = Lease(client, owner="new")
+    assert await new.acquire() == 1
+    standby = asyncio.create_task(broadcaster.publisher_loop())
+    await asyncio.sleep(0.1)
+    assert await new.publish(broadcaster.channel, "after the flush")
+    await asyncio.sleep(0.05)
+
+    standby.cancel()
+    listener.cancel()
+    await asyncio.gather(standby, listener, return_exceptions=True)
+    assert ws.received == ["before the flush", "after the flush"]
+    assert broadcaster._fence == 1
+
+
+@pytest.mark.asyncio
+async def test_failover_broadcast_gap(client):
+    """When the leader dies without releasing the lease, a standby takes over within TTL + poll interval."""
+    registry = WorkerRegistry(client, worker_id="host:1")
+    await registry.heartbeat(1)
+
+    workers = []
+    for owner in ("a", "b"):
+        worker = RedisBroadcaster(client=client)
+        worker.interval = 0.2
+        worker._lease = Lease(client, owner=owner, ttl=0.6)
+        worker._registry = registry
+        workers.append(worker)
+
+    pubsub = client.pubsub()
+    await pubsub.subscribe(workers[0].channel)
+    received = []
+
+    async def receive():
+        async for msg in pubsub.listen():
+            if msg["type"] == "message":
+                received.append((asyncio.get_running_loop().time(), int(msg["data"].split(" ", 1)[0])))
+
+    receiver = asyncio.create_task(receive())
+    first = asyncio.create_task(workers[0].publisher_loop())
+    await asyncio.sleep(0.1)
+    second = asyncio.create_task(workers[1].publisher_loop())
+    await asyncio.sleep(1.0)
+    first.cancel()  # the leader dies, its lease is left to expire
+    killed_at = asyncio.get_running_loop().time()
+    await asyncio.sleep(2.0)
+    second.cancel()
+    receiver.cancel()
+
+    tokens = [token for _, token in received]
+    assert tokens[0] == 1 and tokens[-1] == 2 and tokens == sorted(tokens)
+    before = [at for at, token in received if token == 1]
+    after = [at for at, token in received if token == 2]
+    lease = workers[1]._lease
+    # the dead leader is replaced within TTL + 1s, and the broadcast gap is at most TTL + poll + interval
+    assert after[0] - killed_at < lease.ttl + 1.0
+    assert after[0] - before[-1] < lease.ttl + lease.poll_interval + workers[1].interval + 0.1
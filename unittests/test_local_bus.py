@@ -0,0 +1,83 @@
+import asyncio
+import os
+
+import pytest
+
+from core.local_bus import LocalBus
+
+
+def make_bus(address, received):
+    async def on_message(topic, data):
+        received.append((topic, data))
+    return LocalBus(on_message, address=address, retry_delay=0.01)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("transport", ["unix", "tcp"])
+async def test_hub_routes_broadcasts_and_topics_and_fails_over(tmp_path, transport, unused_tcp_port):
+    """One bus node wins the election, messages reach every node (topics only the interested ones),
+    and a follower takes over when the hub goes away."""
+    if transport == "unix":
+        if os.name == "nt":
+            pytest.skip("no Unix sockets")
+        address = str(tmp_path / "bus.sock")
+    else:
+        address = f"tcp://127.0.0.1:{unused_tcp_port}"
+
+    hub_received, follower_received = [], []
+    hub, follower = make_bus(address, hub_received), make_bus(address, follower_received)
+    hub_task = asyncio.create_task(hub.run())
+    await hub.wait_leader()
+    follower_task = asyncio.create_task(follower.run())
+    await asyncio.sleep(0.1)
+
+    assert hub.is_leader and not follower.is_leader
+    await follower.update_state(3, {"news"})
+    await hub.update_state(1, set())
+    await asyncio.sleep(0.05)
+    assert hub.total_connections() == 4
+
+    await follower.publish(None, "Scheduled broadcast")
+    await asyncio.sleep(0.05)
+    await hub.publish("news", "hello")
+    await hub.publish("sports", "ignored")
+    await asyncio.sleep(0.05)
+    assert hub_received == [(None, "Scheduled broadcast")]
+    assert follower_received == [(None, "Scheduled broadcast"), ("news", "hello")]
+
+    hub.close()
+    await asyncio.wait_for(follower.wait_leader(), timeout=1)
+    assert follower.is_leader
+
+    follower.close()
+    await asyncio.sleep(0.05)
+    for task in (hub_task, follower_task):
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_draining_hub_steps_down_and_follows(tmp_path):
+    """A hub that steps down hands the hub to a follower at once and keeps receiving broadcasts from it."""
+    address = str(tmp_path / "bus.sock")
+    hub_received, follower_received = [], []
+    hub, follower = make_bus(address, hub_received), make_bus(address, follower_received)
+    tasks = [asyncio.create_task(hub.run())]
+    await hub.wait_leader()
+    tasks.append(asyncio.create_task(follower.run()))
+    await asyncio.sleep(0.1)
+
+    hub.step_down()
+    tasks.append(asyncio.create_task(hub.run()))
+    await asyncio.wait_for(follower.wait_leader(), timeout=1)
+    await asyncio.sleep(0.1)
+    assert not hub.is_leader and hub.connected
+
+    await follower.publish(None, "Scheduled broadcast")
+    await asyncio.sleep(0.05)
+    assert hub_received == [(None, "Scheduled broadcast")]
+
+    follower.close()
+    hub.close()
+    await asyncio.sleep(0.05)
+    for task in tasks:
+        task.cancel()
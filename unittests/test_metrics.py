@@ -0,0 +1,68 @@
+import pytest
+from fastapi import FastAPI
+
+from core import metrics
+from router.registry_rout import add_api_websocket_rout
+from unittests.conftest import FakeWebSocket
+
+
+async def scrape(app: FastAPI) -> tuple:
+    """GETs /metrics through the ASGI app and returns the status, the content type and the body."""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": "/metrics", "raw_path": b"/metrics", "root_path": "", "query_string": b"", "headers": [],
+             "client": ("127.0.0.1", 1234), "server": ("127.0.0.1", 8000)}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    start = sent[0]
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    return start["status"], dict(start["headers"])[b"content-type"], body.decode()
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_exposition(manager):
+    """/metrics serves the Prometheus text format: HELP/TYPE per family, the worker label and full histograms."""
+    app = FastAPI()
+    add_api_websocket_rout(app)
+    manager.register(FakeWebSocket())
+    metrics.fanout_duration.labels(metrics.worker, "test").observe(0.003)
+
+    status, content_type, body = await scrape(app)
+    assert status == 200
+    assert content_type.startswith(b"text/plain; version=0.0.4")
+    lines = body.splitlines()
+
+    assert "# HELP ws_connects_total Accepted WebSocket connections" in lines
+    assert "# TYPE ws_connects_total counter" in lines
+    assert "# TYPE ws_active_connections gauge" in lines
+    assert "# TYPE ws_fanout_duration_seconds histogram" in lines
+    assert f'ws_active_connections{{worker="{metrics.worker}"}} 1' in lines
+
+    series = f'worker="{metrics.worker}",broadcaster="test"'
+    buckets = [line for line in lines if line.startswith(f"ws_fanout_duration_seconds_bucket{{{series},")]
+    assert len(buckets) == len(metrics.LATENCY_BUCKETS) + 1
+    assert buckets[0].endswith(' 0') and buckets[-1] == f'ws_fanout_duration_seconds_bucket{{{series},le="+Inf"}} 1'
+    assert f'ws_fanout_duration_seconds_bucket{{{series},le="0.005"}} 1' in lines
+    assert f"ws_fanout_duration_seconds_sum{{{series}}} 0.003" in lines
+    assert f"ws_fanout_duration_seconds_count{{{series}}} 1" in lines
+
+    metrics.fanout_duration._children.pop((metrics.worker, "test"))
+
+
+def test_register_callback_replaces_the_previous_one():
+    """A second registration under the same name reads the new callback, the family is rendered once."""
+    metrics.register_callback("ws_test_value", "A test value", lambda: 1)
+    metrics.register_callback("ws_test_value", "A test value", lambda: 2, kind="counter")
+    try:
+        lines = metrics.registry.render().splitlines()
+        assert f'ws_test_value{{worker="{metrics.worker}"}} 2' in lines
+        assert lines.count("# TYPE ws_test_value counter") == 1
+        assert "# TYPE ws_test_value gauge" not in lines
+    finally:
+        metrics.registry._metrics.pop("ws_test_value")
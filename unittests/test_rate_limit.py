@@ -0,0 +1,36 @@
+from core.rate_limit import RateLimitAction, RateLimits, parse_limits
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_parse_limits():
+    assert parse_limits("send_now=2:5, *=50") == {"send_now": (2.0, 5.0), "*": (50.0, 50.0)}
+
+
+def test_budgets_are_per_command_and_refill():
+    """A command has its own bucket: exhausting send_now leaves other frames alone, tokens come back over time."""
+    clock = FakeClock()
+    limits = RateLimits("send_now=1:2,*=10:3", action="close", clock=clock)
+    buckets = {}
+
+    assert limits.action is RateLimitAction.CLOSE
+    assert [limits.allow(buckets, "send_now") for _ in range(3)] == [True, True, False]
+    assert limits.allow(buckets, "ping")
+    assert limits.allow(buckets, "unknown")
+    assert set(buckets) == {"send_now", "*"}
+
+    clock.now = 1.0
+    assert limits.allow(buckets, "send_now")
+    assert not limits.allow(buckets, "send_now")
+    assert limits._throttled["send_now"].value == 2
+
+
+def test_commands_without_budget_are_not_limited():
+    limits = RateLimits("send_now=1:1", clock=FakeClock())
+    assert all(limits.allow({}, "ping") for _ in range(100))
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from core import envelope
+from core.frames import PreparedMessage
+from core.recent import RecentMessages
+from unittests.conftest import FakeWebSocket
+
+
+@pytest_asyncio.fixture
+async def manager(manager):
+    recent = manager.recent
+    manager.recent = RecentMessages(count=3, size=1024, topics=2)
+    yield manager
+    manager.recent = recent
+
+
+def test_eviction_by_count_bytes_and_topics():
+    """Buffers keep the newest messages within their count and byte limits, and the most recently written topics."""
+    recent = RecentMessages(count=3, size=100, topics=2)
+    for i in range(5):
+        recent.add(PreparedMessage(f"m{i}"))
+    assert recent.snapshot() == ["m2", "m3", "m4"]
+
+    recent.add(PreparedMessage("x" * 60))
+    recent.add(PreparedMessage("y" * 60))
+    assert recent.snapshot() == ["y" * 60]
+
+    tick = PreparedMessage("Scheduled broadcast")
+    recent.add(tick)
+    recent.add(tick)
+    assert recent.snapshot() == ["y" * 60, "Scheduled broadcast"]
+
+    for topic in ("a", "b", "a", "c"):
+        recent.add(PreparedMessage.for_topic(topic, "hi"))
+    assert recent.snapshot("a") == ["a: hi", "a: hi"]
+    assert recent.snapshot("b") == []
+    assert recent.snapshot("c") == ["c: hi"]
+    assert recent.bytes == sum(len(m.frame) for key in (None, "a", "c") for m in recent.snapshot(key))
+
+
+@pytest.mark.asyncio
+async def test_snapshot_is_sent_as_one_batch(manager):
+    """A text client gets the recent messages in one frame, a binary client as envelopes packed in one frame."""
+    for i in range(4):
+        manager.recent.add(PreparedMessage(f"broadcast {i}"))
+    manager.recent.add(PreparedMessage.for_topic("news", "headline"))
+
+    text, binary = FakeWebSocket(), FakeWebSocket()
+    manager.register(text)
+    manager.register(binary, binary=True)
+    assert manager.send_snapshot(text)
+    assert manager.send_snapshot(binary, "news")
+    assert not manager.send_snapshot(text, "sports")
+    await asyncio.sleep(0.05)
+
+    assert text.received == ["broadcast 1\nbroadcast 2\nbroadcast 3"]
+    assert [[(item.type, item.topic, item.body) for item in envelope.decode(frame)] for frame in binary.frames] == [
+        [(envelope.EnvelopeType.TOPIC, "news", "headline")]]
@@ -12,7 +12,7 @@ async def test_graceful_shutdown_multi_worker():
     """
     If we run a server with several workers, we check:
     - workers without a connection end quickly
-    - a worker with an active connection waits before completing
+    - a worker with active connections closes them with 1012 in paced batches, within TIMEOUT (60 seconds)
     """
     num_clients = 3
     connections = []
@@ -23,17 +23,19 @@ async def test_graceful_shutdown_multi_worker():
 
     start = datetime.now()
     delays = []
+    codes = []
 
     async def wait_for_close(i, ws):
         try:
             while True:
                 await ws.recv()
-        except ConnectionClosedError:
+        except ConnectionClosedError as e:
             end = datetime.now()
             elapsed = (end - start).total_seconds()
             delays.append(elapsed)
+            codes.append(e.rcvd.code)
 
     await asyncio.gather(*(wait_for_close(i, ws) for i, ws in enumerate(connections)))
 
-    long_lived = [d for d in delays if d >= 55]
-    assert long_lived
+    assert codes == [1012] * num_clients
+    assert max(delays) < 65
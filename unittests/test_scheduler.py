@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from core.scheduler import DeadlineScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_pop_due_returns_only_due_keys_in_deadline_order():
+    """Keys come back once their deadline passed, earliest first, and are removed from the scheduler."""
+    clock = FakeClock()
+    scheduler = DeadlineScheduler(clock=clock)
+    scheduler.schedule("c", 3)
+    scheduler.schedule("a", 1)
+    scheduler.schedule("b", 2)
+
+    clock.now = 0.5
+    assert scheduler.pop_due() == []
+
+    clock.now = 2.0
+    assert scheduler.pop_due() == ["a", "b"]
+    assert "a" not in scheduler
+    assert len(scheduler) == 1
+
+
+def test_cancel_and_reschedule():
+    """A cancelled key is never returned, a rescheduled key only at its new deadline."""
+    clock = FakeClock()
+    scheduler = DeadlineScheduler(clock=clock)
+    scheduler.schedule("a", 1)
+    scheduler.schedule("b", 1)
+
+    assert scheduler.cancel("a")
+    assert not scheduler.cancel("a")
+    scheduler.schedule("b", 5)
+
+    clock.now = 1.0
+    assert scheduler.pop_due() == []
+    assert scheduler.next_deadline() == pytest.approx(5.0)
+
+    clock.now = 5.0
+    assert scheduler.pop_due() == ["b"]
+    assert scheduler.next_deadline() is None
+
+
+@pytest.mark.asyncio
+async def test_wait_due_wakes_up_for_an_earlier_deadline():
+    """A key scheduled earlier than the current sleep wakes the waiter up on time."""
+    scheduler = DeadlineScheduler(resolution=0.01)
+    scheduler.schedule("late", 5)
+
+    waiter = asyncio.create_task(scheduler.wait_due())
+    await asyncio.sleep(0.05)
+    scheduler.schedule("early", 0.05)
+
+    due = await asyncio.wait_for(waiter, timeout=1)
+    assert due == ["early"]
+    assert "late" in scheduler
@@ -9,7 +9,8 @@ WS_URI = "ws://localhost:8000/ws"
 async def test_shutdown_waits_for_client_disconnect():
     """
         The client opens the connection and keeps it open.
-        After manually terminating the server (SIGINT), the connection should last ~60 seconds.
+        After manually terminating the server (SIGINT), the connection is closed within DRAIN_PERIOD (10 seconds)
+        with 1012 and a reconnect hint, never later than TIMEOUT (60 seconds).
     """
 
     async with websockets.connect(WS_URI) as ws:
@@ -21,4 +22,6 @@ async def test_shutdown_waits_for_client_disconnect():
         except ConnectionClosedError as e:
             end = datetime.now()
             elapsed = (end - start).total_seconds()
-            assert elapsed >= 55
\ No newline at end of file
+            assert elapsed < 65
+            assert e.rcvd.code == 1012
+            assert e.rcvd.reason.startswith("reconnect_after_ms=")
\ No newline at end of file
@@ -0,0 +1,114 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+import redis_client
+from core.broadcast import Broadcaster
+from core.broadcast_strategy import Context
+from core.redis_broadcaster import RedisBroadcaster
+from core.singeltone import Singleton
+from unittests.conftest import FakeWebSocket
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeAsyncRedis(decode_responses=True)
+
+
+@pytest.mark.asyncio
+async def test_only_the_selected_strategy_is_built(monkeypatch):
+    """A context builds nothing until it is used, and a single worker never creates a Redis client."""
+    monkeypatch.setattr(redis_client, "_redis", None)
+    monkeypatch.setattr(redis_client, "_pubsub_redis", None)
+
+    multi = Context(workers_number=2)
+    assert multi._selected is None and not multi.ready
+
+    single = Context(workers_number=1)
+    single.start()
+    try:
+        assert single.ready
+        assert redis_client._redis is None and redis_client._pubsub_redis is None
+    finally:
+        task = Broadcaster()._broadcast_task
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        Singleton._instances.pop(Broadcaster, None)
+
+
+@pytest.mark.asyncio
+async def test_ready_once_warmed_and_subscribed(client, manager):
+    """The listener subscribes after the warm-up, and serves the broadcast and direct channels on one connection."""
+    broadcaster = RedisBroadcaster(client=client)
+    assert not broadcaster.ready
+    broadcaster._listen_task = asyncio.create_task(broadcaster._warm_and_listen())
+    await broadcaster._listening.wait()
+    assert broadcaster.ready
+    assert all(await client.script_exists(*(script.sha for script in broadcaster._lease.scripts)))
+
+    ws = FakeWebSocket()
+    manager.register(ws, client_id="c1")
+    await client.publish(broadcaster.channel, "0 hello")
+    await client.publish(broadcaster._directory.channel, "c1 just for you")
+    await asyncio.sleep(0.05)
+    assert ws.received == ["hello", "just for you"]
+
+    broadcaster._listen_task.cancel()
+    await asyncio.gather(broadcaster._listen_task, return_exceptions=True)
+    assert not broadcaster.ready
+
+
+@pytest.mark.asyncio
+async def test_renewal_and_total_in_one_pipeline(client):
+    """The pipelined renewal reads the cluster total, and falls back to plain calls when Redis lost the script."""
+    broadcaster = RedisBroadcaster(client=client)
+    await broadcaster.warm()
+    await broadcaster._registry.heartbeat(3)
+    assert await broadcaster._lease.acquire()
+    assert await broadcaster._renew_and_count() == (True, 3)
+
+    await client.script_flush()
+    assert await broadcaster._renew_and_count() == (True, 3)
+
+    await client.set(broadcaster._lease.key, "somebody 99")
+    assert await broadcaster._renew_and_count() == (False, 3)
+    assert not broadcaster._lease.is_held
+
+
+@pytest.mark.asyncio
+async def test_listener_reconnects_and_resubscribes(client, manager, monkeypatch):
+    """A failed subscription is reopened with a backoff, with the broadcast, direct and topic channels."""
+    broadcaster = RedisBroadcaster(client=client)
+    broadcaster.reconnect_delay = 0.05
+    failures = []
+    pubsub = client.pubsub
+
+    def failing_pubsub(**kwargs):
+        created = pubsub(**kwargs)
+        if not failures:
+            async def listen():
+                failures.append(True)
+                raise ConnectionError("Connection reset by peer")
+                yield
+            created.listen = listen
+        return created
+
+    monkeypatch.setattr(client, "pubsub", failing_pubsub)
+    ws = FakeWebSocket()
+    manager.register(ws, client_id="c1")
+    manager.subscribe(ws, "news")
+    broadcaster._listen_task = asyncio.create_task(broadcaster.listen_and_broadcast())
+    await asyncio.sleep(0.02)
+    assert failures and not broadcaster._listening.is_set()
+
+    await asyncio.sleep(0.1)
+    assert broadcaster._listening.is_set()
+    await client.publish(broadcaster.channel, "0 hello")
+    await client.publish(broadcaster._directory.channel, "c1 just for you")
+    await client.publish(broadcaster.topic_channel("news"), "headline")
+    await asyncio.sleep(0.05)
+    assert ws.received == ["hello", "just for you", "news: headline"]
+
+    broadcaster._listen_task.cancel()
+    await asyncio.gather(broadcaster._listen_task, return_exceptions=True)
@@ -0,0 +1,115 @@
+import asyncio
+
+import fakeredis
+import pytest
+import pytest_asyncio
+from redis.exceptions import ResponseError
+
+from core.connection_manager import ConnectionManager
+from core.lease import Lease
+from core.stream_broadcaster import StreamBroadcaster
+from unittests.conftest import FakeWebSocket
+
+
+@pytest_asyncio.fixture
+async def broadcaster():
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    broadcaster = StreamBroadcaster(client=client)
+    broadcaster._lease = Lease(client, owner="leader")
+    await broadcaster._lease.acquire()
+    broadcaster.batch = 2
+    broadcaster.block_ms = 50
+    yield broadcaster
+    manager = ConnectionManager()
+    await manager.disconnect_many(list(manager.get_connections()))
+
+
+@pytest.mark.asyncio
+async def test_resume_replays_missed_messages_then_goes_live(broadcaster):
+    """A reconnecting client gets what it missed in one batch, then live messages tagged with their ids."""
+    first_id = await broadcaster._redis.xadd(broadcaster.channel, {"data": "before"})
+    for i in range(3):
+        await broadcaster.publish_broadcast(f"missed {i}")
+
+    listener = asyncio.create_task(broadcaster.listen_and_broadcast())
+    await asyncio.sleep(0.1)
+
+    manager = ConnectionManager()
+    client, plain = FakeWebSocket(), FakeWebSocket()
+    manager.register(client)
+    manager.register(plain)
+
+    assert await broadcaster.resume(client, first_id)
+    await broadcaster.publish_broadcast("live")
+    await asyncio.sleep(0.2)
+    listener.cancel()
+
+    replayed = [line.split(" ", 1)[1] for frame in client.received[:-1] for line in frame.split("\n")]
+    assert replayed == ["missed 0", "missed 1", "missed 2"]
+    assert client.received[-1].endswith(" live")
+    assert plain.received == ["live"]
+
+
+@pytest.mark.asyncio
+async def test_replay_stops_where_the_live_loop_is(broadcaster):
+    """Entries the live loop has not read yet are left to it, so a client never gets an entry twice."""
+    before = await broadcaster._redis.xadd(broadcaster.channel, {"data": "before"})
+    ids = [await broadcaster.publish_broadcast(f"m{i}") for i in range(4)]
+    # the live loop has read up to m1 so far
+    broadcaster._last_ids[broadcaster.channel] = ids[1]
+
+    client = FakeWebSocket()
+    ConnectionManager().register(client)
+    assert await broadcaster.resume(client, before)
+    listener = asyncio.create_task(broadcaster.listen_and_broadcast())
+    await asyncio.sleep(0.2)
+    listener.cancel()
+
+    lines = [line for frame in client.received for line in frame.split("\n")]
+    assert lines == [f"{entry_id} m{i}" for i, entry_id in enumerate(ids)]
+
+
+@pytest.mark.asyncio
+async def test_invalid_resume_id_keeps_plain_delivery(broadcaster):
+    """A malformed or out-of-range id is refused before anything changes: the client keeps plain delivery."""
+    client = FakeWebSocket()
+    ConnectionManager().register(client)
+    assert not await broadcaster.resume(client, "foo")
+    assert not await broadcaster.resume(client, "99999999999999999999999-0")
+    assert not await broadcaster.resume(client, f"1-{2 ** 64}")
+    assert client not in broadcaster._tagged
+
+    listener = asyncio.create_task(broadcaster.listen_and_broadcast())
+    await asyncio.sleep(0.1)
+    await broadcaster.publish_broadcast("live")
+    await asyncio.sleep(0.2)
+    listener.cancel()
+    assert client.received == ["live"]
+
+
+@pytest.mark.asyncio
+async def test_resume_refused_by_redis_changes_nothing(broadcaster, monkeypatch):
+    """An id Redis refuses on XREAD is reported as unsupported, the client is neither tagged nor left replaying."""
+    async def xread(*args, **kwargs):
+        raise ResponseError("Invalid stream ID specified as stream command argument")
+
+    client = FakeWebSocket()
+    ConnectionManager().register(client)
+    monkeypatch.setattr(broadcaster._redis, "xread", xread)
+    assert not await broadcaster.resume(client, "1-0")
+    assert client not in broadcaster._tagged
+    assert client not in broadcaster._replaying
+
+
+@pytest.mark.asyncio
+async def test_replay_ends_when_a_tracked_stream_is_gone(broadcaster):
+    """A stream the live loop still tracks but XREAD no longer returns (deleted) ends the replay after one round."""
+    manager = ConnectionManager()
+    client = FakeWebSocket()
+    manager.register(client)
+    manager.subscribe(client, "news")
+    broadcaster._last_ids[broadcaster.topic_channel("news")] = "5-0"
+
+    assert await asyncio.wait_for(broadcaster.resume(client, "1-0"), timeout=1)
+    assert client in broadcaster._tagged
+    assert client.received == []
@@ -0,0 +1,46 @@
+import asyncio
+
+import fakeredis
+import pytest
+import pytest_asyncio
+
+from core.connection_manager import ConnectionManager
+from core.redis_broadcaster import RedisBroadcaster
+from unittests.conftest import FakeWebSocket
+
+
+@pytest_asyncio.fixture
+async def broadcaster():
+    broadcaster = RedisBroadcaster(client=fakeredis.FakeAsyncRedis(decode_responses=True))
+    broadcaster._manager.add_topic_listener(broadcaster._on_topic_change)
+    tasks = [asyncio.create_task(broadcaster.listen_and_broadcast()), asyncio.create_task(broadcaster.interest_loop())]
+    await broadcaster._listening.wait()
+    yield broadcaster
+    for task in tasks:
+        task.cancel()
+    manager = ConnectionManager()
+    manager._topic_listeners.remove(broadcaster._on_topic_change)
+    await manager.disconnect_many(list(manager.get_connections()))
+
+
+@pytest.mark.asyncio
+async def test_topic_messages_reach_only_subscribers(broadcaster):
+    """A worker subscribes to a topic channel only while it has local subscribers, and fans out only to them."""
+    manager = ConnectionManager()
+    subscriber, other = FakeWebSocket(), FakeWebSocket()
+    manager.register(subscriber)
+    manager.register(other)
+
+    assert manager.subscribe(subscriber, "news")
+    await asyncio.sleep(0.05)
+    assert broadcaster.topic_channel("news") in broadcaster._pubsub.channels
+
+    await broadcaster.publish("news", "hello")
+    await asyncio.sleep(0.05)
+    assert subscriber.received == ["news: hello"]
+    assert other.received == []
+
+    await manager.disconnect(subscriber)
+    await asyncio.sleep(0.05)
+    assert "news" not in manager.topics
+    assert broadcaster.topic_channel("news") not in broadcaster._pubsub.channels
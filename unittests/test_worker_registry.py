@@ -0,0 +1,31 @@
+import fakeredis
+import pytest
+
+from core.worker_registry import WorkerRegistry
+
+
+@pytest.mark.asyncio
+async def test_cluster_total_follows_heartbeats_and_prunes_stale_workers():
+    """The total is kept by the heartbeat script, a worker that stops beating is pruned with its connections."""
+    server = fakeredis.FakeServer()
+    client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+    first = WorkerRegistry(client, worker_id="host:1", stale_after=15)
+    second = WorkerRegistry(client, worker_id="host:2", stale_after=15)
+
+    assert await first.total_connections() == 0
+    assert await first.heartbeat(3) == 3
+    assert await second.heartbeat(4) == 7
+    assert await first.heartbeat(1) == 5
+    assert await second.workers() == {"host:1": 1, "host:2": 4}
+    assert first.live_workers == 2
+    assert await second.heartbeat(4, load=0.25) == 5
+    assert (await second.loads())["host:2"] == 0.25
+
+    # with stale_after=0 every other worker is already stale from host:2's point of view
+    second.stale_after = 0
+    assert await second.heartbeat(4) == 4
+    assert await second.workers() == {"host:2": 4}
+    assert await client.zrange(WorkerRegistry.workers_key, 0, -1) == ["host:2"]
+
+    assert await second.deregister() == 0
+    assert await second.total_connections() == 0